@@ -0,0 +1,246 @@
+"""
+Offline load test of the monitoring pipeline.
+
+Starts local stand-ins for every provider, tracks thousands of transactions through Coin.track, produces blocks on a
+schedule and runs the monitor until every watch has been notified through a fake Discord channel.
+
+Usage: python -m benchmarks.load_test --watches 10000 --coins BTC,LTC,ETH
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+from statistics import median, quantiles
+from time import monotonic
+
+from benchmarks.standins import (SimulatedChain, StandInServer, esplora_server, ethereum_server, rawtx_server,
+                                 ticker_server)
+
+
+class FakeUser:
+    def __init__(self, id: int):
+        self.id = id
+
+
+class FakeContext:
+
+    def __init__(self, user_id: int, channel_id: int):
+        """
+        Stands in for the slash command context passed to Coin.track.
+        :param user_id: The ID of the user running the command.
+        :param channel_id: The ID of the channel the command was run in.
+        """
+        self.user = FakeUser(user_id)
+        self.channel_id = channel_id
+        self.responses = 0
+
+    async def send(self, *args, **kwargs):
+        self.responses += 1
+
+
+class FakeChannel:
+
+    def __init__(self, sink: dict[int, float]):
+        """
+        Stands in for a Discord channel, recording when every mentioned user was notified.
+        :param sink: The monotonic time every user was notified at, keyed by user ID.
+        """
+        self.sink = sink
+        self.messages = 0
+
+    async def send(self, content: str = None, embeds: list = None, **kwargs):
+        self.messages += 1
+        now = monotonic()
+        for user_id in re.findall(r"<@(\d+)>", content or ""):
+            self.sink.setdefault(int(user_id), now)
+
+
+def percentile(values: list[float], p: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0
+    return quantiles(values, n=100)[p - 1]
+
+
+async def run(args: argparse.Namespace):
+    symbols = [symbol.strip().upper() for symbol in args.coins.split(",")]
+    injection = {"latency": args.latency / 1000, "error_rate": args.error_rate, "rate_limit_rate": args.rate_limit_rate}
+
+    # Start the stand-ins and point the coins at them before anything reads the environment
+    chains = {symbol: SimulatedChain(height) for symbol, height in (("BTC", 800_000), ("LTC", 2_500_000),
+                                                                     ("ETH", 19_000_000))}
+    servers: dict[str, StandInServer] = {
+        "btc-esplora": esplora_server(chains["BTC"], **injection),
+        "btc-rawtx": rawtx_server(chains["BTC"], **injection),
+        "ltc-esplora": esplora_server(chains["LTC"], **injection),
+        "eth-rpc": ethereum_server(chains["ETH"], **injection),
+        "tickers": ticker_server(**injection),
+    }
+    urls = {name: await server.start() for name, server in servers.items()}
+    store_dir = tempfile.mkdtemp(prefix="cryptotracker-bench-")
+    os.environ.update({
+        "BTC_API_URL": urls["btc-esplora"] + "/api",
+        "BTC_RAWTX_URL": urls["btc-rawtx"],
+        "LTC_API_URL": urls["ltc-esplora"] + "/api",
+        "WEB3_HTTP_PROVIDER": urls["eth-rpc"] + "/",
+        "TICKER_API_URL": urls["tickers"],
+        "TX_STORE_PATH": os.path.join(store_dir, "transactions.db"),
+        "HTTP_RATE_LIMITS": ";".join(f"{url}={args.rate}:{args.rate}:{args.in_flight}" for url in urls.values()),
+    })
+    if args.block_events:
+        # Push new blocks over the websocket feeds of the stand-ins, polling stays as the fallback
+        os.environ.update({
+            "BTC_BLOCK_FEED_URL": urls["btc-esplora"].replace("http://", "ws://", 1) + "/api/v1/ws",
+            "LTC_BLOCK_FEED_URL": urls["ltc-esplora"].replace("http://", "ws://", 1) + "/api/v1/ws",
+            "WEB3_WS_PROVIDER": urls["eth-rpc"].replace("http://", "ws://", 1) + "/",
+        })
+
+    import crypto
+    from crypto.base import CoinSymbol
+    from helpers import notifier as notifier_module
+    from helpers.shared import tx_registry
+    from helpers.events import block_feeds, start_block_feeds
+    from helpers.tasks import flush_task, monitor_task, on_block
+
+    coin_classes = {"BTC": crypto.Bitcoin, "LTC": crypto.Litecoin, "ETH": crypto.Ethereum}
+    coins = {symbol: coin_classes[symbol]() for symbol in symbols}
+    for coin in coins.values():
+        # Scale the polling cadence to the simulated block interval
+        coin.block_time = args.block_interval
+
+    # Replace Discord with a sink recording when every user was notified
+    notified: dict[int, float] = {}
+    channels: dict[int, FakeChannel] = {}
+    notifier_module.bot.get_channel = lambda channel_id: channels.setdefault(channel_id, FakeChannel(notified))
+    notifier_module.notifier.channel_interval = 0
+    notifier_module.notifier.start()
+
+    # Track every transaction through the same path as /track
+    watches: dict[int, tuple[str, str, int]] = {}
+    for user_id in range(1, args.watches + 1):
+        symbol = symbols[user_id % len(symbols)]
+        txid = ("0x" if symbol == "ETH" else "") + random.randbytes(32).hex()
+        chains[symbol].add_tx(txid)
+        confirmations = random.randint(1, min(args.confirmations, coins[symbol].max_confirmations))
+        watches[user_id] = (symbol, txid, confirmations)
+
+    semaphore = asyncio.Semaphore(args.in_flight * len(servers))
+
+    async def track(user_id: int):
+        symbol, txid, confirmations = watches[user_id]
+        async with semaphore:
+            await coins[symbol].track(FakeContext(user_id, user_id % args.channels), txid, confirmations)
+
+    track_started_at = monotonic()
+    await asyncio.gather(*[track(user_id) for user_id in watches])
+    track_duration = monotonic() - track_started_at
+    track_requests = {name: server.requests for name, server in servers.items()}
+
+    pushed_blocks = 0
+
+    async def on_pushed_block(coin, height: int):
+        nonlocal pushed_blocks
+        pushed_blocks += 1
+        await on_block(coin, height)
+
+    if args.block_events:
+        start_block_feeds(list(coins.values()), on_pushed_block)
+        while not all(feed.connected for feed in block_feeds.values()):
+            await asyncio.sleep(0.05)
+
+    # Produce blocks on a schedule, mining part of every mempool
+    async def produce_blocks():
+        while True:
+            await asyncio.sleep(args.block_interval)
+            for chain in chains.values():
+                mempool = chain.mempool()
+                chain.mine(random.sample(mempool, int(len(mempool) * args.mine_fraction) or len(mempool)))
+
+    producer = asyncio.create_task(produce_blocks())
+    cycle_durations = []
+    started_at = monotonic()
+    while len(notified) < len(watches) and monotonic() - started_at < args.duration:
+        cycle_started_at = monotonic()
+        await monitor_task()
+        cycle_durations.append(monotonic() - cycle_started_at)
+        await flush_task()
+        await asyncio.sleep(args.tick)
+    producer.cancel()
+    for feed in block_feeds.values():
+        feed.stop()
+
+    # Give the dispatcher a moment to send what is still queued
+    await asyncio.sleep(0.5)
+    monitor_duration = monotonic() - started_at
+
+    delays = []
+    for user_id, sent_at in notified.items():
+        symbol, txid, confirmations = watches[user_id]
+        chain = chains[symbol]
+        target_height = chain.txs[txid] + confirmations - 1
+        delays.append(sent_at - chain.block_times[target_height])
+
+    monitor_requests = {name: server.requests - track_requests[name] for name, server in servers.items()}
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    for server in servers.values():
+        await server.stop()
+
+    return {
+        "watches": len(watches),
+        "notified": len(notified),
+        "still tracked": len(tx_registry),
+        "messages": sum(channel.messages for channel in channels.values()),
+        "track duration (s)": track_duration,
+        "track requests per watch": sum(track_requests.values()) / len(watches),
+        "monitor duration (s)": monitor_duration,
+        "monitor cycles": len(cycle_durations),
+        "cycle time p50 (ms)": median(cycle_durations) * 1000,
+        "cycle time p95 (ms)": percentile(cycle_durations, 95) * 1000,
+        "cycle time max (ms)": max(cycle_durations) * 1000,
+        "monitor requests per watch": sum(monitor_requests.values()) / len(watches),
+        "requests by provider": monitor_requests,
+        "injected errors": sum(server.errors for server in servers.values()),
+        "blocks pushed": pushed_blocks if args.block_events else None,
+        "block to notification p50 (s)": median(delays) if delays else None,
+        "block to notification p95 (s)": percentile(delays, 95) if delays else None,
+        "block to notification max (s)": max(delays) if delays else None,
+        "peak memory (MB)": peak_memory,
+        "symbols": [CoinSymbol(symbol).name for symbol in symbols],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the transaction monitor.")
+    parser.add_argument("--watches", type=int, default=10_000, help="number of transactions to track")
+    parser.add_argument("--coins", default="BTC,LTC,ETH", help="comma-separated coins to track")
+    parser.add_argument("--confirmations", type=int, default=3, help="maximum confirmations required per watch")
+    parser.add_argument("--channels", type=int, default=100, help="number of Discord channels watches are spread over")
+    parser.add_argument("--block-interval", type=float, default=3, help="seconds between simulated blocks")
+    parser.add_argument("--mine-fraction", type=float, default=0.5, help="fraction of the mempool mined per block")
+    parser.add_argument("--tick", type=float, default=0.5, help="seconds between monitor runs")
+    parser.add_argument("--duration", type=float, default=120, help="maximum seconds to run the monitor for")
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds added to every provider response")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of provider responses that are 500s")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="fraction of provider responses that are 429s")
+    parser.add_argument("--rate", type=float, default=2_000, help="requests per second allowed per provider")
+    parser.add_argument("--in-flight", type=int, default=50, help="concurrent requests allowed per provider")
+    parser.add_argument("--block-events", action="store_true", help="push new blocks over websocket block feeds")
+    args = parser.parse_args()
+
+    # Keep the per-transaction log lines out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = asyncio.run(run(args))
+
+    for name, value in results.items():
+        print(f"{name:>32}: {value:,.2f}" if isinstance(value, float) else f"{name:>32}: {value}")
+    return 0 if results["notified"] == results["watches"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+Memory benchmark of the tracked transaction registry.
+
+Fills the registry and the confirmation scheduler with pending watches the same way /track does, spread over every
+coin, and reports the memory they hold.
+
+Usage: python -m benchmarks.memory --watches 1000000
+"""
+import argparse
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory benchmark of the tracked transaction registry.")
+    parser.add_argument("--watches", type=int, default=1_000_000, help="number of pending watches to hold")
+    parser.add_argument("--mined", type=float, default=0.5, help="fraction of the watches already mined")
+    parser.add_argument("--channels", type=int, default=10_000, help="number of Discord channels used")
+    args = parser.parse_args()
+
+    import crypto
+    from helpers.registry import TransactionRegistry
+    from helpers.scheduler import ConfirmationScheduler
+    from helpers.transaction import Transaction
+
+    coins = [crypto.Bitcoin(), crypto.Litecoin(), crypto.Ethereum()]
+    tips = {"BTC": 800_000, "LTC": 2_500_000, "ETH": 19_000_000}
+    random.seed(0)
+
+    tracemalloc.start()
+    registry = TransactionRegistry()
+    scheduler = ConfirmationScheduler()
+    started_at = perf_counter()
+    for watch_id in range(1, args.watches + 1):
+        coin = coins[watch_id % len(coins)]
+        txid = coin.decode_txid(random.randbytes(32))
+        block_height = tips[coin.symbol.name] - random.randrange(3) if random.random() < args.mined else None
+        tx = Transaction(coin, txid, random.getrandbits(62), random.randrange(args.channels) + 10 ** 17,
+                         random.randrange(10 ** 9), random.randint(1, coin.max_confirmations), block_height)
+        tx.watch_id = watch_id
+        registry.add(tx)
+        if block_height is not None:
+            scheduler.schedule(tx)
+    fill_duration = perf_counter() - started_at
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started_at = perf_counter()
+    due = sum(len(watchers) for coin in coins for watchers in registry.due_for_poll(coin.symbol, None))
+    scan_duration = perf_counter() - started_at
+
+    print(f"{'watches':>24}: {len(registry):,}")
+    print(f"{'scheduled':>24}: {len(scheduler):,}")
+    print(f"{'memory held (MB)':>24}: {held / 1e6:,.2f}")
+    print(f"{'peak memory (MB)':>24}: {peak / 1e6:,.2f}")
+    print(f"{'bytes per watch':>24}: {held / args.watches:,.1f}")
+    print(f"{'fill time (s)':>24}: {fill_duration:,.2f}")
+    print(f"{'poll scan time (ms)':>24}: {scan_duration * 1000:,.2f} ({due:,} due)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
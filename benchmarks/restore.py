@@ -0,0 +1,68 @@
+"""
+Restore benchmark of the tracked transactions.
+
+Fills a store with pending watches spread over every coin, then restores them the way the bot does on startup and
+reports the time it took. Exits with an error if the restore takes longer than the target.
+
+Usage: python -m benchmarks.restore --watches 100000 --target 1
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Restore benchmark of the tracked transactions.")
+    parser.add_argument("--watches", type=int, default=100_000, help="number of stored watches to restore")
+    parser.add_argument("--mined", type=float, default=0.5, help="fraction of the watches already mined")
+    parser.add_argument("--channels", type=int, default=10_000, help="number of Discord channels used")
+    parser.add_argument("--target", type=float, default=1, help="maximum number of seconds the restore may take")
+    args = parser.parse_args()
+
+    import crypto
+    from helpers import shared
+    from helpers.registry import TransactionRegistry
+    from helpers.scheduler import ConfirmationScheduler
+    from helpers.store import TransactionStore
+    from helpers.transaction import Transaction
+
+    coins = {coin.symbol: coin for coin in (crypto.Bitcoin(), crypto.Litecoin(), crypto.Ethereum())}
+    tips = {"BTC": 800_000, "LTC": 2_500_000, "ETH": 19_000_000}
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "transactions.db")
+        store = TransactionStore(path)
+        for watch_id in range(1, args.watches + 1):
+            coin = list(coins.values())[watch_id % len(coins)]
+            txid = coin.decode_txid(random.randbytes(32))
+            block_height = tips[coin.symbol.name] - random.randrange(3) if random.random() < args.mined else None
+            tx = Transaction(coin, txid, random.getrandbits(62), random.randrange(args.channels) + 10 ** 17,
+                             random.randrange(10 ** 9), random.randint(1, coin.max_confirmations), block_height)
+            tx.watch_id = watch_id
+            store.save(tx)
+        store.flush(store.take_pending())
+
+        # Restore into a fresh store connection, registry and scheduler, like a restarted bot
+        shared.tx_store = TransactionStore(path)
+        shared.tx_registry = TransactionRegistry()
+        shared.confirmation_scheduler = ConfirmationScheduler()
+        started_at = perf_counter()
+        asyncio.run(shared.load_transactions(coins))
+        duration = perf_counter() - started_at
+
+    print(f"{'watches':>24}: {len(shared.tx_registry):,}")
+    print(f"{'scheduled':>24}: {len(shared.confirmation_scheduler):,}")
+    print(f"{'restore time (s)':>24}: {duration:,.2f}")
+    if duration > args.target:
+        print(f"[!] Restoring {args.watches:,} watches took {duration:,.2f}s, over the {args.target:,.2f}s target")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,397 @@
+import asyncio
+import hashlib
+import json
+import random
+from time import monotonic
+from typing import Callable
+
+from aiohttp import WSMsgType, web
+
+
+class SimulatedChain:
+
+    def __init__(self, height: int):
+        """
+        Represents a blockchain whose blocks are produced on demand.
+        :param height: The height of the chain tip to start at.
+        """
+        self.height = height
+        # The monotonic time every block was produced at, used to measure notification delays
+        self.block_times: dict[int, float] = {height: monotonic()}
+        # The block height of every known transaction, or None while it is in the mempool
+        self.txs: dict[str, int | None] = {}
+        # The recipient addresses of the transactions that have any
+        self.recipients: dict[str, list[str]] = {}
+        # The hash of every block, which changes when a reorg replaces the block
+        self._reorgs = 0
+        self.block_hashes: dict[int, str] = {height: self._make_hash(height)}
+        # Called with the height of every new block, used by the block feed stand-ins
+        self.listeners: list[Callable[[int], None]] = []
+
+    def _make_hash(self, height: int) -> str:
+        return hashlib.sha256(f"{height}:{self._reorgs}".encode()).hexdigest()
+
+    def get_block(self, height: int) -> dict:
+        """
+        Builds the header of a block.
+        :param height: The height of the block.
+        :return: The height, hash and previous block hash of the block.
+        """
+        return {
+            "height": height,
+            "hash": self.block_hashes[height],
+            "previous_hash": self.block_hashes.get(height - 1, "0" * 64)
+        }
+
+    def add_tx(self, txid: str, block_height: int | None = None, recipients: list[str] = ()):
+        """
+        Adds a transaction to the chain.
+        :param txid: The transaction ID.
+        :param block_height: The height of the block the transaction was mined in, or None to add it to the mempool.
+        :param recipients: The addresses the transaction sends to.
+        """
+        self.txs[txid] = block_height
+        if recipients:
+            self.recipients[txid] = list(recipients)
+
+    def get_block_txs(self, height: int) -> list[str]:
+        """
+        Retrieves the transactions of a block.
+        :param height: The height of the block.
+        :return: The IDs of the transactions mined in the block.
+        """
+        return [txid for txid, block_height in self.txs.items() if block_height == height]
+
+    def mempool(self) -> list[str]:
+        """
+        Retrieves the transactions that haven't been mined yet.
+        :return: The IDs of the unconfirmed transactions.
+        """
+        return [txid for txid, height in self.txs.items() if height is None]
+
+    def mine(self, txids: list[str] = ()) -> int:
+        """
+        Produces a new block.
+        :param txids: The IDs of the mempool transactions to include in the block.
+        :return: The height of the new block.
+        """
+        self.height += 1
+        self.block_times[self.height] = monotonic()
+        self.block_hashes[self.height] = self._make_hash(self.height)
+        for txid in txids:
+            self.txs[txid] = self.height
+        for listener in self.listeners:
+            listener(self.height)
+        return self.height
+
+    def reorg(self, depth: int) -> list[str]:
+        """
+        Replaces the latest blocks with other blocks of the same heights, returning their transactions to the mempool.
+        :param depth: The number of blocks replaced.
+        :return: The IDs of the transactions of the replaced blocks.
+        """
+        fork_height = self.height - depth + 1
+        self._reorgs += 1
+        for height in range(fork_height, self.height + 1):
+            self.block_hashes[height] = self._make_hash(height)
+        orphaned = [txid for txid, height in self.txs.items() if height is not None and height >= fork_height]
+        for txid in orphaned:
+            self.txs[txid] = None
+        return orphaned
+
+
+class StandInServer:
+
+    def __init__(self, name: str, latency: float = 0, error_rate: float = 0, rate_limit_rate: float = 0):
+        """
+        Serves a provider API locally, with injected latency and errors.
+        :param name: The name of the provider, used in reports.
+        :param latency: The number of seconds every response is delayed by.
+        :param error_rate: The fraction of requests answered with a 500 error.
+        :param rate_limit_rate: The fraction of requests answered with a 429 error and a Retry-After header.
+        """
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests = 0
+        self.errors = 0
+        self.app = web.Application(middlewares=[self._inject])
+        self._runner: web.AppRunner | None = None
+        self.url: str | None = None
+
+    @web.middleware
+    async def _inject(self, request: web.Request, handler):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            self.errors += 1
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.errors += 1
+            return web.Response(status=500)
+        return await handler(request)
+
+    async def start(self) -> str:
+        """
+        Starts the server on a free local port.
+        :return: The base URL of the server.
+        """
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        """
+        Stops the server.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def _serve_block_feed(
+        request: web.Request,
+        chain: SimulatedChain,
+        subscribe: Callable[[dict], str | None],
+        encode: Callable[[int], str]
+) -> web.WebSocketResponse:
+    """
+    Pushes every new block of a chain over a websocket, once the client subscribed.
+    :param request: The websocket upgrade request.
+    :param chain: The chain whose blocks are pushed.
+    :param subscribe: Builds the reply to the subscription message, or returns None if no reply is expected.
+    :param encode: Builds the message pushed for the block at a height.
+    :return: The websocket response, once the client disconnected.
+    """
+    websocket = web.WebSocketResponse()
+    await websocket.prepare(request)
+    heights: asyncio.Queue[int] = asyncio.Queue()
+
+    async def push():
+        while True:
+            await websocket.send_str(encode(await heights.get()))
+
+    pusher = None
+    try:
+        async for message in websocket:
+            if message.type != WSMsgType.TEXT or pusher is not None:
+                continue
+            reply = subscribe(json.loads(message.data))
+            if reply is not None:
+                await websocket.send_str(reply)
+            chain.listeners.append(heights.put_nowait)
+            pusher = asyncio.create_task(push())
+    finally:
+        if pusher is not None:
+            pusher.cancel()
+            chain.listeners.remove(heights.put_nowait)
+    return websocket
+
+
+def esplora_server(chain: SimulatedChain, **kwargs) -> StandInServer:
+    """
+    Creates a stand-in for an esplora API such as mempool.space or litecoinspace.org, mounted under /api, with the
+    websocket block feed of mempool.space at /api/v1/ws.
+    :param chain: The chain served.
+    :param kwargs: The latency and error injection options of the server.
+    :return: The stand-in server.
+    """
+    server = StandInServer("esplora", **kwargs)
+
+    def get_status(txid: str):
+        height = chain.txs[txid]
+        if height is None:
+            return {"confirmed": False}
+        return {"confirmed": True, "block_height": height, "block_hash": chain.block_hashes[height]}
+
+    async def tip_height(_: web.Request):
+        return web.Response(text=str(chain.height))
+
+    async def blocks(request: web.Request):
+        # Up to 10 blocks, from the given height down
+        start_height = min(int(request.match_info["height"]), chain.height)
+        heights = [height for height in range(start_height, start_height - 10, -1) if height in chain.block_hashes]
+        return web.json_response([
+            {"id": block["hash"], "height": block["height"], "previousblockhash": block["previous_hash"]}
+            for block in map(chain.get_block, heights)
+        ])
+
+    def get_height(block_hash: str) -> int | None:
+        return next((height for height, known_hash in chain.block_hashes.items() if known_hash == block_hash), None)
+
+    async def block_height(request: web.Request):
+        height = int(request.match_info["height"])
+        if height not in chain.block_hashes:
+            return web.Response(status=404, text="Block not found")
+        return web.Response(text=chain.block_hashes[height])
+
+    async def block(request: web.Request):
+        height = get_height(request.match_info["hash"])
+        if height is None:
+            return web.Response(status=404, text="Block not found")
+        return web.json_response({
+            "id": chain.block_hashes[height], "height": height, "tx_count": len(chain.get_block_txs(height))
+        })
+
+    async def block_txs(request: web.Request):
+        height = get_height(request.match_info["hash"])
+        if height is None:
+            return web.Response(status=404, text="Block not found")
+        start = int(request.match_info["start"])
+        return web.json_response([
+            {
+                "txid": txid, "fee": 1_000,
+                "vout": [{"scriptpubkey_address": address} for address in chain.recipients.get(txid, ())]
+            }
+            for txid in chain.get_block_txs(height)[start:start + 25]
+        ])
+
+    async def tx(request: web.Request):
+        txid = request.match_info["txid"]
+        if txid not in chain.txs:
+            return web.Response(status=404, text="Transaction not found")
+        return web.json_response({
+            "txid": txid, "status": get_status(txid), "fee": 1_000, "size": 225, "weight": 900,
+            "vin": [{"txid": "0" * 64, "vout": 0}], "vout": [{"value": 10_000, "scriptpubkey_address": "addr"}]
+        })
+
+    async def tx_status(request: web.Request):
+        txid = request.match_info["txid"]
+        if txid not in chain.txs:
+            return web.Response(status=404, text="Transaction not found")
+        return web.json_response(get_status(txid))
+
+    async def mempool(_: web.Request):
+        # Every stand-in transaction has the same size and fee, so the mempool is a single fee range
+        count = sum(1 for height in chain.txs.values() if height is None)
+        return web.json_response({
+            "count": count, "vsize": count * 225, "total_fee": count * 1_000,
+            "fee_histogram": [[1_000 / 225, count * 225]] if count else []
+        })
+
+    server.app.router.add_get("/api/v1/blocks/tip/height", tip_height)
+    server.app.router.add_get("/api/blocks/tip/height", tip_height)
+    server.app.router.add_get("/api/tx/{txid}", tx)
+    server.app.router.add_get("/api/tx/{txid}/status", tx_status)
+    server.app.router.add_get("/api/mempool", mempool)
+    # The websocket API of mempool.space, pushing new blocks once "blocks" are wanted
+    server.app.router.add_get("/api/v1/ws", lambda request: _serve_block_feed(
+        request, chain, lambda _: None,
+        lambda height: json.dumps({"block": {"id": chain.block_hashes[height], "height": height}})
+    ))
+    server.app.router.add_get("/api/blocks/{height}", blocks)
+    server.app.router.add_get("/api/block-height/{height}", block_height)
+    server.app.router.add_get("/api/block/{hash}", block)
+    server.app.router.add_get("/api/block/{hash}/txs/{start}", block_txs)
+    return server
+
+
+def rawtx_server(chain: SimulatedChain, **kwargs) -> StandInServer:
+    """
+    Creates a stand-in for the blockchain.info raw transaction API.
+    :param chain: The chain served.
+    :param kwargs: The latency and error injection options of the server.
+    :return: The stand-in server.
+    """
+    server = StandInServer("blockchain.info", **kwargs)
+
+    async def rawtx(request: web.Request):
+        txid = request.match_info["txid"]
+        if txid not in chain.txs:
+            return web.Response(status=404, text="Transaction not found")
+        return web.json_response({
+            "hash": txid, "block_height": chain.txs[txid], "fee": 1_000, "size": 225, "weight": 900,
+            "double_spend": False, "time": 1_700_000_000,
+            "inputs": [{"prev_out": {"value": 11_000}}], "out": [{"value": 10_000}]
+        })
+
+    server.app.router.add_get("/rawtx/{txid}", rawtx)
+    return server
+
+
+def ticker_server(**kwargs) -> StandInServer:
+    """
+    Creates a stand-in for the blockchain.com exchange ticker API.
+    :param kwargs: The latency and error injection options of the server.
+    :return: The stand-in server.
+    """
+    server = StandInServer("tickers", **kwargs)
+
+    async def tickers(_: web.Request):
+        return web.json_response([
+            {"symbol": "BTC-USD", "last_trade_price": 60_000.0},
+            {"symbol": "LTC-USD", "last_trade_price": 80.0},
+            {"symbol": "ETH-USD", "last_trade_price": 3_000.0}
+        ])
+
+    server.app.router.add_get("/v3/exchange/tickers", tickers)
+    return server
+
+
+def ethereum_server(chain: SimulatedChain, **kwargs) -> StandInServer:
+    """
+    Creates a stand-in for an Ethereum JSON-RPC node, supporting batch requests and newHeads subscriptions over a
+    websocket on the same URL.
+    :param chain: The chain served.
+    :param kwargs: The latency and error injection options of the server.
+    :return: The stand-in server.
+    """
+    server = StandInServer("ethereum", **kwargs)
+
+    def call(payload: dict) -> dict:
+        method, params = payload["method"], payload.get("params", [])
+        result = None
+        if method == "eth_blockNumber":
+            result = hex(chain.height)
+        elif method == "eth_chainId":
+            result = "0x1"
+        elif method == "eth_getBlockByNumber" and int(params[0], 16) in chain.block_hashes:
+            block = chain.get_block(int(params[0], 16))
+            result = {"number": hex(block["height"]), "hash": block["hash"], "parentHash": block["previous_hash"]}
+            if params[1]:
+                result["transactions"] = [
+                    {"hash": txid, "gasPrice": hex(30 * 10 ** 9), "to": chain.recipients.get(txid, [None])[0]}
+                    for txid in chain.get_block_txs(block["height"])
+                ]
+        elif method in ("eth_getTransactionByHash", "eth_getTransactionReceipt") and params[0] in chain.txs:
+            height = chain.txs[params[0]]
+            if method == "eth_getTransactionByHash":
+                result = {
+                    "hash": params[0], "blockNumber": hex(height) if height is not None else None,
+                    "blockHash": chain.block_hashes[height] if height is not None else None, "gas": hex(21_000),
+                    "gasPrice": hex(30 * 10 ** 9), "value": hex(10 ** 18), "nonce": "0x1",
+                    "from": "0x" + "1" * 40, "to": "0x" + "2" * 40
+                }
+            elif height is not None:
+                result = {
+                    "transactionHash": params[0], "blockNumber": hex(height), "gasUsed": hex(21_000),
+                    "effectiveGasPrice": hex(25 * 10 ** 9), "status": "0x1"
+                }
+        return {"jsonrpc": "2.0", "id": payload.get("id"), "result": result}
+
+    async def rpc(request: web.Request):
+        payload = json.loads(await request.read())
+        if isinstance(payload, list):
+            return web.json_response([call(item) for item in payload])
+        return web.json_response(call(payload))
+
+    def encode_head(height: int) -> str:
+        block = chain.get_block(height)
+        head = {"number": hex(height), "hash": block["hash"], "parentHash": block["previous_hash"]}
+        return json.dumps({
+            "jsonrpc": "2.0", "method": "eth_subscription", "params": {"subscription": "0x1", "result": head}
+        })
+
+    server.app.router.add_post("/", rpc)
+    # Websocket clients subscribe to new heads with eth_subscribe
+    server.app.router.add_get("/", lambda request: _serve_block_feed(
+        request, chain, lambda payload: json.dumps({"jsonrpc": "2.0", "id": payload.get("id"), "result": "0x1"}),
+        encode_head
+    ))
+    return server
@@ -0,0 +1,71 @@
+"""
+Cold start benchmark of the bot and the monitor worker.
+
+Imports each entry point in a fresh interpreter, the way a restart or a new worker does, and reports the time until
+it is ready to connect, its peak memory and the modules that took the longest to import.
+
+Usage: python -m benchmarks.startup --runs 5
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+# Prints the peak resident memory of the interpreter, in KiB on Linux
+_RSS_SNIPPET = "import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def measure(module: str) -> tuple[float, int]:
+    """
+    Imports a module in a fresh interpreter.
+    :param module: The name of the module to import.
+    :return: The number of seconds until the import finished and the peak memory in KiB.
+    """
+    started_at = perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", f"import {module}; {_RSS_SNIPPET}"],
+        capture_output=True, text=True, check=True, env=os.environ | {"PYTHONDONTWRITEBYTECODE": "1"}
+    )
+    return perf_counter() - started_at, int(result.stdout.strip().splitlines()[-1])
+
+
+def get_slowest_imports(module: str, count: int) -> list[tuple[int, str]]:
+    """
+    Imports a module with -X importtime and keeps the slowest imports.
+    :param module: The name of the module to import.
+    :param count: The number of imports kept.
+    :return: The cumulative import time in microseconds and the name of each of the slowest imports.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s*(.+)$", line)
+        if match:
+            imports.append((int(match.group(1)), match.group(2).strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark of the bot and the monitor worker.")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters per entry point")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports listed per entry point")
+    parser.add_argument("modules", nargs="*", default=["crypto", "main", "worker"], help="entry points to import")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        # Warm the bytecode and filesystem caches once, so every run measures the same thing
+        measure(module)
+        durations, peaks = zip(*[measure(module) for _ in range(args.runs)])
+        print(f"[*] {module}: {statistics.median(durations) * 1000:,.0f}ms median "
+              f"({min(durations) * 1000:,.0f}-{max(durations) * 1000:,.0f}ms) | {max(peaks) / 1024:,.1f} MiB peak")
+        for duration, name in get_slowest_imports(module, args.top):
+            print(f"    {duration / 1000:8,.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,88 @@
-from .bitcoin import Bitcoin
-from .litecoin import Litecoin
-from .ethereum import Ethereum
+import importlib
+import os
+import threading
+from collections.abc import Iterator, Mapping
+
+from .base import Coin, CoinSymbol
+
+# The module, class and display name of every supported coin, so coins can be listed without importing their modules
+_COINS: dict[CoinSymbol, tuple[str, str, str]] = {
+    CoinSymbol.BTC: ("crypto.bitcoin", "Bitcoin", "Bitcoin"),
+    CoinSymbol.LTC: ("crypto.litecoin", "Litecoin", "Litecoin"),
+    CoinSymbol.ETH: ("crypto.ethereum", "Ethereum", "Ethereum"),
+}
+
+# The environment variables a coin can't work without
+_REQUIRED_ENV: dict[CoinSymbol, str] = {
+    CoinSymbol.ETH: "WEB3_HTTP_PROVIDER",
+}
+
+
+def __getattr__(name: str):
+    # Coin classes are imported on first access, e.g. crypto.Bitcoin
+    for module, class_name, _ in _COINS.values():
+        if class_name == name:
+            return getattr(importlib.import_module(module), class_name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class CoinRegistry(Mapping):
+
+    def __init__(self, symbols: list[CoinSymbol]):
+        """
+        Holds the enabled coins, keyed by symbol. The module of a coin is only imported and the coin only created
+        when it is first used, so the bot connects to the gateway without waiting on every provider library.
+        :param symbols: The symbols of the enabled coins, in display order.
+        """
+        self.symbols = symbols
+        self._coins: dict[CoinSymbol, Coin] = {}
+        # Coins can be loaded from a background thread while commands use them
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "CoinRegistry":
+        """
+        Enables the coins listed in ENABLED_COINS, e.g. "BTC,LTC", or every supported coin if it isn't set.
+        Coins missing a required environment variable are left out.
+        :return: The registry of the enabled coins.
+        """
+        symbols = []
+        for value in os.getenv("ENABLED_COINS", ",".join(_COINS)).split(","):
+            symbol = CoinSymbol(value.strip().upper())
+            variable = _REQUIRED_ENV.get(symbol)
+            if variable is not None and not os.getenv(variable):
+                print(f"[!] {symbol.name} is disabled because {variable} is not set")
+                continue
+            symbols.append(symbol)
+        return cls(symbols)
+
+    def get_name(self, symbol: CoinSymbol) -> str:
+        """
+        Retrieves the display name of a coin without loading it.
+        :param symbol: The symbol of the coin.
+        :return: The name of the coin.
+        """
+        return _COINS[symbol][2]
+
+    def __getitem__(self, symbol: CoinSymbol | str) -> Coin:
+        try:
+            symbol = CoinSymbol(symbol)
+        except ValueError:
+            raise KeyError(symbol) from None
+        if symbol not in self.symbols:
+            raise KeyError(symbol)
+
+        coin = self._coins.get(symbol)
+        if coin is None:
+            with self._lock:
+                coin = self._coins.get(symbol)
+                if coin is None:
+                    module, class_name, _ = _COINS[symbol]
+                    coin = self._coins[symbol] = getattr(importlib.import_module(module), class_name)()
+        return coin
+
+    def __iter__(self) -> Iterator[CoinSymbol]:
+        return iter(self.symbols)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
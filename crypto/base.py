@@ -1,11 +1,19 @@
+import asyncio
+import json
 import re
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import TypedDict
+from typing import TYPE_CHECKING, TypedDict
 
-import httpx
-from cachetools import cached, TTLCache
-from interactions import SlashContext
+from interactions import EmbedField, SlashContext
+
+from helpers.mempool import mempool_snapshots
+from helpers.prices import prices
+from helpers.tips import chain_tips
+from helpers.txcache import tx_cache
+
+if TYPE_CHECKING:
+    from helpers.transaction import Transaction
 
 FeeDenomination = TypedDict("FeeDenomination", {"name": str, "decimal_digits": int, "conversion_rate": float})
 
@@ -23,21 +31,32 @@ class Coin(ABC):
             name: str,
             symbol: CoinSymbol,
             max_confirmations: int,
+            block_time: int,
             txid_pattern: str,
             emoji: str,
             explorer_url: str,
             fee_denomination: FeeDenomination,
+            block_feed_url: str | None = None,
+            address_pattern: str | None = None
     ):
         self.name = name
         self.symbol = symbol
+        # A small integer identifying the coin in compact transaction records
+        self.index = list(CoinSymbol).index(symbol)
         self.max_confirmations = max_confirmations
+        # The average number of seconds between blocks
+        self.block_time = block_time
         self.txid_pattern = re.compile(txid_pattern)
         self.emoji = emoji
         self.explorer_url = explorer_url
         self.fee_denomination = fee_denomination
+        # The websocket URL pushing new blocks of the cryptocurrency, if it has one
+        self.block_feed_url = block_feed_url
+        # Matches the addresses that can be watched, if the coin supports address watching
+        self.address_pattern = re.compile(address_pattern) if address_pattern else None
 
     @abstractmethod
-    def get_latest_block_height(self):
+    async def get_latest_block_height(self):
         """
         Retrieves the latest block height of the cryptocurrency.
         :return: The latest block height of the cryptocurrency.
@@ -45,7 +64,7 @@ class Coin(ABC):
         raise NotImplementedError()
 
     @abstractmethod
-    def get_tx(self, txid: str):
+    async def get_tx(self, txid: str):
         """
         Retrieves the transaction with the given transaction ID.
         :param txid: The transaction ID.
@@ -53,6 +72,176 @@ class Coin(ABC):
         """
         raise NotImplementedError()
 
+    @abstractmethod
+    async def get_tx_data(self, txid: str):
+        """
+        Retrieves the parsed data of the transaction with the given transaction ID.
+        :param txid: The transaction ID.
+        :return: The parsed transaction data.
+        :raises Exception: If the transaction could not be retrieved.
+        """
+        raise NotImplementedError()
+
+    async def get_tx_data_batch(self, txids: list[str]) -> dict:
+        """
+        Retrieves the parsed data of several transactions. Coins whose provider supports batch requests override this
+        to look them all up in as few requests as possible.
+        :param txids: The transaction IDs.
+        :return: The parsed data of every transaction, or the exception raised while retrieving it, keyed by ID.
+        """
+        results = await asyncio.gather(*[self.get_tx_data(txid) for txid in txids], return_exceptions=True)
+        return dict(zip(txids, results))
+
+    async def get_cached_tx_data_batch(self, txids: list[str]) -> dict:
+        """
+        Retrieves the parsed data of several transactions like get_tx_data_batch, serving the deeply confirmed ones
+        from the transaction cache and caching the ones that became deeply confirmed.
+        :param txids: The transaction IDs.
+        :return: The parsed data of every transaction, or the exception raised while retrieving it, keyed by ID.
+        """
+        results = {txid: tx_cache.get(self, txid) for txid in txids}
+        missing = [txid for txid, data in results.items() if data is None]
+        if missing:
+            for txid, data in (await self.get_tx_data_batch(missing)).items():
+                if not isinstance(data, Exception):
+                    tx_cache.put(self, txid, data)
+                results[txid] = data
+        return results
+
+    async def get_tx_status(self, txid: str) -> int | None:
+        """
+        Retrieves only the block height of the transaction with the given transaction ID, which is all polling needs.
+        Defaults to retrieving the whole transaction; coins whose provider has a lighter status endpoint override this.
+        :param txid: The transaction ID.
+        :return: The block height of the transaction, or None if it hasn't been mined yet.
+        :raises Exception: If the transaction could not be retrieved.
+        """
+        return self.get_tx_block_height(await self.get_tx_data(txid))
+
+    async def get_tx_status_batch(self, txids: list[str]) -> dict:
+        """
+        Retrieves only the block heights of several transactions.
+        :param txids: The transaction IDs.
+        :return: The block height of every transaction, None if it hasn't been mined yet, or the exception raised while
+        retrieving it, keyed by ID.
+        """
+        results = await asyncio.gather(*[self.get_tx_status(txid) for txid in txids], return_exceptions=True)
+        return dict(zip(txids, results))
+
+    async def get_block_headers(self, start_height: int, end_height: int) -> list[tuple[int, str, str]]:
+        """
+        Retrieves the headers of a range of blocks, used to detect reorgs.
+        :param start_height: The height of the first block.
+        :param end_height: The height of the last block, included.
+        :return: The height, hash and previous block hash of every block, from the lowest height up.
+        :raises NotImplementedError: If the coin doesn't support block headers.
+        """
+        raise NotImplementedError()
+
+    async def get_block_recipients(self, height: int) -> list[tuple[str, int, list[str]]]:
+        """
+        Retrieves the recipients of every transaction of a block, used to match it against watched addresses.
+        :param height: The height of the block.
+        :return: The ID, fee and normalized recipient addresses of every transaction of the block.
+        :raises NotImplementedError: If the coin doesn't support address watching.
+        """
+        raise NotImplementedError()
+
+    async def get_mempool_histogram(self) -> list[tuple[float, int]]:
+        """
+        Retrieves the fee histogram of the mempool, used to estimate when unconfirmed transactions will be mined.
+        :return: The fee rate and virtual size of each range of the mempool.
+        :raises NotImplementedError: If the coin doesn't support mempool snapshots.
+        """
+        raise NotImplementedError()
+
+    def get_tx_vsize(self, data) -> int | None:
+        """
+        Extracts the virtual size from parsed transaction data.
+        :param data: The parsed transaction data.
+        :return: The virtual size of the transaction, or None if the coin doesn't price transactions by size.
+        """
+        return None
+
+    async def get_confirmation_eta(self, data) -> int | None:
+        """
+        Estimates in how many blocks an unconfirmed transaction will be mined from a shared snapshot of the mempool,
+        so it costs no request of its own once the snapshot is fetched.
+        :param data: The parsed transaction data.
+        :return: The estimated number of blocks, or None if the transaction is mined or no estimate is available.
+        """
+        vsize = self.get_tx_vsize(data)
+        if not vsize or self.get_tx_block_height(data):
+            return None
+        try:
+            return await mempool_snapshots.get_blocks_until_confirmed(self, self.get_tx_fee(data) / vsize)
+        except NotImplementedError:
+            return None
+        except Exception as e:
+            print(f"[!] Mempool snapshot failed (type: {self.symbol.name}) {e!r}")
+            return None
+
+    def normalize_address(self, address: str) -> str:
+        """
+        Converts an address into the form it has in blocks, so the same address is always matched.
+        :param address: The address entered by the user.
+        :return: The normalized address.
+        """
+        return address.strip()
+
+    @abstractmethod
+    def get_tx_fee(self, data) -> int:
+        """
+        Extracts the fee stored with a tracked transaction from parsed transaction data.
+        :param data: The parsed transaction data.
+        :return: The fee of the transaction.
+        """
+        raise NotImplementedError()
+
+    def compact_tx_data(self, data) -> dict:
+        """
+        Keeps the fields of parsed transaction data that tracking and notifications use, to cache them.
+        :param data: The parsed transaction data.
+        :return: The fields used, which can be serialized as JSON.
+        """
+        return dict(data)
+
+    def restore_tx_data(self, data: dict):
+        """
+        Rebuilds parsed transaction data from the fields kept by compact_tx_data.
+        :param data: The cached fields.
+        :return: The parsed transaction data.
+        """
+        return data
+
+    def get_tx_block_hash(self, data) -> str | None:
+        """
+        Extracts the hash of the block a transaction was mined in from parsed transaction data.
+        :param data: The parsed transaction data.
+        :return: The block hash, or None if the transaction hasn't been mined yet or its data doesn't include it.
+        """
+        return None
+
+    @abstractmethod
+    def get_tx_block_height(self, data) -> int | None:
+        """
+        Extracts the block height from parsed transaction data.
+        :param data: The parsed transaction data.
+        :return: The block height of the transaction, or None if it hasn't been mined yet.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_confirmed_fields(self, tx: "Transaction", data, current_confirmations: int) -> list[EmbedField]:
+        """
+        Builds the embed fields sent when a transaction reaches its required number of confirmations.
+        :param tx: The confirmed transaction.
+        :param data: The parsed transaction data.
+        :param current_confirmations: The number of confirmations the transaction has reached.
+        :return: The fields to add to the embed.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     async def track(self, ctx: SlashContext, txid: str, required_confirmations: int):
         """
@@ -63,25 +252,63 @@ class Coin(ABC):
         """
         raise NotImplementedError()
 
-    def get_current_confirmations(self, tx_block_height: int):
+    def get_block_feed_subscription(self) -> str:
+        """
+        Builds the message sent to the block feed to subscribe to new blocks.
+        Defaults to the websocket API of mempool.space and other esplora-based explorers.
+        :return: The subscription message.
+        """
+        return json.dumps({"action": "want", "data": ["blocks"]})
+
+    def parse_block_feed_message(self, message: str | bytes) -> int | None:
+        """
+        Extracts the height of a new block from a block feed message.
+        :param message: The message received from the block feed.
+        :return: The height of the new block, or None if the message isn't about a new block.
+        """
+        data = json.loads(message)
+        if data.get("block"):
+            return data["block"]["height"]
+        if data.get("blocks"):
+            return max(block["height"] for block in data["blocks"])
+        return None
+
+    async def get_current_confirmations(self, tx_block_height: int, allow_stale: bool = False):
         """
         Calculates the number of confirmations using the latest block height and the block height of the transaction.
+        The latest block height is shared between lookups, so it is only fetched once for every transaction checked.
         :param tx_block_height: The block height of the transaction.
+        :param allow_stale: Whether the stored block height is used however old it is, for transactions confirmed so
+        deeply that a few blocks don't matter.
         :return: The number of confirmations the transaction has reached.
         """
-        return max(0, self.get_latest_block_height() - tx_block_height + 1)
+        tip_height = chain_tips.peek(self.symbol) if allow_stale else None
+        if tip_height is None:
+            tip_height = await chain_tips.get_height(self)
+        return max(0, tip_height - tx_block_height + 1)
 
-    @cached(cache=TTLCache(maxsize=50, ttl=5))
-    def get_usd_rate(self) -> float:
+    async def get_usd_rate(self) -> float:
         """
         Retrieves the current USD price of the cryptocurrency.
+        Prices are kept in memory and refreshed in the background, so this rarely waits on the network.
         :return: The last trade price of the cryptocurrency in USD.
         """
-        ticker_symbol = self.symbol.name + "-USD"
-        r = httpx.get(f"https://api.blockchain.com/v3/exchange/tickers/{ticker_symbol}")
-        if not r.is_success:
-            raise Exception(f"Failed to retrieve current {ticker_symbol} price")
-        return r.json()["last_trade_price"]
+        return await prices.get_usd_rate(self.symbol.name)
+
+    def extract_txids(self, text: str) -> list[str]:
+        """
+        Extracts the transaction IDs from a list of IDs or explorer links, such as the contents of a CSV file.
+        :param text: The IDs or links, separated by whitespace, commas or semicolons.
+        :return: The distinct transaction IDs found, in the order they appear.
+        """
+        txids = {}
+        for token in re.split(r"[\s,;]+", text.lower()):
+            # Explorer links end with the transaction ID
+            token = token.strip("\"'").split("?")[0].split("#")[0].rstrip("/").rsplit("/", 1)[-1]
+            match = self.txid_pattern.search(token)
+            if match:
+                txids[match.group(0)] = None
+        return list(txids)
 
     def get_explorer_url(self, txid: str):
         """
@@ -91,6 +318,22 @@ class Coin(ABC):
         """
         return self.explorer_url.format(id=txid)
 
+    def encode_txid(self, txid: str) -> bytes:
+        """
+        Converts a transaction ID into the raw bytes stored in compact transaction records.
+        :param txid: The transaction ID.
+        :return: The 32 bytes of the transaction hash.
+        """
+        return bytes.fromhex(txid)
+
+    def decode_txid(self, raw_id: bytes) -> str:
+        """
+        Converts the raw bytes of a transaction hash back into a transaction ID.
+        :param raw_id: The 32 bytes of the transaction hash.
+        :return: The transaction ID.
+        """
+        return raw_id.hex()
+
     def get_formatted_url(self, txid: str):
         return f"[[view]]({self.get_explorer_url(txid)})"
 
@@ -104,13 +347,23 @@ class Coin(ABC):
             if current_confirmations > self.max_confirmations \
             else f"{current_confirmations}/{self.max_confirmations}"
 
-    def get_formatted_fee(self, tx_fee: int):
+    def get_formatted_eta(self, blocks: int):
+        """
+        Formats the estimated time until a transaction is mined for display.
+        :param blocks: The estimated number of blocks.
+        :return: The formatted estimate.
+        """
+        minutes = round(blocks * self.block_time / 60)
+        duration = f"{minutes:,} min" if minutes < 120 else f"{minutes / 60:,.1f} h"
+        return f"~{blocks:,} {'block' if blocks == 1 else 'blocks'} (~{duration})"
+
+    async def get_formatted_fee(self, tx_fee: int):
         """
         Formats the transaction fee for display.
         :param tx_fee: The transaction fee.
         :return: The formatted transaction fee.
         """
         tx_fee_display = f"{tx_fee:,.15f}".rstrip('0').rstrip('.')
-        usd_fee = self.get_usd_rate() * (tx_fee / self.fee_denomination["conversion_rate"])
+        usd_fee = await self.get_usd_rate() * (tx_fee / self.fee_denomination["conversion_rate"])
         return f"{tx_fee_display} {self.fee_denomination['name']} " \
                f"(${usd_fee:,.{self.fee_denomination['decimal_digits']}f})"
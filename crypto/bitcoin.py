@@ -1,54 +1,99 @@
-import httpx
+import os
+from time import time
+
 from interactions import SlashContext, EmbedField
 
 from helpers.embeds import send_invalid_tx_embed, send_tx_info_embed
+from helpers.metrics import timed
+from helpers.providers import ProviderPool
 from helpers.shared import queue_transaction
 from helpers.transaction import Transaction
-from .base import Coin, CoinSymbol, FeeDenomination
+from helpers.txcache import tx_cache
+from .base import CoinSymbol, FeeDenomination
+from .esplora import EsploraCoin
+
 
+class Bitcoin(EsploraCoin):
+    bech32_prefix = "bc1"
 
-class Bitcoin(Coin):
     def __init__(self):
         super(Bitcoin, self).__init__(
             name="Bitcoin",
             symbol=CoinSymbol.BTC,
             max_confirmations=6,
+            block_time=600,
             txid_pattern=r"[0-9a-f]{64}$",
             emoji="<:btc:1133213003655942145>",
             explorer_url="https://mempool.space/tx/{id}",
-            fee_denomination=FeeDenomination(name="sat", decimal_digits=2, conversion_rate=1e8)
+            fee_denomination=FeeDenomination(name="sat", decimal_digits=2, conversion_rate=1e8),
+            block_feed_url=os.getenv("BTC_BLOCK_FEED_URL", "wss://mempool.space/api/v1/ws"),
+            address_pattern=r"^(bc1[02-9ac-hj-np-z]{11,71}|[13][1-9A-HJ-NP-Za-km-z]{25,34})$"
         )
+        # Esplora-compatible APIs used for the chain tip and transaction statuses
+        self.api = ProviderPool.from_env(
+            "btc-esplora", "BTC_API_URL", "https://mempool.space/api,https://blockstream.info/api"
+        )
+        # blockchain.info-compatible APIs used for transactions
+        self.rawtx_api = ProviderPool.from_env("btc-rawtx", "BTC_RAWTX_URL", "https://blockchain.info")
 
-    def get_latest_block_height(self):
-        r = httpx.get("https://mempool.space/api/v1/blocks/tip/height")
-        if not r.is_success:
-            raise Exception("Failed to retrieve latest BTC block height")
-        return int(r.text)
-
-    def get_tx(self, txid: str):
-        return httpx.get("https://blockchain.info/rawtx/" + txid)
+    @timed("get_tx")
+    async def get_tx(self, txid: str):
+        return await self.rawtx_api.fetch("/rawtx/" + txid)
 
-    async def track(self, ctx: SlashContext, txid: str, required_confirmations: int):
-        response = self.get_tx(txid)
+    async def get_tx_data(self, txid: str):
+        response = await self.get_tx(txid)
         if not response.is_success:
-            return await send_invalid_tx_embed(ctx, response.status_code)
+            raise Exception(f"Failed to retrieve BTC transaction {txid}")
+        return response.json()
+
+    def compact_tx_data(self, data):
+        return {key: data[key] for key in ("hash", "block_height", "fee", "double_spend", "time", "weight")}
 
-        data = response.json()
+    def get_tx_block_height(self, data):
+        return data["block_height"]
+
+    async def get_confirmed_fields(self, tx: Transaction, data, current_confirmations: int):
+        formatted_confirmations = self.get_formatted_confirmations(current_confirmations)
+        return [
+            EmbedField(name="Transaction ID", value=f"`{tx.id}`", inline=False),
+            EmbedField(name="Confirmations", value=formatted_confirmations, inline=True),
+            EmbedField(name="Fee", value=await self.get_formatted_fee(tx.fee), inline=True),
+            EmbedField(name="Double-spent", value=f"{'Yes' if data['double_spend'] else 'No'}", inline=True),
+            EmbedField(name="Block height", value=f"{data['block_height']:,}", inline=True),
+            EmbedField(name="Confirmed at", value=f"<t:{int(time())}>", inline=True),
+            EmbedField(name="Sent at", value=f"<t:{data['time']}>", inline=True)
+        ]
+
+    async def track(self, ctx: SlashContext, txid: str, required_confirmations: int):
+        # Deeply confirmed transactions don't change, so they are served from the cache without any request
+        data = tx_cache.get(self, txid)
+        cached = data is not None
+        if not cached:
+            response = await self.get_tx(txid)
+            if not response.is_success:
+                return await send_invalid_tx_embed(ctx, response.status_code)
+            data = response.json()
         txid = data["hash"]
 
         tx_block_height = data["block_height"]
-        current_confirmations = self.get_current_confirmations(tx_block_height) if tx_block_height else 0
+        current_confirmations = await self.get_current_confirmations(tx_block_height, allow_stale=cached) \
+            if tx_block_height \
+            else 0
+        if not cached:
+            tx_cache.put(self, txid, data)
         formatted_confirmations = self.get_formatted_confirmations(current_confirmations)
 
-        tx = Transaction(self, txid, ctx.user.id, ctx.channel_id, data["fee"], required_confirmations)
+        tx = Transaction(self, txid, ctx.user.id, ctx.channel_id, data["fee"], required_confirmations,
+                         tx_block_height)
 
         # Queue the transaction if it hasn't already reached the required number of confirmations
         if current_confirmations < required_confirmations:
             queue_transaction(tx)
 
+        eta = await self.get_confirmation_eta(data)
         await send_tx_info_embed(ctx, tx, current_confirmations, [
             EmbedField(name="Transaction ID", value=f"`{txid}`", inline=False),
             EmbedField(name="Confirmations", value=formatted_confirmations, inline=True),
-            EmbedField(name="Fee", value=self.get_formatted_fee(data['fee']), inline=True),
+            EmbedField(name="Fee", value=await self.get_formatted_fee(data['fee']), inline=True),
             EmbedField(name="Double-spent", value=f"{'Yes' if data['double_spend'] else 'No'}", inline=True)
-        ])
+        ], eta)
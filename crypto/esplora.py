@@ -0,0 +1,91 @@
+import asyncio
+import math
+
+from helpers.metrics import timed
+from helpers.providers import ProviderPool
+from .base import Coin
+
+
+class EsploraCoin(Coin):
+    """
+    A coin served by Esplora-compatible APIs, such as mempool.space and its forks, for the chain tip, blocks, the
+    mempool and transaction statuses.
+    """
+    # Set by every coin to its pool of Esplora-compatible APIs
+    api: ProviderPool
+    # The prefix of the bech32 addresses of the coin
+    bech32_prefix: str
+
+    @timed("get_latest_block_height")
+    async def get_latest_block_height(self):
+        r = await self.api.fetch("/blocks/tip/height")
+        if not r.is_success:
+            raise Exception(f"Failed to retrieve latest {self.symbol.name} block height")
+        return int(r.text)
+
+    @timed("get_block_headers")
+    async def get_block_headers(self, start_height: int, end_height: int):
+        # Every request returns up to 10 blocks, from the requested height down
+        headers = {}
+        height = end_height
+        while height >= start_height:
+            response = await self.api.fetch(f"/blocks/{height}")
+            if not response.is_success:
+                raise Exception(f"Failed to retrieve {self.symbol.name} blocks below {height}")
+            blocks = response.json()
+            if not blocks:
+                break
+            for block in blocks:
+                headers[block["height"]] = (block["id"], block["previousblockhash"])
+            height = blocks[-1]["height"] - 1
+        return [(height, *headers[height]) for height in range(start_height, end_height + 1) if height in headers]
+
+    @timed("get_block_recipients")
+    async def get_block_recipients(self, height: int):
+        response = await self.api.fetch(f"/block-height/{height}")
+        if not response.is_success:
+            raise Exception(f"Failed to retrieve {self.symbol.name} block {height}")
+        block_hash = response.text
+        response = await self.api.fetch(f"/block/{block_hash}")
+        if not response.is_success:
+            raise Exception(f"Failed to retrieve {self.symbol.name} block {block_hash}")
+
+        # The transactions of a block are served 25 at a time
+        pages = await asyncio.gather(*[
+            self.api.fetch(f"/block/{block_hash}/txs/{start}") for start in range(0, response.json()["tx_count"], 25)
+        ])
+        recipients = []
+        for page in pages:
+            if not page.is_success:
+                raise Exception(f"Failed to retrieve the transactions of {self.symbol.name} block {block_hash}")
+            for tx in page.json():
+                addresses = [output.get("scriptpubkey_address") for output in tx["vout"]]
+                recipients.append((tx["txid"], tx["fee"], [address for address in addresses if address]))
+        return recipients
+
+    @timed("get_mempool_histogram")
+    async def get_mempool_histogram(self):
+        response = await self.api.fetch("/mempool")
+        if not response.is_success:
+            raise Exception(f"Failed to retrieve the {self.symbol.name} mempool")
+        return [(fee_rate, vsize) for fee_rate, vsize in response.json()["fee_histogram"]]
+
+    def normalize_address(self, address: str):
+        # Bech32 addresses are case-insensitive and appear in lowercase in blocks, unlike base58 addresses
+        address = address.strip()
+        return address.lower() if address.lower().startswith(self.bech32_prefix) else address
+
+    def get_tx_fee(self, data):
+        return data["fee"]
+
+    def get_tx_vsize(self, data):
+        return math.ceil(data["weight"] / 4)
+
+    @timed("get_tx_status")
+    async def get_tx_status(self, txid: str):
+        # The status endpoint only returns the block of the transaction, a fraction of the full transaction
+        response = await self.api.fetch(f"/tx/{txid}/status")
+        if not response.is_success:
+            raise Exception(f"Failed to retrieve {self.symbol.name} transaction status {txid}")
+        status = response.json()
+        return status["block_height"] if status["confirmed"] else None
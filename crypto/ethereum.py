@@ -1,59 +1,284 @@
+import asyncio
+import json
 import os
+from time import time
 
-from eth_typing import HexStr
 from interactions import SlashContext, EmbedField
-from web3 import Web3
-from web3.exceptions import TransactionNotFound
-from web3.types import TxData
 
 from helpers.embeds import send_invalid_tx_embed, send_tx_info_embed
+from helpers.metrics import timed
+from helpers.providers import ProviderPool
 from helpers.shared import queue_transaction
+from helpers.tips import chain_tips
 from helpers.transaction import Transaction
+from helpers.txcache import tx_cache
 from .base import Coin, CoinSymbol, FeeDenomination
 
 
+class AttributeDict(dict):
+    """
+    Parsed transaction data whose fields can also be read as attributes.
+    """
+
+    def __getattr__(self, name: str):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
 class Ethereum(Coin):
     def __init__(self):
         super(Ethereum, self).__init__(
             name="Ethereum",
             symbol=CoinSymbol.ETH,
             max_confirmations=50,
+            block_time=12,
             txid_pattern=r"^0x([a-f0-9]{64})$",
             emoji="<:eth:1133213001529434122>",
             explorer_url="https://etherscan.io/tx/{id}",
-            fee_denomination=FeeDenomination(name="ETH", decimal_digits=2, conversion_rate=1)
+            fee_denomination=FeeDenomination(name="ETH", decimal_digits=2, conversion_rate=1),
+            block_feed_url=os.getenv("WEB3_WS_PROVIDER"),
+            address_pattern=r"^0x[0-9a-fA-F]{40}$"
         )
-        self.eth = Web3(Web3.HTTPProvider(os.getenv("WEB3_HTTP_PROVIDER"))).eth
+        # Interchangeable JSON-RPC nodes, separated by commas
+        self.rpc = ProviderPool.from_env("eth-rpc", "WEB3_HTTP_PROVIDER", "")
+        # The maximum number of calls sent in a single JSON-RPC batch request
+        self.batch_size = int(os.getenv("ETH_RPC_BATCH_SIZE", 100))
 
-    def get_latest_block_height(self):
-        return self.eth.block_number
+    @timed("get_latest_block_height")
+    async def get_latest_block_height(self):
+        result = (await self._call_batch([("eth_blockNumber", [])]))[0]
+        if isinstance(result, Exception):
+            raise result
+        return int(result, 16)
 
-    def get_tx(self, txid: str) -> TxData:
-        try:
-            return self.eth.get_transaction(HexStr(txid))
-        except (ValueError, TransactionNotFound):
+    def get_block_feed_subscription(self):
+        return json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["newHeads"]})
+
+    def parse_block_feed_message(self, message: str | bytes):
+        data = json.loads(message)
+        if data.get("method") != "eth_subscription":
             return None
+        return int(data["params"]["result"]["number"], 16)
 
-    async def track(self, ctx: SlashContext, txid: str, required_confirmations: int):
-        data = self.get_tx(txid)
-        if not data:
-            return await send_invalid_tx_embed(ctx)
+    @timed("get_block_headers")
+    async def get_block_headers(self, start_height: int, end_height: int):
+        heights = range(start_height, end_height + 1)
+        results = await self._call_batch([("eth_getBlockByNumber", [hex(height), False]) for height in heights])
+        headers = []
+        for height, result in zip(heights, results):
+            if isinstance(result, Exception):
+                raise result
+            if result is None:
+                raise Exception(f"Failed to retrieve ETH block {height}")
+            headers.append((height, result["hash"], result["parentHash"]))
+        return headers
+
+    @timed("get_block_recipients")
+    async def get_block_recipients(self, height: int):
+        result = (await self._call_batch([("eth_getBlockByNumber", [hex(height), True])]))[0]
+        if isinstance(result, Exception):
+            raise result
+        if result is None:
+            raise Exception(f"Failed to retrieve ETH block {height}")
+        # Only plain transfers are matched: token transfers name the token contract as the recipient
+        return [
+            (tx["hash"], int(tx.get("gasPrice") or tx.get("maxFeePerGas"), 16), [tx["to"].lower()] if tx["to"] else [])
+            for tx in result["transactions"]
+        ]
+
+    def normalize_address(self, address: str):
+        return address.strip().lower()
+
+    async def get_tx(self, txid: str) -> AttributeDict | None:
+        # Timed by get_tx_data_batch, which sends the request
+        data = (await self.get_tx_data_batch([txid]))[txid]
+        return None if isinstance(data, Exception) else data
+
+    async def get_tx_data(self, txid: str) -> AttributeDict:
+        data = (await self.get_tx_data_batch([txid]))[txid]
+        if isinstance(data, Exception):
+            raise data
+        return data
+
+    @timed("get_tx_data_batch")
+    async def get_tx_data_batch(self, txids: list[str]):
+        # Look up the chain tip along with every transaction and its receipt
+        calls = [("eth_blockNumber", [])]
+        for txid in txids:
+            calls.append(("eth_getTransactionByHash", [txid]))
+            calls.append(("eth_getTransactionReceipt", [txid]))
+        results = await self._call_batch(calls)
+
+        if not isinstance(results[0], Exception):
+            chain_tips.set_height(self.symbol, int(results[0], 16))
+
+        data = {}
+        for i, txid in enumerate(txids):
+            tx_result, receipt_result = results[2 * i + 1], results[2 * i + 2]
+            if isinstance(tx_result, Exception):
+                data[txid] = tx_result
+            elif tx_result is None:
+                data[txid] = Exception(f"Failed to retrieve ETH transaction {txid}")
+            else:
+                receipt = receipt_result if not isinstance(receipt_result, Exception) else None
+                data[txid] = self._parse_tx(tx_result, receipt)
+        return data
+
+    @timed("get_tx_status_batch")
+    async def get_tx_status_batch(self, txids: list[str]):
+        # Polling only needs the block number, so skip the receipts until the transaction is confirmed
+        results = await self._call_batch(
+            [("eth_blockNumber", [])] + [("eth_getTransactionByHash", [txid]) for txid in txids]
+        )
+
+        if not isinstance(results[0], Exception):
+            chain_tips.set_height(self.symbol, int(results[0], 16))
+
+        statuses = {}
+        for txid, result in zip(txids, results[1:]):
+            if isinstance(result, Exception):
+                statuses[txid] = result
+            elif result is None:
+                statuses[txid] = Exception(f"Failed to retrieve ETH transaction {txid}")
+            else:
+                statuses[txid] = int(result["blockNumber"], 16) if result.get("blockNumber") else None
+        return statuses
+
+    async def _call_batch(self, calls: list[tuple[str, list]]) -> list:
+        """
+        Sends JSON-RPC calls to the node in batch requests of at most batch_size calls each.
+        :param calls: The method and parameters of every call.
+        :return: The result of every call, or the exception raised by it, in the same order as the calls.
+        """
+        async def send(chunk: list[tuple[str, list]]) -> list:
+            payload = [
+                {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+                for i, (method, params) in enumerate(chunk)
+            ]
+            try:
+                response = await self.rpc.request("POST", "", json=payload)
+                responses = response.json() if response.is_success else None
+            except Exception as e:
+                return [e] * len(chunk)
+            # The node answers with a single error object if it rejected the whole batch
+            if not isinstance(responses, list):
+                return [Exception("The Ethereum node rejected the batch request")] * len(chunk)
+
+            by_id = {item.get("id"): item for item in responses}
+            results = []
+            for i, (method, _) in enumerate(chunk):
+                item = by_id.get(i)
+                if item is None or "error" in item:
+                    results.append(Exception(f"{method} failed: {item and item['error']}"))
+                else:
+                    results.append(item.get("result"))
+            return results
 
-        txid = data.hash.hex()
+        chunks = await asyncio.gather(*[
+            send(calls[start:start + self.batch_size])
+            for start in range(0, len(calls), self.batch_size)
+        ])
+        return [result for chunk in chunks for result in chunk]
+
+    @staticmethod
+    def _parse_tx(tx: dict, receipt: dict | None) -> AttributeDict:
+        """
+        Converts the hex quantities of a JSON-RPC transaction and its receipt into the fields used by the bot.
+        :param tx: The result of eth_getTransactionByHash.
+        :param receipt: The result of eth_getTransactionReceipt, or None if the transaction hasn't been mined yet.
+        :return: The parsed transaction data.
+        """
+        def to_int(value: str | None):
+            return int(value, 16) if value is not None else None
+
+        return AttributeDict({
+            "hash": tx["hash"],
+            "blockNumber": to_int(tx.get("blockNumber")),
+            "blockHash": tx.get("blockHash"),
+            "gas": to_int(tx["gas"]),
+            "gasPrice": to_int(tx.get("gasPrice") or tx.get("maxFeePerGas")),
+            "value": to_int(tx["value"]),
+            "nonce": to_int(tx["nonce"]),
+            "gasUsed": to_int(receipt.get("gasUsed")) if receipt else None,
+            "effectiveGasPrice": to_int(receipt.get("effectiveGasPrice")) if receipt else None
+        })
+
+    @staticmethod
+    def get_fee(data: AttributeDict) -> float:
+        """
+        Calculates the fee of a transaction in ETH.
+        :param data: The parsed transaction data.
+        :return: The fee paid, or the maximum fee if the transaction hasn't been mined yet.
+        """
+        # tx fee (ETH) = gas used by tx * price paid per gas, both taken from the receipt once mined
+        if data.gasUsed is not None and data.effectiveGasPrice is not None:
+            return data.gasUsed * data.effectiveGasPrice / 1e18
+        return data.gas * data.gasPrice / 1e18
+
+    def get_tx_fee(self, data: AttributeDict):
+        return data.gasPrice
+
+    def restore_tx_data(self, data: dict):
+        return AttributeDict(data)
+
+    def get_tx_block_height(self, data: AttributeDict):
+        return data.blockNumber
+
+    def get_tx_block_hash(self, data: AttributeDict):
+        # Cached before the block hash was kept
+        return data.get("blockHash")
+
+    async def get_confirmed_fields(self, tx: Transaction, data: AttributeDict, current_confirmations: int):
+        fee = self.get_fee(data)
+
+        # convert tx value from wei to ETH
+        eth_value = data.value / 1e18
+        usd_amount = await self.get_usd_rate() * eth_value
+
+        formatted_confirmations = self.get_formatted_confirmations(current_confirmations)
+        return [
+            EmbedField(name="Transaction ID", value=f"`{tx.id}`", inline=False),
+            EmbedField(name="Confirmations", value=formatted_confirmations, inline=True),
+            EmbedField(name="Fee", value=await self.get_formatted_fee(fee), inline=True),
+            EmbedField(name="Value", value=f"${usd_amount:,.2f}", inline=True),
+            EmbedField(name="Block number", value=f"{data.blockNumber:,}", inline=True),
+            EmbedField(name="Nonce", value=f"{data.nonce:,}", inline=True),
+            EmbedField(name="Confirmed at", value=f"<t:{int(time())}>", inline=True)
+        ]
+
+    def encode_txid(self, txid: str) -> bytes:
+        return bytes.fromhex(txid.removeprefix("0x"))
+
+    def decode_txid(self, raw_id: bytes) -> str:
+        return "0x" + raw_id.hex()
+
+    async def track(self, ctx: SlashContext, txid: str, required_confirmations: int):
+        # Deeply confirmed transactions don't change, so they are served from the cache without any request
+        data = tx_cache.get(self, txid)
+        cached = data is not None
+        if not cached:
+            data = await self.get_tx(txid)
+            if not data:
+                return await send_invalid_tx_embed(ctx)
 
-        # convert gas price from wei to ETH
-        eth_gas_price = data.gasPrice / 1e18
-        # tx fee (ETH) = gas price * gas used by tx
-        fee = data.gas * eth_gas_price
+        txid = data.hash
+        fee = self.get_fee(data)
 
         # convert tx value from wei to ETH
         eth_value = data.value / 1e18
-        usd_amount = self.get_usd_rate() * eth_value
+        usd_amount = await self.get_usd_rate() * eth_value
 
-        current_confirmations = self.get_current_confirmations(data.blockNumber) if data.blockNumber is not None else 0
+        current_confirmations = await self.get_current_confirmations(data.blockNumber, allow_stale=cached) \
+            if data.blockNumber is not None \
+            else 0
+        if not cached:
+            tx_cache.put(self, txid, data)
         formatted_confirmations = self.get_formatted_confirmations(current_confirmations)
 
-        tx = Transaction(self, txid, ctx.user.id, ctx.channel_id, data.gasPrice, required_confirmations)
+        tx = Transaction(self, txid, ctx.user.id, ctx.channel_id, data.gasPrice, required_confirmations,
+                         data.blockNumber)
 
         # Queue the transaction if it hasn't already reached the required number of confirmations
         if current_confirmations < required_confirmations:
@@ -62,6 +287,6 @@ class Ethereum(Coin):
         await send_tx_info_embed(ctx, tx, current_confirmations, [
             EmbedField(name="Transaction ID", value=f"`{txid}`", inline=False),
             EmbedField(name="Confirmations", value=formatted_confirmations, inline=True),
-            EmbedField(name="Fee", value=self.get_formatted_fee(fee), inline=True),
+            EmbedField(name="Fee", value=await self.get_formatted_fee(fee), inline=True),
             EmbedField(name="Value", value=f"${usd_amount:,.2f}", inline=True)
         ])
@@ -1,55 +1,98 @@
-import httpx
+import os
+from time import time
+
 from interactions import SlashContext, EmbedField
 
 from helpers.embeds import send_invalid_tx_embed, send_tx_info_embed
+from helpers.metrics import timed
+from helpers.providers import ProviderPool
 from helpers.shared import queue_transaction
 from helpers.transaction import Transaction
-from .base import Coin, CoinSymbol, FeeDenomination
+from helpers.txcache import tx_cache
+from .base import CoinSymbol, FeeDenomination
+from .esplora import EsploraCoin
+
 
+class Litecoin(EsploraCoin):
+    bech32_prefix = "ltc1"
 
-class Litecoin(Coin):
     def __init__(self):
         super(Litecoin, self).__init__(
             name="Litecoin",
             symbol=CoinSymbol.LTC,
             max_confirmations=24,
+            block_time=150,
             txid_pattern=r"[0-9a-f]{64}$",
             emoji="<:btc:1133213000304697495>",
             explorer_url="https://blockchair.com/litecoin/transaction/{id}",
-            fee_denomination=FeeDenomination(name="lit", decimal_digits=7, conversion_rate=1e8)
+            fee_denomination=FeeDenomination(name="lit", decimal_digits=7, conversion_rate=1e8),
+            block_feed_url=os.getenv("LTC_BLOCK_FEED_URL", "wss://litecoinspace.org/api/v1/ws"),
+            address_pattern=r"^(ltc1[02-9ac-hj-np-z]{11,71}|[LM3][1-9A-HJ-NP-Za-km-z]{25,34})$"
         )
+        # Esplora-compatible APIs used for the chain tip, transactions and their statuses
+        self.api = ProviderPool.from_env("ltc-esplora", "LTC_API_URL", "https://litecoinspace.org/api")
 
-    def get_latest_block_height(self):
-        r = httpx.get("https://litecoinspace.org/api/v1/blocks/tip/height")
-        if not r.is_success:
-            raise Exception("Failed to retrieve latest LTC block height")
-        return int(r.text)
-
-    def get_tx(self, txid: str):
-        return httpx.get("https://litecoinspace.org/api/tx/" + txid)
+    @timed("get_tx")
+    async def get_tx(self, txid: str):
+        return await self.api.fetch("/tx/" + txid)
 
-    async def track(self, ctx: SlashContext, txid: str, required_confirmations: int):
-        response = self.get_tx(txid)
+    async def get_tx_data(self, txid: str):
+        response = await self.get_tx(txid)
         if not response.is_success:
-            return await send_invalid_tx_embed(ctx, response.status_code)
+            raise Exception(f"Failed to retrieve LTC transaction {txid}")
+        return response.json()
+
+    def compact_tx_data(self, data):
+        return {key: data[key] for key in ("txid", "status", "fee", "size", "weight")}
+
+    def get_tx_block_height(self, data):
+        return data["status"]["block_height"] if data["status"]["confirmed"] else None
 
-        data = response.json()
+    def get_tx_block_hash(self, data):
+        return data["status"].get("block_hash")
+
+    async def get_confirmed_fields(self, tx: Transaction, data, current_confirmations: int):
+        formatted_confirmations = self.get_formatted_confirmations(current_confirmations)
+        return [
+            EmbedField(name="Transaction ID", value=f"`{tx.id}`", inline=False),
+            EmbedField(name="Confirmations", value=formatted_confirmations, inline=True),
+            EmbedField(name="Fee", value=await self.get_formatted_fee(tx.fee), inline=True),
+            EmbedField(name="Block height", value=f"{data['status']['block_height']:,}", inline=True),
+            EmbedField(name="Size", value=f"{data['size']:,} vB", inline=True),
+            EmbedField(name="Weight", value=f"{data['weight']:,} WU", inline=True),
+            EmbedField(name="Confirmed at", value=f"<t:{int(time())}>", inline=True)
+        ]
+
+    async def track(self, ctx: SlashContext, txid: str, required_confirmations: int):
+        # Deeply confirmed transactions don't change, so they are served from the cache without any request
+        data = tx_cache.get(self, txid)
+        cached = data is not None
+        if not cached:
+            response = await self.get_tx(txid)
+            if not response.is_success:
+                return await send_invalid_tx_embed(ctx, response.status_code)
+            data = response.json()
         txid = data["txid"]
 
-        current_confirmations = self.get_current_confirmations(data["status"]["block_height"]) \
-            if data["status"]["confirmed"] \
+        tx_block_height = self.get_tx_block_height(data)
+        current_confirmations = await self.get_current_confirmations(tx_block_height, allow_stale=cached) \
+            if tx_block_height \
             else 0
+        if not cached:
+            tx_cache.put(self, txid, data)
         formatted_confirmations = self.get_formatted_confirmations(current_confirmations)
 
-        tx = Transaction(self, txid, ctx.user.id, ctx.channel_id, data["fee"], required_confirmations)
+        tx = Transaction(self, txid, ctx.user.id, ctx.channel_id, data["fee"], required_confirmations,
+                         tx_block_height)
 
         # Queue the transaction if it hasn't already reached the required number of confirmations
         if current_confirmations < required_confirmations:
             queue_transaction(tx)
 
+        eta = await self.get_confirmation_eta(data)
         await send_tx_info_embed(ctx, tx, current_confirmations, [
             EmbedField(name="Transaction ID", value=f"`{txid}`", inline=False),
             EmbedField(name="Confirmations", value=formatted_confirmations, inline=True),
-            EmbedField(name="Fee", value=self.get_formatted_fee(data['fee']), inline=True),
+            EmbedField(name="Fee", value=await self.get_formatted_fee(data['fee']), inline=True),
             EmbedField(name="Size", value=f"{data['size']:,} vB", inline=True)
-        ])
+        ], eta)
@@ -0,0 +1,135 @@
+import asyncio
+from collections.abc import Mapping
+from typing import TYPE_CHECKING, Callable, NamedTuple
+
+from helpers.store import TransactionStore
+
+if TYPE_CHECKING:
+    from crypto.base import Coin, CoinSymbol
+
+
+class AddressWatch(NamedTuple):
+    user_id: int
+    channel_id: int
+    required_confirmations: int
+
+
+class AddressIndex:
+
+    def __init__(self, max_blocks_per_scan: int = 6):
+        """
+        Indexes the watched addresses of every coin in hash tables, so a block is matched against all of them with one
+        lookup per recipient: scanning a block costs the same for ten watched addresses or tens of thousands.
+        The store is the source of truth, and the index is reloaded whenever the addresses change there, which also
+        picks up the addresses watched through other processes.
+        :param max_blocks_per_scan: The maximum number of blocks scanned in one monitor run when catching up.
+        """
+        self.max_blocks_per_scan = max_blocks_per_scan
+        # The supported coins, keyed by symbol, set at startup
+        self.coins: Mapping["CoinSymbol", "Coin"] = {}
+        # Checks whether this process is responsible for an address, set by sharded monitor workers
+        self.owns: Callable[["CoinSymbol", str], bool] | None = None
+        self._watches: dict["CoinSymbol", dict[str, list[AddressWatch]]] = {}
+        self._version: int | None = None
+        # The height of the last block scanned for each coin
+        self._scanned_heights: dict["CoinSymbol", int] = {}
+
+    def count(self, symbol: "CoinSymbol") -> int:
+        """
+        Counts the watched addresses of a coin.
+        :param symbol: The symbol of the coin.
+        :return: The number of distinct watched addresses of the coin.
+        """
+        return len(self._watches.get(symbol, ()))
+
+    def get_coins(self) -> list["Coin"]:
+        """
+        Retrieves the coins that currently have watched addresses.
+        :return: The coins with at least one watched address.
+        """
+        return [self.coins[symbol] for symbol, watches in self._watches.items() if watches]
+
+    def invalidate(self):
+        """
+        Reloads the watched addresses on the next sync, after the addresses this process is responsible for changed.
+        """
+        self._version = None
+
+    async def sync(self, store: TransactionStore):
+        """
+        Reloads the watched addresses if they changed in the store since the last sync.
+        :param store: The store of the watched addresses.
+        """
+        version = await asyncio.to_thread(store.get_addresses_version)
+        if version == self._version:
+            return
+
+        watches: dict["CoinSymbol", dict[str, list[AddressWatch]]] = {}
+        for symbol, address, user_id, channel_id, required_confirmations in await asyncio.to_thread(
+                store.load_addresses
+        ):
+            coin = self.coins.get(symbol)
+            # Skip coins that are no longer supported and addresses assigned to another worker
+            if coin is None or (self.owns is not None and not self.owns(coin.symbol, address)):
+                continue
+            watch = AddressWatch(user_id, channel_id, required_confirmations)
+            watches.setdefault(coin.symbol, {}).setdefault(address, []).append(watch)
+
+        # Coins without watched addresses start scanning from the chain tip again once one is added
+        for symbol in [symbol for symbol in self._scanned_heights if symbol not in watches]:
+            del self._scanned_heights[symbol]
+        self._watches = watches
+        self._version = version
+
+    def get_scan_heights(self, symbol: "CoinSymbol", tip_height: int) -> range:
+        """
+        Retrieves the heights of the blocks to scan, starting after the last scanned block.
+        Scanning starts at the next block when a coin gets its first watched address.
+        :param symbol: The symbol of the coin.
+        :param tip_height: The latest block height of the coin.
+        :return: The heights of the blocks to scan now, from the lowest up.
+        """
+        scanned_height = self._scanned_heights.setdefault(symbol, tip_height)
+        return range(scanned_height + 1, min(tip_height, scanned_height + self.max_blocks_per_scan) + 1)
+
+    def scanned(self, symbol: "CoinSymbol", height: int):
+        """
+        Records that a block was scanned.
+        :param symbol: The symbol of the coin.
+        :param height: The height of the block.
+        """
+        self._scanned_heights[symbol] = height
+
+    def rewind(self, symbol: "CoinSymbol", fork_height: int):
+        """
+        Scans the blocks that replaced the blocks of a reorg again.
+        :param symbol: The symbol of the coin.
+        :param fork_height: The lowest height whose block was replaced.
+        """
+        if self._scanned_heights.get(symbol, -1) >= fork_height:
+            self._scanned_heights[symbol] = fork_height - 1
+
+    def match(
+            self,
+            symbol: "CoinSymbol",
+            recipients: list[tuple[str, int, list[str]]]
+    ) -> list[tuple[str, int, AddressWatch]]:
+        """
+        Matches the transactions of a block against the watched addresses.
+        :param symbol: The symbol of the coin.
+        :param recipients: The ID, fee and recipient addresses of every transaction of the block.
+        :return: The ID and fee of every transaction sent to a watched address, with each watch it matched, once per
+        transaction and watch.
+        """
+        watches = self._watches.get(symbol)
+        if not watches:
+            return []
+
+        matches = []
+        for txid, fee, addresses in recipients:
+            matched = {watch for address in addresses for watch in watches.get(address, ())}
+            matches.extend((txid, fee, watch) for watch in matched)
+        return matches
+
+
+address_index = AddressIndex()
@@ -0,0 +1,52 @@
+from interactions import SlashContext
+
+from crypto.base import Coin
+from helpers.embeds import send_bulk_track_embed
+from helpers.shared import queue_transaction
+from helpers.transaction import Transaction
+
+# The maximum number of transactions tracked by one bulk command
+MAX_BULK_TXIDS = 100
+
+
+async def track_bulk(ctx: SlashContext, coin: Coin, txids: list[str], required_confirmations: int):
+    """
+    Tracks several transactions at once and answers with a single summary.
+    The transactions are looked up together, so coins with batch requests validate them in as few requests as
+    possible and the others validate them concurrently. Deeply confirmed ones are served from the cache.
+    :param ctx: The application command interaction context.
+    :param coin: The cryptocurrency coin used.
+    :param txids: The IDs of the transactions to track.
+    :param required_confirmations: The number of confirmations to notify after.
+    """
+    skipped = max(0, len(txids) - MAX_BULK_TXIDS)
+    txids = txids[:MAX_BULK_TXIDS]
+    results = await coin.get_cached_tx_data_batch(txids)
+
+    lines = []
+    tracked = 0
+    for txid in txids:
+        data = results[txid]
+        link = f"[`{txid[:10]}…{txid[-6:]}`]({coin.get_explorer_url(txid)})"
+        if isinstance(data, Exception):
+            lines.append(f":x: {link} Not found")
+            continue
+
+        tx_block_height = coin.get_tx_block_height(data)
+        # A stale tip only undercounts, leaving the monitor to notify a transaction that was closer than it looked
+        current_confirmations = await coin.get_current_confirmations(tx_block_height, allow_stale=True) \
+            if tx_block_height else 0
+        formatted_confirmations = coin.get_formatted_confirmations(current_confirmations)
+        if current_confirmations >= required_confirmations:
+            lines.append(f":white_check_mark: {link} Already confirmed ({formatted_confirmations})")
+            continue
+
+        queue_transaction(Transaction(coin, txid, ctx.user.id, ctx.channel_id, coin.get_tx_fee(data),
+                                      required_confirmations, tx_block_height))
+        # Every estimate comes from the same mempool snapshot, fetched at most once for the whole batch
+        eta = await coin.get_confirmation_eta(data)
+        formatted_eta = f", {coin.get_formatted_eta(eta)}" if eta is not None else ""
+        lines.append(f":hourglass: {link} Tracking ({formatted_confirmations}{formatted_eta})")
+        tracked += 1
+
+    await send_bulk_track_embed(ctx, coin, required_confirmations, tracked, lines, skipped)
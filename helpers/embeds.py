@@ -1,8 +1,15 @@
+import asyncio
+from typing import TYPE_CHECKING
+
 from interactions import Embed, SlashContext, RoleColors, EmbedField
+from interactions.ext.paginators import Paginator
 
-from helpers.shared import bot
+from helpers.notifier import notifier
 from helpers.transaction import Transaction
 
+if TYPE_CHECKING:
+    from crypto.base import Coin
+
 
 async def send_invalid_tx_embed(ctx: SlashContext, status_code=404):
     """
@@ -21,13 +28,84 @@ async def send_invalid_tx_embed(ctx: SlashContext, status_code=404):
     await ctx.send(embed=embed)
 
 
-async def send_tx_info_embed(ctx: SlashContext, tx: Transaction, current_confirmations: int, fields: list[EmbedField]):
+async def send_invalid_address_embed(ctx: SlashContext, coin: "Coin"):
+    """
+    Sends an embed indicating that an address can't be watched.
+    :param ctx: The application command interaction context.
+    :param coin: The cryptocurrency coin of the address.
+    """
+    embed = Embed(
+        color=RoleColors.RED,
+        title=":x: An error occurred",
+        description=f"The specified address is not a valid {coin.name} address."
+    )
+    await ctx.send(embed=embed)
+
+
+async def send_address_watch_embed(ctx: SlashContext, coin: "Coin", address: str, required_confirmations: int):
+    """
+    Sends an embed confirming that an address is being watched.
+    :param ctx: The application command interaction context.
+    :param coin: The cryptocurrency coin of the address.
+    :param address: The watched address.
+    :param required_confirmations: The number of confirmations to notify after.
+    """
+    description = f"{coin.emoji} You will be notified when a transaction sent to this address reaches " \
+                  f"{required_confirmations} {'confirmation' if required_confirmations == 1 else 'confirmations'}."
+    embed = Embed(":information_source: Address watched", description, RoleColors.BLUE)
+    embed.add_field(name="Address", value=f"`{address}`", inline=False)
+    await ctx.send(embed=embed)
+
+
+async def send_bulk_track_embed(
+        ctx: SlashContext,
+        coin: "Coin",
+        required_confirmations: int,
+        tracked: int,
+        lines: list[str],
+        skipped: int = 0,
+        page_size: int = 20
+):
+    """
+    Sends a single summary of a bulk tracking command, split into pages when it lists many transactions.
+    :param ctx: The application command interaction context.
+    :param coin: The cryptocurrency coin used.
+    :param required_confirmations: The number of confirmations to notify after.
+    :param tracked: The number of transactions that are now tracked.
+    :param lines: The status of every transaction.
+    :param skipped: The number of transactions left out because the command listed too many.
+    :param page_size: The number of transactions listed on each page.
+    """
+    summary = f"{coin.emoji} Tracking {tracked} of {len(lines)} {coin.name} " \
+              f"{'transaction' if len(lines) == 1 else 'transactions'}. You will be notified when each one " \
+              f"reaches {required_confirmations} {'confirmation' if required_confirmations == 1 else 'confirmations'}."
+    if skipped:
+        summary += f" {skipped} more {'transaction was' if skipped == 1 else 'transactions were'} left out."
+
+    embeds = []
+    for start in range(0, max(len(lines), 1), page_size):
+        description = "\n".join([summary, ""] + lines[start:start + page_size])
+        embeds.append(Embed(":information_source: Bulk tracking", description, RoleColors.BLUE))
+
+    if len(embeds) == 1:
+        return await ctx.send(embed=embeds[0])
+    await Paginator.create_from_embeds(ctx.bot, *embeds, timeout=300).send(ctx)
+
+
+async def send_tx_info_embed(
+        ctx: SlashContext,
+        tx: Transaction,
+        current_confirmations: int,
+        fields: list[EmbedField],
+        eta: int | None = None
+):
     """
     Sends an embed containing information about a transaction.
     :param ctx: The application command interaction context.
     :param tx: The transaction to send the embed for.
     :param current_confirmations: The number of confirmations the transaction has reached.
     :param fields: The fields to add to the embed.
+    :param eta: The estimated number of blocks until the transaction is mined, if it is unconfirmed.
     """
     view_link = tx.coin.get_formatted_url(tx.id)
 
@@ -42,14 +120,23 @@ async def send_tx_info_embed(ctx: SlashContext, tx: Transaction, current_confirm
 
     embed = Embed(":information_source: Transaction information", description, RoleColors.BLUE)
     embed.add_fields(*fields)
+    if eta is not None:
+        embed.add_field(name="Estimated confirmation", value=tx.coin.get_formatted_eta(eta), inline=True)
     await ctx.send(embed=embed)
 
 
-async def send_tx_confirmed_embed(tx: Transaction, fields: list[EmbedField]):
+async def send_tx_confirmed_embed(
+        tx: Transaction,
+        fields: list[EmbedField],
+        reached_at: float | None = None
+) -> asyncio.Future:
     """
     Sends an embed notifying the user that their transaction has confirmed.
+    The embed is queued and sent in the background, combined with other notifications going to the same channel.
     :param tx: The transaction to send the embed for.
     :param fields: The fields to add to the embed.
+    :param reached_at: The monotonic time the transaction reached its required number of confirmations.
+    :return: The future resolved with the Delivery outcome once the embed is sent or dropped.
     """
     view_link = tx.coin.get_formatted_url(tx.id)
 
@@ -59,5 +146,4 @@ async def send_tx_confirmed_embed(tx: Transaction, fields: list[EmbedField]):
                   RoleColors.GREEN)
     embed.add_fields(*fields)
     embed.set_footer("Find this bot helpful? Leave a star on GitHub!")
-    channel = bot.get_channel(tx.channel_id)
-    await channel.send(content=f"<@{tx.user_id}>", embed=embed)
+    return notifier.enqueue(tx.channel_id, tx.user_id, embed, reached_at)
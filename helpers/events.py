@@ -0,0 +1,107 @@
+import asyncio
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from websockets.asyncio.client import connect
+
+if TYPE_CHECKING:
+    from crypto.base import Coin, CoinSymbol
+
+
+class BlockFeed:
+
+    def __init__(
+            self,
+            coin: "Coin",
+            on_block: Callable[["Coin", int], Awaitable],
+            min_backoff: float = 1,
+            max_backoff: float = 60
+    ):
+        """
+        Listens for new blocks of a coin over its websocket block feed, reconnecting whenever the connection drops.
+        :param coin: The coin to listen for new blocks of.
+        :param on_block: The callback awaited with the coin and the height of every new block.
+        :param min_backoff: The number of seconds waited before the first reconnection attempt.
+        :param max_backoff: The maximum number of seconds waited between reconnection attempts.
+        """
+        self.coin = coin
+        self.on_block = on_block
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.connected = False
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        """
+        Starts listening in the background.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    def stop(self):
+        """
+        Stops listening.
+        """
+        if self._task is not None:
+            self._task.cancel()
+        self.connected = False
+
+    async def run(self):
+        """
+        Listens for new blocks until cancelled.
+        """
+        backoff = self.min_backoff
+        while True:
+            try:
+                async with connect(self.coin.block_feed_url) as websocket:
+                    await websocket.send(self.coin.get_block_feed_subscription())
+                    self.connected = True
+                    backoff = self.min_backoff
+                    print(f"[*] Block feed connected ({self.coin.symbol.name})")
+                    async for message in websocket:
+                        height = self.coin.parse_block_feed_message(message)
+                        if height is not None:
+                            await self.on_block(self.coin, height)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[!] Block feed error ({self.coin.symbol.name}) {e!r}")
+            finally:
+                self.connected = False
+
+            # The monitor keeps polling while the feed is down
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+
+block_feeds: dict["CoinSymbol", BlockFeed] = {}
+
+
+def start_block_feed(coin: "Coin", on_block: Callable[["Coin", int], Awaitable]):
+    """
+    Starts listening to the block feed of a coin, if it has one and it isn't listened to yet.
+    :param coin: The coin to listen for new blocks of.
+    :param on_block: The callback awaited with the coin and the height of every new block.
+    """
+    if coin.block_feed_url and coin.symbol not in block_feeds:
+        block_feeds[coin.symbol] = BlockFeed(coin, on_block)
+        block_feeds[coin.symbol].start()
+
+
+def start_block_feeds(coins: list["Coin"], on_block: Callable[["Coin", int], Awaitable]):
+    """
+    Starts listening to the block feed of every coin that has one.
+    :param coins: The coins to listen for new blocks of.
+    :param on_block: The callback awaited with the coin and the height of every new block.
+    """
+    for coin in coins:
+        start_block_feed(coin, on_block)
+
+
+def is_feed_live(symbol: "CoinSymbol") -> bool:
+    """
+    Checks whether new blocks of a coin are currently pushed by its block feed.
+    :param symbol: The symbol of the coin.
+    :return: Whether the block feed of the coin is connected.
+    """
+    feed = block_feeds.get(symbol)
+    return feed is not None and feed.connected
@@ -0,0 +1,121 @@
+import asyncio
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from crypto.base import Coin, CoinSymbol
+
+
+class HeaderIndex:
+
+    def __init__(self, depth: int = 100):
+        """
+        Keeps the hashes of the latest blocks of each coin, extended as the chain tip advances. A reorg is noticed by
+        comparing the previous block hash of the first new block with the indexed one, instead of fetching every
+        mined transaction again.
+        :param depth: The number of recent blocks kept for each coin, which is the deepest reorg that can be located.
+        """
+        self.depth = depth
+        self._hashes: dict["CoinSymbol", dict[int, str]] = {}
+        self._heights: dict["CoinSymbol", int] = {}
+        self._locks: dict["CoinSymbol", asyncio.Lock] = {}
+        # Coins whose providers don't serve block headers
+        self._unsupported: set["CoinSymbol"] = set()
+
+    def get_height(self, symbol: "CoinSymbol") -> int | None:
+        """
+        Retrieves the height of the latest indexed block of a coin.
+        :param symbol: The symbol of the coin.
+        :return: The latest indexed height, or None if no block has been indexed yet.
+        """
+        return self._heights.get(symbol)
+
+    def get_hash(self, symbol: "CoinSymbol", height: int) -> str | None:
+        """
+        Retrieves the hash of an indexed block.
+        :param symbol: The symbol of the coin.
+        :param height: The height of the block.
+        :return: The hash of the block, or None if it isn't one of the indexed blocks.
+        """
+        return self._hashes.get(symbol, {}).get(height)
+
+    def get_confirmations(self, symbol: "CoinSymbol", block_height: int, block_hash: str | None = None) -> int | None:
+        """
+        Counts the confirmations of a block from the index, without any request.
+        :param symbol: The symbol of the coin.
+        :param block_height: The height of the block.
+        :param block_hash: The hash of the block, if known, checked against the indexed block at that height.
+        :return: The number of confirmations of the block, 0 if the indexed block at that height is another one, or
+        None if it isn't one of the indexed blocks.
+        """
+        indexed_hash = self.get_hash(symbol, block_height)
+        if indexed_hash is None:
+            return None
+        if block_hash is not None and block_hash != indexed_hash:
+            return 0
+        return self._heights[symbol] - block_height + 1
+
+    async def update(self, coin: "Coin", tip_height: int, recheck_tip: bool = False) -> int | None:
+        """
+        Indexes the blocks up to the chain tip, checking that they extend the indexed blocks.
+        :param coin: The coin to index the blocks of.
+        :param tip_height: The latest block height of the coin.
+        :param recheck_tip: Whether to fetch the tip again when its height didn't change, since it may have been
+        replaced by another block at the same height.
+        :return: The lowest height whose block was replaced by a reorg, or None if every indexed block is unchanged.
+        """
+        if coin.symbol in self._unsupported:
+            return None
+
+        lock = self._locks.setdefault(coin.symbol, asyncio.Lock())
+        async with lock:
+            latest_height = self._heights.get(coin.symbol)
+            if latest_height is not None and tip_height <= latest_height:
+                if not recheck_tip or tip_height != latest_height:
+                    return None
+                headers = await coin.get_block_headers(tip_height, tip_height)
+                hashes = self._hashes[coin.symbol]
+                if not headers or headers[0][1] == hashes.get(tip_height):
+                    return None
+                return await self._find_fork(coin, hashes, tip_height)
+
+            # Start from the tip, then only fetch the blocks added since the last update
+            start_height = tip_height if latest_height is None else max(latest_height + 1, tip_height - self.depth + 1)
+            try:
+                headers = await coin.get_block_headers(start_height, tip_height)
+            except NotImplementedError:
+                self._unsupported.add(coin.symbol)
+                return None
+            if not headers:
+                return None
+
+            hashes = self._hashes.setdefault(coin.symbol, {})
+            fork_height = None
+            first_height, _, previous_hash = headers[0]
+            indexed_hash = hashes.get(first_height - 1)
+            if indexed_hash is not None and indexed_hash != previous_hash:
+                fork_height = await self._find_fork(coin, hashes, first_height - 1)
+
+            for height, block_hash, _ in headers:
+                hashes[height] = block_hash
+            self._heights[coin.symbol] = headers[-1][0]
+            for height in [height for height in hashes if height <= self._heights[coin.symbol] - self.depth]:
+                del hashes[height]
+            return fork_height
+
+    @staticmethod
+    async def _find_fork(coin: "Coin", hashes: dict[int, str], height: int) -> int:
+        # Walk down from the block the new blocks build on until the chain matches the index again
+        lowest_height = min(hashes)
+        while height >= lowest_height:
+            start_height = max(lowest_height, height - 9)
+            headers = await coin.get_block_headers(start_height, height)
+            for header_height, block_hash, _ in reversed(headers):
+                if hashes.get(header_height) == block_hash:
+                    return header_height + 1
+                hashes[header_height] = block_hash
+            height = start_height - 1
+        # The reorg goes deeper than the index, so every indexed block changed
+        return lowest_height
+
+
+chain_headers = HeaderIndex()
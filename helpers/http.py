@@ -0,0 +1,209 @@
+import asyncio
+import os
+import random
+from time import monotonic, perf_counter
+from urllib.parse import urlsplit
+
+import httpx
+
+from helpers.metrics import provider_errors, provider_latency
+
+# One client per host, so connections are kept alive and reused between requests
+_clients: dict[str, httpx.AsyncClient] = {}
+
+_timeout = httpx.Timeout(10.0, connect=5.0)
+_limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+
+# Status codes that mean the host wants us to slow down
+RETRY_STATUS_CODES = {429, 503}
+
+
+class HostGovernor:
+
+    def __init__(self, rate: float, burst: int, max_in_flight: int, max_retries: int = 4, base_backoff: float = 1):
+        """
+        Limits the requests sent to a host with a token bucket and a cap on concurrent requests.
+        :param rate: The number of requests allowed per second on average.
+        :param burst: The number of requests that can be sent at once after a quiet period.
+        :param max_in_flight: The maximum number of requests waiting for a response at the same time.
+        :param max_retries: The number of times a rate-limited request is retried.
+        :param base_backoff: The number of seconds waited before the first retry, doubled on every retry.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self._tokens = float(burst)
+        self._updated_at = monotonic()
+        self._paused_until = 0.0
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+
+    async def _take_token(self):
+        while True:
+            now = monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self._in_flight.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self._in_flight.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._in_flight.release()
+
+    async def back_off(self, attempt: int, retry_after: str | None = None):
+        """
+        Pauses every request to the host after it rate-limited us.
+        :param attempt: The number of retries already made for the request, starting at 0.
+        :param retry_after: The value of the Retry-After header, if the host sent one.
+        """
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = self.base_backoff * 2 ** attempt * random.uniform(1, 1.5)
+        self._paused_until = max(self._paused_until, monotonic() + delay)
+        await asyncio.sleep(delay)
+
+
+# Requests per second, burst size and concurrent requests of known hosts
+_host_limits: dict[str, tuple[float, int, int]] = {
+    "https://mempool.space": (10, 20, 8),
+    "https://blockstream.info": (10, 20, 8),
+    "https://litecoinspace.org": (10, 20, 8),
+    "https://blockchain.info": (5, 10, 5),
+    "https://api.blockchain.com": (5, 10, 5),
+}
+_default_limits = (10, 20, 8)
+_governors: dict[str, HostGovernor] = {}
+_env_limits_loaded = False
+
+
+def get_host(url: str) -> str:
+    """
+    Extracts the scheme and host of a URL, which identify the host in limits and metrics.
+    :param url: A URL of the host.
+    :return: The scheme and host of the URL.
+    """
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def configure_host(url: str, rate: float, burst: int, max_in_flight: int):
+    """
+    Sets the request limits of a host. Must be called before the first request to the host.
+    :param url: A URL of the host.
+    :param rate: The number of requests allowed per second on average.
+    :param burst: The number of requests that can be sent at once after a quiet period.
+    :param max_in_flight: The maximum number of requests waiting for a response at the same time.
+    """
+    _host_limits[get_host(url)] = (rate, burst, max_in_flight)
+
+
+def get_governor(url: str) -> HostGovernor:
+    """
+    Retrieves the request governor of a host, creating it on first use.
+    :param url: A URL of the host.
+    :return: The request governor of the host.
+    """
+    global _env_limits_loaded
+
+    if not _env_limits_loaded:
+        # Limits can be overridden with HTTP_RATE_LIMITS, e.g. "https://blockchain.info=2:4:2;https://..."
+        for entry in filter(None, os.getenv("HTTP_RATE_LIMITS", "").split(";")):
+            host_url, values = entry.rsplit("=", 1)
+            rate, burst, max_in_flight = values.split(":")
+            configure_host(host_url, float(rate), int(burst), int(max_in_flight))
+        _env_limits_loaded = True
+
+    host = get_host(url)
+    governor = _governors.get(host)
+    if governor is None:
+        governor = _governors[host] = HostGovernor(*_host_limits.get(host, _default_limits))
+    return governor
+
+
+def record_status(host: str, status_code: int):
+    """
+    Counts the provider errors of a response in the metrics.
+    :param host: The host the response came from.
+    :param status_code: The status code of the response.
+    """
+    if status_code == 429:
+        provider_errors.inc(host=host, reason="429")
+    elif status_code >= 500:
+        provider_errors.inc(host=host, reason="5xx")
+
+
+def get_client(base_url: str) -> httpx.AsyncClient:
+    """
+    Retrieves the shared HTTP client for a host, creating it on first use.
+    :param base_url: The base URL of the host.
+    :return: The pooled asynchronous HTTP client for the host.
+    """
+    client = _clients.get(base_url)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(base_url=base_url, timeout=_timeout, limits=_limits)
+        _clients[base_url] = client
+    return client
+
+
+async def request(method: str, base_url: str, path: str, **kwargs) -> httpx.Response:
+    """
+    Sends a request through the host's request governor, retrying when the host rate-limits us.
+    :param method: The HTTP method.
+    :param base_url: The base URL of the host.
+    :param path: The path to request.
+    :param kwargs: Additional arguments passed to the HTTP client.
+    :return: The response of the host.
+    """
+    governor = get_governor(base_url)
+    host = get_host(base_url)
+    attempt = 0
+    while True:
+        async with governor:
+            started_at = perf_counter()
+            try:
+                response = await get_client(base_url).request(method, path, **kwargs)
+            except Exception:
+                provider_errors.inc(host=host, reason="error")
+                raise
+            finally:
+                provider_latency.observe(perf_counter() - started_at, host=host)
+        record_status(host, response.status_code)
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= governor.max_retries:
+            return response
+        await governor.back_off(attempt, response.headers.get("Retry-After"))
+        attempt += 1
+
+
+async def fetch(base_url: str, path: str, **kwargs) -> httpx.Response:
+    """
+    Sends a GET request through the host's request governor.
+    :param base_url: The base URL of the host.
+    :param path: The path to request.
+    :param kwargs: Additional arguments passed to the HTTP client.
+    :return: The response of the host.
+    """
+    return await request("GET", base_url, path, **kwargs)
+
+
+async def close_clients():
+    """
+    Closes every pooled HTTP client.
+    """
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
@@ -0,0 +1,408 @@
+import asyncio
+import json
+from collections import OrderedDict, deque
+from time import monotonic, time
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from interactions import EmbedField
+
+from helpers.store import TransactionStore
+from helpers.transaction import Transaction
+
+if TYPE_CHECKING:
+    from crypto.base import Coin, CoinSymbol
+    from helpers.notifier import Delivery
+
+# Messages are single JSON lines, well below this size
+MAX_MESSAGE_SIZE = 1024 * 1024
+# Confirmations remembered by the bot, so the ones sent again before they were acknowledged are only notified once
+MAX_HANDLED_CONFIRMATIONS = 10_000
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """
+    Splits a host:port address.
+    :param address: The address to split.
+    :return: The host and the port.
+    """
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def encode_transaction(tx: Transaction) -> dict:
+    """
+    Converts a transaction into a message payload.
+    :param tx: The transaction to convert.
+    :return: The JSON-serializable transaction.
+    """
+    return {
+        "coin": tx.coin.symbol.value,
+        "txid": tx.id,
+        "user_id": int(tx.user_id),
+        "channel_id": int(tx.channel_id),
+        "fee": tx.fee,
+        "required_confirmations": tx.required_confirmations,
+        "block_height": tx.block_height
+    }
+
+
+def decode_transaction(data: dict, coins: dict["CoinSymbol", "Coin"]) -> Transaction | None:
+    """
+    Converts a message payload back into a transaction.
+    :param data: The JSON-serializable transaction.
+    :param coins: The supported coins, keyed by symbol.
+    :return: The transaction, or None if its coin isn't supported by this process.
+    """
+    coin = coins.get(data["coin"])
+    if coin is None:
+        return None
+    return Transaction(coin, data["txid"], data["user_id"], data["channel_id"], data["fee"],
+                       data["required_confirmations"], data["block_height"])
+
+
+class MessageStream:
+
+    def __init__(self):
+        """
+        Exchanges JSON messages over a local connection.
+        Outgoing messages wait in an outbox while disconnected and are sent once a connection is available.
+        """
+        self._outbox: deque[dict] = deque()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._outbox)
+
+    def send(self, message: dict):
+        """
+        Queues a message to be sent. Returns immediately.
+        :param message: The message to send.
+        """
+        self._outbox.append(message)
+        self._wakeup.set()
+
+    async def _write(self, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._outbox:
+                    # Taken before writing, so several connections can share the outbox
+                    message = self._outbox.popleft()
+                    try:
+                        writer.write(json.dumps(message).encode() + b"\n")
+                        await writer.drain()
+                    except BaseException:
+                        # Sent again once a connection is available
+                        self._outbox.appendleft(message)
+                        raise
+        except ConnectionError:
+            # Ends the read loop as well
+            writer.close()
+
+    async def serve(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+            on_message: Callable[[dict], Awaitable]
+    ):
+        """
+        Sends the queued messages and handles the received messages until the connection closes.
+        :param reader: The reader of the connection.
+        :param writer: The writer of the connection.
+        :param on_message: The callback awaited with every received message.
+        """
+        self._wakeup.set()
+        write_task = asyncio.create_task(self._write(writer))
+        try:
+            while line := await reader.readline():
+                await on_message(json.loads(line))
+        finally:
+            write_task.cancel()
+            writer.close()
+
+
+class MonitorClient(MessageStream):
+
+    def __init__(
+            self,
+            address: str,
+            coins: dict["CoinSymbol", "Coin"],
+            on_confirmed: Callable[[Transaction, list[EmbedField], float | None], Awaitable[asyncio.Future]],
+            min_backoff: float = 1,
+            max_backoff: float = 30,
+            handled: OrderedDict[int, bool] | None = None,
+            on_match: Callable[[Transaction], None] | None = None
+    ):
+        """
+        Connects the bot to a monitor worker, sending it new watches and receiving the watches that confirmed.
+        Every confirmation is acknowledged once its notification was delivered, so the worker can forget it.
+        Confirmations that couldn't be delivered stay with the worker, which sends them again on the next connection.
+        :param address: The host:port address of the monitor worker.
+        :param coins: The supported coins, keyed by symbol.
+        :param on_confirmed: The callback awaited with every confirmed watch, its embed fields and the monotonic
+        time it reached its required number of confirmations, returning the future of its Delivery.
+        :param min_backoff: The number of seconds waited before the first reconnection attempt.
+        :param max_backoff: The maximum number of seconds waited between reconnection attempts.
+        :param handled: The watch IDs of the latest handled confirmations, shared by the clients of every worker,
+        mapped to whether their notification was delivered.
+        :param on_match: The callback called with every transaction the worker found for a watched address but
+        doesn't own, to hand it over to the worker that does. Sent back to the same worker when not set.
+        """
+        super().__init__()
+        self.host, self.port = parse_address(address)
+        self.coins = coins
+        self.on_confirmed = on_confirmed
+        self.on_match = on_match or self.send_match
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.handled = OrderedDict() if handled is None else handled
+        self.connected = False
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        """
+        Starts connecting to the monitor worker in the background.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    def stop(self) -> list[dict]:
+        """
+        Disconnects from the monitor worker.
+        :return: The messages that weren't sent yet.
+        """
+        if self._task is not None:
+            self._task.cancel()
+        unsent = list(self._outbox)
+        self._outbox.clear()
+        return unsent
+
+    def send_watch(self, tx: Transaction):
+        """
+        Hands a new watch over to the monitor worker. Returns immediately.
+        :param tx: The transaction to track.
+        """
+        self.send({"type": "watch", "tx": encode_transaction(tx)})
+
+    def send_match(self, tx: Transaction):
+        """
+        Hands a transaction found for a watched address over to the monitor worker. Returns immediately.
+        :param tx: The matched transaction, with the height of its block.
+        """
+        self.send({"type": "match", "tx": encode_transaction(tx)})
+
+    async def run(self):
+        """
+        Stays connected to the monitor worker until cancelled.
+        """
+        backoff = self.min_backoff
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port, limit=MAX_MESSAGE_SIZE)
+                self.connected = True
+                backoff = self.min_backoff
+                print(f"[*] Connected to monitor worker ({self.host}:{self.port})")
+                await self.serve(reader, writer, self._on_message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[!] Monitor worker connection error ({self.host}:{self.port}) {e!r}")
+            finally:
+                self.connected = False
+
+            # New watches wait in the outbox until the worker is back
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def _on_message(self, message: dict):
+        if message["type"] == "match":
+            tx = decode_transaction(message["tx"], self.coins)
+            if tx is not None:
+                self.on_match(tx)
+            return
+        if message["type"] != "confirmed":
+            return
+        watch_id = message["id"]
+        # Sent again because the acknowledgement didn't reach the worker, or still being delivered
+        if watch_id in self.handled:
+            if self.handled[watch_id]:
+                self._acknowledge(message)
+            return
+        tx = decode_transaction(message["tx"], self.coins)
+        if tx is None:
+            # Left with the worker for a bot process that supports the coin
+            return
+
+        fields = [EmbedField(**field) for field in message["fields"]]
+        # Wall clock times are comparable across processes, monotonic times aren't
+        reached_at = message["reached_at"]
+        if reached_at is not None:
+            reached_at = monotonic() - max(time() - reached_at, 0)
+        self.handled[watch_id] = False
+        while len(self.handled) > MAX_HANDLED_CONFIRMATIONS:
+            self.handled.popitem(last=False)
+        delivery = await self.on_confirmed(tx, fields, reached_at)
+        delivery.add_done_callback(lambda future: self._on_delivered(message, future.result()))
+
+    def _on_delivered(self, message: dict, delivery: "Delivery"):
+        # Imported here since the notifier uses the bot, whose module depends on this one
+        from helpers.notifier import Delivery
+
+        if delivery == Delivery.FAILED:
+            # Handled again when the worker sends it on the next connection
+            self.handled.pop(message["id"], None)
+            return
+        self.handled[message["id"]] = True
+        self._acknowledge(message)
+
+    def _acknowledge(self, message: dict):
+        # Carries the transaction like every message to a worker, so it can be routed to the new owner
+        tx_key = {"coin": message["tx"]["coin"], "txid": message["tx"]["txid"]}
+        self.send({"type": "ack", "id": message["id"], "tx": tx_key})
+
+
+class MonitorServer(MessageStream):
+
+    def __init__(
+            self,
+            address: str,
+            coins: dict["CoinSymbol", "Coin"],
+            on_watch: Callable[[Transaction], None],
+            store: TransactionStore,
+            on_match: Callable[[Transaction], None] | None = None
+    ):
+        """
+        Accepts the connections of the bot in a monitor worker, receiving new watches and sending the watches that
+        confirmed. Confirmations are kept in the store, committed together with the deletion of their watch, until
+        the bot acknowledges them, and are sent again whenever a bot connects, so they survive a restart of either
+        side. A confirmation can reach the bot twice, which only notifies it once. Transactions found for a watched
+        address but owned by another worker go through the bot, which routes them to their owner.
+        :param address: The host:port address to listen on.
+        :param coins: The supported coins, keyed by symbol.
+        :param on_watch: The callback called with every new watch.
+        :param store: The store keeping the confirmations that weren't acknowledged.
+        :param on_match: The callback called with every transaction found for a watched address that another worker
+        handed over. New watches are used when not set.
+        """
+        super().__init__()
+        self.host, self.port = parse_address(address)
+        self.coins = coins
+        self.on_watch = on_watch
+        self.on_match = on_match or on_watch
+        self.store = store
+        # Confirmations sent to the bot that it hasn't acknowledged yet, keyed by watch ID
+        self._unacked: dict[int, dict] = {}
+        self._server: asyncio.Server | None = None
+
+    def __len__(self):
+        return len(self._unacked)
+
+    async def start(self):
+        """
+        Starts listening for the bot.
+        """
+        self._server = await asyncio.start_server(self._on_connection, self.host, self.port, limit=MAX_MESSAGE_SIZE)
+        print(f"[*] Monitor worker listening on {self.host}:{self.port}")
+
+    async def send_confirmed(
+            self,
+            tx: Transaction,
+            fields: list[EmbedField],
+            reached_at: float | None = None
+    ) -> asyncio.Future:
+        """
+        Reports a confirmed watch to the bot. Returns immediately.
+        :param tx: The transaction that confirmed.
+        :param fields: The fields to add to the embed.
+        :param reached_at: The monotonic time the transaction reached its required number of confirmations.
+        :return: A resolved future, since the confirmation is kept in the store until the bot delivers it.
+        """
+        message = {
+            "type": "confirmed",
+            "id": tx.watch_id,
+            "tx": encode_transaction(tx),
+            "fields": [{"name": field.name, "value": field.value, "inline": field.inline} for field in fields],
+            "reached_at": None if reached_at is None else time() - (monotonic() - reached_at)
+        }
+        self._unacked[tx.watch_id] = message
+        self.store.save_confirmation(tx.watch_id, tx.coin.symbol.value, tx.id, message)
+        self.send(message)
+        # Imported here since the notifier uses the bot, whose module depends on this one
+        from helpers.notifier import Delivery
+
+        delivery = asyncio.get_running_loop().create_future()
+        delivery.set_result(Delivery.SENT)
+        return delivery
+
+    def hand_over(self, tx: Transaction):
+        """
+        Sends a transaction found for a watched address to the bot, which routes it to the worker that owns it.
+        Returns immediately.
+        :param tx: The matched transaction, with the height of its block.
+        """
+        self.send({"type": "match", "tx": encode_transaction(tx)})
+
+    async def claim_confirmations(self, owns: Callable[[str, str], bool]) -> int:
+        """
+        Starts reporting the stored confirmations assigned to this monitor worker, left by a worker that stopped
+        before the bot acknowledged them.
+        :param owns: Checks whether the transaction of a coin symbol and transaction ID is assigned to this worker.
+        :return: The number of confirmations claimed.
+        """
+        # Commit first, so acknowledged confirmations aren't restored from stale rows
+        await self.store.commit()
+        claimed = 0
+        for watch_id, symbol, txid, message in await asyncio.to_thread(self.store.load_confirmations):
+            if watch_id not in self._unacked and owns(symbol, txid):
+                self._unacked[watch_id] = message
+                self.send(message)
+                claimed += 1
+        return claimed
+
+    def release_confirmations(self, owns: Callable[[str, str], bool]) -> int:
+        """
+        Stops reporting the confirmations that are no longer assigned to this monitor worker. They stay in the store
+        for the worker they are assigned to.
+        :param owns: Checks whether the transaction of a coin symbol and transaction ID is assigned to this worker.
+        :return: The number of confirmations released.
+        """
+        released = [
+            watch_id for watch_id, message in self._unacked.items()
+            if not owns(message["tx"]["coin"], message["tx"]["txid"])
+        ]
+        for watch_id in released:
+            del self._unacked[watch_id]
+        self._outbox = deque(
+            message for message in self._outbox if message["type"] != "confirmed" or message["id"] in self._unacked
+        )
+        return len(released)
+
+    async def _on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Several bot processes may be connected when the gateway is sharded, any of them can send a confirmation
+        print("[*] Bot connected")
+        # Confirmations written to a connection that closed before they were acknowledged
+        queued = {message["id"] for message in self._outbox if message["type"] == "confirmed"}
+        for watch_id, message in self._unacked.items():
+            if watch_id not in queued:
+                self.send(message)
+        try:
+            await self.serve(reader, writer, self._on_message)
+        except Exception as e:
+            print(f"[!] Bot connection error {e!r}")
+
+    async def _on_message(self, message: dict):
+        if message["type"] == "ack":
+            # Acknowledgements are routed like watches, so the worker owning the transaction deletes it
+            self._unacked.pop(message["id"], None)
+            self.store.delete_confirmation(message["id"])
+            return
+        if message["type"] not in ("watch", "match"):
+            return
+        tx = decode_transaction(message["tx"], self.coins)
+        if tx is None:
+            return
+        if message["type"] == "match":
+            self.on_match(tx)
+        else:
+            self.on_watch(tx)
@@ -0,0 +1,113 @@
+import asyncio
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from helpers.metrics import cache_requests
+from helpers.tips import chain_tips
+
+if TYPE_CHECKING:
+    from crypto.base import Coin, CoinSymbol
+
+
+class MempoolSnapshots:
+
+    def __init__(self, max_age: float = 120, block_vsize: int = 1_000_000):
+        """
+        Keeps a fee histogram of the mempool of each coin so it is fetched once and shared by every confirmation
+        estimate. When blocks arrive, the snapshot is updated by taking the highest paying transactions out of it,
+        which is what miners include, instead of fetching it again.
+        :param max_age: The number of seconds a snapshot is reused before it is fetched again, which picks up the
+        transactions that arrived since.
+        :param block_vsize: The virtual size of the transactions that fit in a block.
+        """
+        self.max_age = max_age
+        self.block_vsize = block_vsize
+        # The fee rate and virtual size of each range of the mempool, from the highest fee rate down
+        self._histograms: dict["CoinSymbol", list[tuple[float, int]]] = {}
+        # The block height each snapshot is up to date with
+        self._heights: dict["CoinSymbol", int] = {}
+        self._updated_at: dict["CoinSymbol", float] = {}
+        self._locks: dict["CoinSymbol", asyncio.Lock] = {}
+        # Coins whose providers don't serve the mempool
+        self._unsupported: set["CoinSymbol"] = set()
+
+    def is_fresh(self, symbol: "CoinSymbol") -> bool:
+        """
+        Checks whether the snapshot of a coin can still be used.
+        :param symbol: The symbol of the coin.
+        :return: Whether the snapshot is recent enough.
+        """
+        return symbol in self._histograms and monotonic() - self._updated_at[symbol] < self.max_age
+
+    def advance(self, symbol: "CoinSymbol", height: int):
+        """
+        Takes the transactions of the blocks mined since the snapshot out of it, highest fee rate first.
+        :param symbol: The symbol of the coin.
+        :param height: The latest block height of the coin.
+        """
+        previous_height = self._heights.get(symbol)
+        if previous_height is None or height <= previous_height:
+            return
+
+        histogram = self._histograms[symbol]
+        mined_vsize = (height - previous_height) * self.block_vsize
+        while histogram and mined_vsize > 0:
+            fee_rate, vsize = histogram[0]
+            if vsize > mined_vsize:
+                histogram[0] = (fee_rate, vsize - mined_vsize)
+                break
+            histogram.pop(0)
+            mined_vsize -= vsize
+        self._heights[symbol] = height
+
+    async def get_histogram(self, coin: "Coin") -> list[tuple[float, int]]:
+        """
+        Retrieves the fee histogram of the mempool of a coin, fetching it only if the stored one is stale.
+        :param coin: The coin to retrieve the mempool of.
+        :return: The fee rate and virtual size of each range of the mempool, from the highest fee rate down.
+        :raises NotImplementedError: If the coin doesn't support mempool snapshots.
+        """
+        if coin.symbol in self._unsupported:
+            raise NotImplementedError()
+        if self.is_fresh(coin.symbol):
+            cache_requests.inc(cache="mempool", result="hit")
+        else:
+            cache_requests.inc(cache="mempool", result="miss")
+            lock = self._locks.setdefault(coin.symbol, asyncio.Lock())
+            updated_at = self._updated_at.get(coin.symbol)
+            async with lock:
+                # Another caller already fetched the snapshot while we were waiting for the lock
+                if self._updated_at.get(coin.symbol) == updated_at:
+                    try:
+                        histogram, height = await asyncio.gather(
+                            coin.get_mempool_histogram(), chain_tips.get_height(coin)
+                        )
+                    except NotImplementedError:
+                        self._unsupported.add(coin.symbol)
+                        raise
+                    self._histograms[coin.symbol] = sorted(histogram, reverse=True)
+                    self._heights[coin.symbol] = height
+                    self._updated_at[coin.symbol] = monotonic()
+
+        # Blocks seen since the snapshot was taken, through polling or the block feed
+        tip_height = chain_tips.peek(coin.symbol)
+        if tip_height is not None:
+            self.advance(coin.symbol, tip_height)
+        return self._histograms[coin.symbol]
+
+    async def get_blocks_until_confirmed(self, coin: "Coin", fee_rate: float) -> int:
+        """
+        Estimates in how many blocks an unconfirmed transaction will be mined, assuming miners keep including the
+        highest paying transactions first.
+        :param coin: The coin of the transaction.
+        :param fee_rate: The fee rate of the transaction, in the smallest unit of the coin per virtual byte.
+        :return: The estimated number of blocks, 1 if it should be in the next block.
+        :raises NotImplementedError: If the coin doesn't support mempool snapshots.
+        """
+        histogram = await self.get_histogram(coin)
+        # Transactions paying a higher fee rate are mined first
+        ahead_vsize = sum(vsize for range_fee_rate, vsize in histogram if range_fee_rate > fee_rate)
+        return ahead_vsize // self.block_vsize + 1
+
+
+mempool_snapshots = MempoolSnapshots()
@@ -0,0 +1,182 @@
+import functools
+from time import perf_counter
+from typing import Callable
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+
+    def __init__(self, name: str, description: str):
+        """
+        Represents a value that only goes up, such as a number of requests.
+        :param name: The name of the metric.
+        :param description: The description of the metric.
+        """
+        self.name = name
+        self.description = description
+        self._values: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Increases the counter.
+        :param amount: The amount to increase the counter by.
+        :param labels: The labels of the counter to increase.
+        """
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items())
+        return lines
+
+
+class Gauge:
+
+    def __init__(self, name: str, description: str, collect: Callable[[], dict[tuple[tuple[str, str], ...], float]]):
+        """
+        Represents a value read when the metrics are collected, such as a queue depth.
+        :param name: The name of the metric.
+        :param description: The description of the metric.
+        :param collect: The function returning the current values, keyed by their labels.
+        """
+        self.name = name
+        self.description = description
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        lines.extend(f"{self.name}{_format_labels(key)} {value}" for key, value in self.collect().items())
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Represents the distribution of observed values, such as request latencies.
+        :param name: The name of the metric.
+        :param description: The description of the metric.
+        :param buckets: The upper bounds of the buckets values are counted in.
+        """
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # Per label set: the count of every bucket, the sum and the count of observed values
+        self._values: dict[tuple[tuple[str, str], ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        """
+        Records a value.
+        :param value: The observed value.
+        :param labels: The labels of the histogram to record the value in.
+        """
+        key = tuple(sorted(labels.items()))
+        counts, totals = self._values.setdefault(key, ([0] * len(self.buckets), [0.0, 0]))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, (counts, (total, count)) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        """
+        Collects the metrics of the bot and renders them in the Prometheus text format.
+        """
+        self._metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, description))
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, description, buckets))
+
+    def gauge(self, name: str, description: str, collect: Callable) -> Gauge:
+        self._metrics[name] = Gauge(name, description, collect)
+        return self._metrics[name]
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text format.
+        :return: The rendered metrics.
+        """
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+metrics = MetricsRegistry()
+
+provider_latency = metrics.histogram("cryptotracker_provider_request_seconds", "Latency of provider requests by host.")
+provider_errors = metrics.counter("cryptotracker_provider_errors_total", "Failed provider requests by host and reason.")
+cache_requests = metrics.counter(
+    "cryptotracker_cache_requests_total", "Price, chain tip and mempool lookups by result."
+)
+reorgs = metrics.counter("cryptotracker_reorgs_total", "Reorgs detected in the block header index by coin.")
+cycle_duration = metrics.histogram("cryptotracker_monitor_cycle_seconds", "Duration of monitor runs by coin.")
+call_duration = metrics.histogram("cryptotracker_call_seconds", "Duration of instrumented calls.")
+notification_lag = metrics.histogram(
+    "cryptotracker_notification_lag_seconds",
+    "Time from a transaction reaching its target height to its Discord message being sent.",
+    (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+
+
+def timed(name: str):
+    """
+    Records the duration of every call to an asynchronous function.
+    :param name: The name of the call in the metrics.
+    :return: The decorator.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started_at = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                call_duration.observe(perf_counter() - started_at, call=name)
+        return wrapper
+    return decorator
+
+
+async def start_metrics_server(port: int) -> web.AppRunner:
+    """
+    Serves the metrics at /metrics in the Prometheus text format.
+    :param port: The port to listen on.
+    :return: The runner of the server.
+    """
+    async def handle(_: web.Request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    print(f"[*] Serving metrics on port {port}")
+    return runner
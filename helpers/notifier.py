@@ -0,0 +1,196 @@
+import asyncio
+from collections import deque
+from enum import Enum
+from time import monotonic
+
+from interactions import Embed, Snowflake
+from interactions.client.errors import HTTPException
+
+from helpers.http import HostGovernor
+from helpers.metrics import notification_lag, timed
+from helpers.shared import bot
+
+# Discord allows 10 embeds per message, with at most 6000 characters across all of them
+MAX_EMBEDS = 10
+MAX_EMBED_CHARACTERS = 6000
+
+
+class Delivery(Enum):
+    # Sent to the channel
+    SENT = "sent"
+    # Dropped because the channel is gone or can't be accessed, which a retry won't change
+    UNDELIVERABLE = "undeliverable"
+    # Dropped after failing on every retry
+    FAILED = "failed"
+
+
+@timed("send_tx_confirmed_embed")
+async def _send_message(channel, content: str, embeds: list[Embed]):
+    # Timed on its own, so the metric measures Discord rather than the time notifications wait in the queue
+    await channel.send(content=content, embeds=embeds)
+
+
+class Notification:
+    __slots__ = ("user_id", "embed", "reached_at", "attempts", "delivery")
+
+    def __init__(self, user_id: Snowflake, embed: Embed, reached_at: float, delivery: asyncio.Future):
+        """
+        Represents an embed waiting to be sent to a channel.
+        :param user_id: The ID of the user to mention.
+        :param embed: The embed to send.
+        :param reached_at: The monotonic time the event being notified happened at.
+        :param delivery: The future resolved with the outcome once the embed is sent or dropped.
+        """
+        self.user_id = user_id
+        self.embed = embed
+        self.reached_at = reached_at
+        self.attempts = 0
+        self.delivery = delivery
+
+    def resolve(self, delivery: Delivery):
+        if not self.delivery.done():
+            self.delivery.set_result(delivery)
+
+
+class NotificationDispatcher:
+
+    def __init__(self, channel_interval: float = 1, max_retries: int = 3):
+        """
+        Sends notifications in the background, combining the notifications going to the same channel into as few
+        messages as possible so a large block doesn't flood Discord's rate limits or hold up monitoring.
+        :param channel_interval: The minimum number of seconds between two messages sent to the same channel.
+        :param max_retries: The number of times a failed message is sent again before its notifications are dropped.
+        """
+        self.channel_interval = channel_interval
+        self.max_retries = max_retries
+        self._queues: dict[Snowflake, deque[Notification]] = {}
+        self._next_send_at: dict[Snowflake, float] = {}
+        self._sending: set[Snowflake] = set()
+        # Referenced until they finish, since the event loop only keeps weak references to tasks
+        self._send_tasks: set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        # Stays below Discord's global limit of 50 requests per second
+        self._governor = HostGovernor(rate=40, burst=40, max_in_flight=10)
+        self._task: asyncio.Task | None = None
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def start(self):
+        """
+        Starts sending queued notifications in the background.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    def enqueue(
+            self,
+            channel_id: Snowflake,
+            user_id: Snowflake,
+            embed: Embed,
+            reached_at: float | None = None
+    ) -> asyncio.Future:
+        """
+        Queues an embed to be sent to a channel. Returns immediately.
+        :param channel_id: The ID of the channel to send the embed to.
+        :param user_id: The ID of the user to mention.
+        :param embed: The embed to send.
+        :param reached_at: The monotonic time the event being notified happened at, defaults to now.
+        :return: The future resolved with the Delivery outcome once the embed is sent or dropped.
+        """
+        delivery = asyncio.get_running_loop().create_future()
+        notification = Notification(user_id, embed, reached_at or monotonic(), delivery)
+        self._queues.setdefault(channel_id, deque()).append(notification)
+        self._wakeup.set()
+        return delivery
+
+    def _take_batch(self, channel_id: Snowflake) -> list[Notification]:
+        queue = self._queues[channel_id]
+        batch = []
+        characters = 0
+        while queue and len(batch) < MAX_EMBEDS:
+            characters += len(queue[0].embed)
+            if batch and characters > MAX_EMBED_CHARACTERS:
+                break
+            batch.append(queue.popleft())
+        if not queue:
+            del self._queues[channel_id]
+        return batch
+
+    async def run(self):
+        """
+        Sends queued notifications until cancelled.
+        """
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            now = monotonic()
+            next_wakeup = None
+            for channel_id in list(self._queues):
+                if channel_id in self._sending:
+                    continue
+                send_at = self._next_send_at.get(channel_id, 0)
+                if send_at > now:
+                    next_wakeup = min(next_wakeup or send_at, send_at)
+                    continue
+                self._sending.add(channel_id)
+                task = asyncio.create_task(self._send(channel_id, self._take_batch(channel_id)))
+                self._send_tasks.add(task)
+                task.add_done_callback(self._send_tasks.discard)
+
+            # Forget the channels that are allowed to send again and have nothing left to send
+            for channel_id, send_at in list(self._next_send_at.items()):
+                if send_at <= now and channel_id not in self._queues and channel_id not in self._sending:
+                    del self._next_send_at[channel_id]
+
+            # Come back when the next channel is allowed to send again
+            if next_wakeup is not None:
+                asyncio.get_running_loop().call_later(next_wakeup - now, self._wakeup.set)
+
+    async def _send(self, channel_id: Snowflake, batch: list[Notification]):
+        retry_after = None
+        try:
+            channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+            if channel is None:
+                print(f"[!] Dropped {len(batch)} notification(s) for unknown channel {channel_id}")
+                for notification in batch:
+                    notification.resolve(Delivery.UNDELIVERABLE)
+                return
+
+            mentions = " ".join(dict.fromkeys(f"<@{notification.user_id}>" for notification in batch))
+            async with self._governor:
+                await _send_message(channel, mentions, [notification.embed for notification in batch])
+
+            sent_at = monotonic()
+            for notification in batch:
+                notification_lag.observe(sent_at - notification.reached_at)
+                notification.resolve(Delivery.SENT)
+        except Exception as e:
+            # Missing access or a deleted channel won't succeed on a retry
+            if isinstance(e, HTTPException) and e.status in (403, 404):
+                print(f"[!] Dropped {len(batch)} notification(s) for channel {channel_id} {e}")
+                for notification in batch:
+                    notification.resolve(Delivery.UNDELIVERABLE)
+                return
+
+            retried = []
+            for notification in batch:
+                if notification.attempts < self.max_retries:
+                    notification.attempts += 1
+                    retried.append(notification)
+                else:
+                    notification.resolve(Delivery.FAILED)
+            if len(retried) < len(batch):
+                print(f"[!] Dropped {len(batch) - len(retried)} notification(s) for channel {channel_id} {e}")
+            # Put the notifications back at the front of the queue, in their original order
+            self._queues.setdefault(channel_id, deque()).extendleft(reversed(retried))
+            retry_after = self.channel_interval * 2 ** max((n.attempts for n in retried), default=0)
+        finally:
+            self._next_send_at[channel_id] = monotonic() + (retry_after or self.channel_interval)
+            self._sending.discard(channel_id)
+            if channel_id in self._queues:
+                asyncio.get_running_loop().call_later(retry_after or self.channel_interval, self._wakeup.set)
+
+
+notifier = NotificationDispatcher()
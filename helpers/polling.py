@@ -0,0 +1,80 @@
+import random
+from time import monotonic
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from crypto.base import Coin, CoinSymbol
+
+
+class PollingScheduler:
+
+    def __init__(self, backoff: float = 2, jitter: float = 0.2, max_tip_interval: float = 10):
+        """
+        Decides how often each coin's chain tip and unconfirmed transactions are polled, based on the coin's block time.
+        An unconfirmed transaction can only be mined when a new block arrives, so it is polled as soon as the tip
+        advances and otherwise backs off while its result doesn't change.
+        :param backoff: The factor the polling interval grows by after an unchanged result.
+        :param jitter: The fraction of the interval randomly added or removed, so polls don't all line up.
+        :param max_tip_interval: The maximum number of seconds between chain tip refreshes while no block feed is
+        connected, so a new block is never noticed later than by polling every coin on that cadence.
+        """
+        self.backoff = backoff
+        self.jitter = jitter
+        self.max_tip_interval = max_tip_interval
+        self._tips: dict["CoinSymbol", float] = {}
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def get_tip_interval(self, coin: "Coin", near_target: bool, pushed: bool = False) -> float:
+        """
+        Calculates the number of seconds between chain tip refreshes of a coin.
+        :param coin: The coin to calculate the interval of.
+        :param near_target: Whether a tracked transaction reaches its target height on the next block.
+        :param pushed: Whether new blocks are pushed by a block feed, in which case polling is only a safety net.
+        :return: The number of seconds between refreshes.
+        """
+        if pushed:
+            return coin.block_time
+        interval = min(coin.block_time / 10, self.max_tip_interval)
+        return interval / 3 if near_target else interval
+
+    def should_refresh_tip(self, coin: "Coin") -> bool:
+        """
+        Checks whether the chain tip of a coin should be fetched again.
+        :param coin: The coin to check.
+        :return: Whether the chain tip is due for a refresh.
+        """
+        return monotonic() >= self._tips.get(coin.symbol, 0)
+
+    def tip_refreshed(self, coin: "Coin", near_target: bool, pushed: bool = False):
+        """
+        Schedules the next chain tip refresh of a coin.
+        :param coin: The coin whose chain tip was refreshed.
+        :param near_target: Whether a tracked transaction reaches its target height on the next block.
+        :param pushed: Whether new blocks are pushed by a block feed.
+        """
+        self._tips[coin.symbol] = monotonic() + self._jittered(self.get_tip_interval(coin, near_target, pushed))
+
+    def get_poll_interval(self, coin: "Coin", previous_interval: float | None) -> float:
+        """
+        Calculates the number of seconds until an unconfirmed transaction is polled again, backing off while it
+        stays unconfirmed. The transaction is polled earlier anyway if the tip advances.
+        :param coin: The coin of the transaction.
+        :param previous_interval: The interval used after the previous poll, or None if it is the first poll.
+        :return: The number of seconds between polls.
+        """
+        if previous_interval is None:
+            return coin.block_time / 2
+        return min(previous_interval * self.backoff, coin.block_time * 3)
+
+    def get_next_poll_at(self, interval: float) -> float:
+        """
+        Calculates when an unconfirmed transaction should be polled next.
+        :param interval: The number of seconds between polls of the transaction.
+        :return: The jittered monotonic time of the next poll.
+        """
+        return monotonic() + self._jittered(interval)
+
+
+polling_scheduler = PollingScheduler()
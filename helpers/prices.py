@@ -0,0 +1,71 @@
+import asyncio
+import os
+from time import monotonic
+
+from helpers.http import fetch
+from helpers.metrics import cache_requests
+
+
+class PriceService:
+
+    def __init__(self, max_age: float = 30):
+        """
+        Keeps the USD prices of every ticker in memory, refreshing them all with a single request.
+        Stale prices are still served while they are refreshed in the background, and concurrent refreshes are
+        merged into one request.
+        :param max_age: The number of seconds after which prices are refreshed on the next lookup.
+        """
+        self.max_age = max_age
+        self._rates: dict[str, float] = {}
+        self._updated_at = 0.0
+        self._refresh: asyncio.Task | None = None
+
+    def is_fresh(self):
+        """
+        Checks whether the stored prices are recent enough to be served without refreshing them.
+        :return: Whether the stored prices are fresh.
+        """
+        return monotonic() - self._updated_at < self.max_age
+
+    async def _fetch_all(self):
+        r = await fetch(os.getenv("TICKER_API_URL", "https://api.blockchain.com"), "/v3/exchange/tickers")
+        if not r.is_success:
+            raise Exception("Failed to retrieve current prices")
+        for ticker in r.json():
+            if ticker.get("last_trade_price") is not None:
+                self._rates[ticker["symbol"]] = ticker["last_trade_price"]
+        self._updated_at = monotonic()
+
+    def refresh(self) -> asyncio.Task:
+        """
+        Refreshes every price, joining the refresh that is already running if there is one.
+        :return: The task refreshing the prices.
+        """
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._fetch_all())
+            # Retrieve the exception of background refreshes nobody waits on, so it isn't reported as unhandled
+            self._refresh.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._refresh
+
+    async def get_usd_rate(self, symbol: str) -> float:
+        """
+        Retrieves the last trade price of a cryptocurrency in USD.
+        :param symbol: The symbol of the cryptocurrency.
+        :return: The last trade price of the cryptocurrency in USD.
+        """
+        ticker_symbol = symbol + "-USD"
+        rate = self._rates.get(ticker_symbol)
+        cache_requests.inc(cache="price", result="hit" if rate is not None else "miss")
+        if rate is not None:
+            if not self.is_fresh():
+                self.refresh()
+            return rate
+
+        # Nothing to serve yet, so wait for the prices to be fetched
+        await asyncio.shield(self.refresh())
+        if ticker_symbol not in self._rates:
+            raise Exception(f"Failed to retrieve current {ticker_symbol} price")
+        return self._rates[ticker_symbol]
+
+
+prices = PriceService()
@@ -0,0 +1,227 @@
+import asyncio
+import os
+from collections import deque
+from time import monotonic, perf_counter
+
+import httpx
+
+from helpers.http import RETRY_STATUS_CODES, get_host, request
+from helpers.metrics import metrics
+
+# Every provider pool, so their health can be collected in the metrics
+_pools: list["ProviderPool"] = []
+
+hedged_requests = metrics.counter("cryptotracker_provider_hedged_requests_total", "Hedged provider requests by pool.")
+metrics.gauge(
+    "cryptotracker_provider_up",
+    "Whether a provider backend is in rotation, by pool and host.",
+    lambda: {
+        (("host", get_host(backend.url)), ("pool", pool.name)): float(backend.is_healthy())
+        for pool in _pools for backend in pool.backends
+    }
+)
+
+
+def _discard_result(task: asyncio.Task):
+    # Requests that lost the race may still fail, which must be retrieved so it isn't reported as never retrieved
+    if not task.cancelled():
+        task.exception()
+
+
+class Backend:
+
+    def __init__(self, url: str, window: int = 200):
+        """
+        Represents one of the interchangeable base URLs of a provider pool, with its recent latency and health.
+        :param url: The base URL of the backend.
+        :param window: The number of recent latencies kept to estimate the percentiles of the backend.
+        """
+        self.url = url
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.failures = 0
+        self.down_until = 0.0
+        self.cooldown = 0.0
+
+    def is_healthy(self) -> bool:
+        return monotonic() >= self.down_until
+
+    def get_percentile(self, percentile: float) -> float | None:
+        """
+        Estimates a percentile of the recent latencies of the backend.
+        :param percentile: The percentile, between 0 and 1.
+        :return: The latency in seconds, or None if the backend hasn't answered yet.
+        """
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * percentile), len(latencies) - 1)]
+
+    def succeeded(self, latency: float):
+        self.latencies.append(latency)
+        self.failures = 0
+        self.cooldown = 0
+
+    def failed(self, max_failures: int, base_cooldown: float, max_cooldown: float):
+        """
+        Counts a failed request, taking the backend out of rotation after too many failures in a row.
+        A backend that fails again right after coming back is taken out for twice as long.
+        """
+        self.failures += 1
+        if self.failures >= max_failures:
+            self.cooldown = min(max_cooldown, self.cooldown * 2 or base_cooldown)
+            self.down_until = monotonic() + self.cooldown
+            self.failures = 0
+            print(f"[!] Provider {get_host(self.url)} out of rotation for {self.cooldown:.0f}s")
+
+
+class ProviderPool:
+
+    def __init__(
+            self,
+            name: str,
+            urls: list[str],
+            hedge_percentile: float = 0.95,
+            min_samples: int = 20,
+            default_hedge_delay: float = 1,
+            max_failures: int = 3,
+            base_cooldown: float = 30,
+            max_cooldown: float = 600
+    ):
+        """
+        Sends requests to several interchangeable backends of a provider, preferring the fastest healthy one.
+        A request that takes longer than the usual slow response of its backend is hedged with a second backend, and
+        the first usable response wins. Backends that keep failing are taken out of rotation for a while.
+        :param name: The name of the pool, used in logs and metrics.
+        :param urls: The base URLs of the backends, in order of preference.
+        :param hedge_percentile: The percentile of the latency of a backend after which its requests are hedged.
+        :param min_samples: The number of responses needed before the latency percentile of a backend is trusted.
+        :param default_hedge_delay: The number of seconds after which requests are hedged until then.
+        :param max_failures: The number of failures in a row that take a backend out of rotation.
+        :param base_cooldown: The number of seconds a backend is first taken out of rotation for.
+        :param max_cooldown: The maximum number of seconds a backend is taken out of rotation for.
+        """
+        self.name = name
+        self.backends = [Backend(url) for url in urls]
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.default_hedge_delay = default_hedge_delay
+        self.max_failures = max_failures
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        _pools.append(self)
+
+    @classmethod
+    def from_env(cls, name: str, variable: str, default: str) -> "ProviderPool":
+        """
+        Builds a pool from a comma-separated list of base URLs in an environment variable.
+        :param name: The name of the pool.
+        :param variable: The name of the environment variable.
+        :param default: The base URLs used when the variable isn't set.
+        :return: The provider pool.
+        """
+        urls = os.getenv(variable) or default
+        return cls(name, [url.strip().rstrip("/") for url in urls.split(",") if url.strip()])
+
+    def _rank(self) -> list[Backend]:
+        healthy = [backend for backend in self.backends if backend.is_healthy()]
+        if not healthy:
+            # Keep trying the backend that comes back first rather than failing every request
+            return sorted(self.backends, key=lambda backend: backend.down_until)
+
+        def median(backend: Backend) -> float:
+            latency = backend.get_percentile(0.5)
+            return latency if latency is not None else 0
+
+        # Untried backends come first so every backend gets latency samples, then the fastest ones
+        return sorted(healthy, key=median)
+
+    def _get_hedge_delay(self, backend: Backend) -> float:
+        if len(backend.latencies) < self.min_samples:
+            return self.default_hedge_delay
+        return backend.get_percentile(self.hedge_percentile)
+
+    async def _send(self, backend: Backend, method: str, path: str, **kwargs) -> httpx.Response:
+        started_at = perf_counter()
+        try:
+            response = await request(method, backend.url, path, **kwargs)
+        except asyncio.CancelledError:
+            # Lost a hedged race: the time waited so far still tells how slow the backend is
+            backend.latencies.append(perf_counter() - started_at)
+            raise
+        except Exception:
+            backend.failed(self.max_failures, self.base_cooldown, self.max_cooldown)
+            raise
+        if response.status_code >= 500 or response.status_code in RETRY_STATUS_CODES:
+            backend.failed(self.max_failures, self.base_cooldown, self.max_cooldown)
+        else:
+            backend.succeeded(perf_counter() - started_at)
+        return response
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Sends a request to the preferred backend, hedging it with the next one if it is slow and failing over to the
+        next ones if it fails. Requests must be safe to send twice.
+        :param method: The HTTP method.
+        :param path: The path to request, relative to the base URL of the backends.
+        :param kwargs: Additional arguments passed to the HTTP client.
+        :return: The first usable response, or the last response if every backend failed.
+        :raises Exception: If every backend failed without a response, or if the pool has no backend.
+        """
+        if not self.backends:
+            raise Exception(f"No backend is configured for the {self.name} provider")
+        backends = iter(self._rank())
+        primary = next(backends)
+        in_flight: dict[asyncio.Task, Backend] = {}
+        hedged = False
+        last_response, last_error = None, None
+
+        def start(backend: Backend):
+            in_flight[asyncio.create_task(self._send(backend, method, path, **kwargs))] = backend
+
+        start(primary)
+        try:
+            while in_flight:
+                timeout = None if hedged or len(self.backends) < 2 else self._get_hedge_delay(primary)
+                done, _ = await asyncio.wait(in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The primary backend is slower than usual, so race it with the next one
+                    hedged = True
+                    backend = next(backends, None)
+                    if backend is not None:
+                        hedged_requests.inc(pool=self.name)
+                        start(backend)
+                    continue
+
+                for task in done:
+                    del in_flight[task]
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if response.status_code < 500 and response.status_code not in RETRY_STATUS_CODES:
+                        return response
+                    last_response = response
+
+                # Fail over to the next backend right away
+                if not in_flight and (backend := next(backends, None)) is not None:
+                    hedged = True
+                    start(backend)
+        finally:
+            # Includes the requests that finished along with the returned one but weren't looked at
+            for task in in_flight:
+                task.cancel()
+                task.add_done_callback(_discard_result)
+
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+    async def fetch(self, path: str, **kwargs) -> httpx.Response:
+        """
+        Sends a GET request through the pool.
+        :param path: The path to request, relative to the base URL of the backends.
+        :param kwargs: Additional arguments passed to the HTTP client.
+        :return: The first usable response.
+        """
+        return await self.request("GET", path, **kwargs)
@@ -0,0 +1,520 @@
+import heapq
+from array import array
+from time import monotonic
+from typing import TYPE_CHECKING, Callable
+
+from helpers.transaction import Transaction, register_coin
+
+if TYPE_CHECKING:
+    from crypto.base import Coin, CoinSymbol
+
+TXID_SIZE = 32
+
+# Markers of the transaction ID index and of the block height and poll columns
+_EMPTY = -1
+_DELETED = -2
+_NONE = -1
+
+
+class WatchTable:
+
+    def __init__(self, coin: "Coin"):
+        """
+        Stores the watches of a coin in columns of fixed-width values, so a watch costs under a hundred bytes with its
+        index entry instead of a Python object per field. Rows of removed watches are reused by the next watches added.
+        Watches of the same transaction are chained together and found through a hash index of transaction IDs.
+        :param coin: The coin of the watches.
+        """
+        self.coin = coin
+        register_coin(coin)
+        # A watch ID of 0 marks a free row
+        self.watch_ids = array("q")
+        self.raw_ids = bytearray()
+        self.user_ids = array("Q")
+        self.channel_ids = array("Q")
+        self.fees = array("q")
+        # Commands cap the required confirmations well below 256
+        self.required_confirmations = array("B")
+        self.block_heights = array("i")
+        # The next row watching the same transaction
+        self.next_rows = array("i")
+        # When the transaction of an unconfirmed row should be polled next
+        self.next_poll_at = array("d")
+        self.poll_intervals = array("f")
+        self._free_rows = array("i")
+        self._count = 0
+        # Unconfirmed watches that only need one confirmation, so they reach their target with the next block
+        self.next_block_watches = 0
+        self._tip_height = _NONE
+        # Rows by the second of their next poll, with a heap of those seconds. Every unconfirmed row is in the bucket
+        # of its next poll, and is only due if its next poll still falls in the bucket it is found in, later polls
+        # having added it to another bucket
+        self._poll_buckets: dict[int, array] = {}
+        self._poll_seconds: list[int] = []
+        # Open addressing index from transaction ID to the first row watching it
+        self._index = array("i", [_EMPTY]) * 8
+        self._index_used = 0
+
+    def __len__(self):
+        return self._count
+
+    def _raw_id(self, row: int) -> bytes:
+        return bytes(self.raw_ids[row * TXID_SIZE:(row + 1) * TXID_SIZE])
+
+    def _lookup(self, raw_id: bytes) -> int:
+        # Position of the transaction ID in the index, or -1 if it isn't tracked
+        mask = len(self._index) - 1
+        position = hash(raw_id) & mask
+        while (row := self._index[position]) != _EMPTY:
+            if row != _DELETED and self.raw_ids[row * TXID_SIZE:(row + 1) * TXID_SIZE] == raw_id:
+                return position
+            position = (position + 1) & mask
+        return -1
+
+    def _insert(self, raw_id: bytes, row: int):
+        # Keep the index at most two thirds full, counting deleted entries
+        if (self._index_used + 1) * 3 > len(self._index) * 2:
+            self._resize()
+        mask = len(self._index) - 1
+        position = hash(raw_id) & mask
+        while self._index[position] >= 0:
+            position = (position + 1) & mask
+        if self._index[position] == _EMPTY:
+            self._index_used += 1
+        self._index[position] = row
+
+    def _resize(self, count: int = 0):
+        # Room for the current transaction IDs and count new ones, keeping the index at most half full
+        heads = [row for row in self._index if row >= 0]
+        size = 8
+        while size < (len(heads) + count) * 2:
+            size *= 2
+        self._index = array("i", [_EMPTY]) * size
+        self._index_used = 0
+        for row in heads:
+            self._insert(self._raw_id(row), row)
+
+    def _chain(self, row: int) -> list[int]:
+        rows = []
+        while row != _NONE:
+            rows.append(row)
+            row = self.next_rows[row]
+        return rows
+
+    def _is_unconfirmed(self, row: int) -> bool:
+        return self.watch_ids[row] != 0 and self.block_heights[row] == _NONE
+
+    def _schedule_poll(self, row: int):
+        second = int(self.next_poll_at[row])
+        bucket = self._poll_buckets.get(second)
+        if bucket is None:
+            bucket = self._poll_buckets[second] = array("i")
+            heapq.heappush(self._poll_seconds, second)
+        bucket.append(row)
+
+    def find_row(self, tx: Transaction) -> int:
+        """
+        Finds the row of a watch, through the row of the record or, for records loaded from the store that don't have
+        one, through the other watches of the same transaction.
+        :param tx: The transaction to find.
+        :return: The row of the watch, or -1 if it isn't tracked.
+        """
+        if tx.slot is not None and tx.slot < len(self.watch_ids) and self.watch_ids[tx.slot] == tx.watch_id:
+            return tx.slot
+        position = self._lookup(tx.raw_id)
+        if position >= 0:
+            for row in self._chain(self._index[position]):
+                if self.watch_ids[row] == tx.watch_id:
+                    return row
+        return -1
+
+    def get(self, row: int) -> Transaction:
+        """
+        Builds the transaction record of a row.
+        :param row: The row of the watch.
+        :return: The watched transaction.
+        """
+        block_height = self.block_heights[row]
+        return Transaction.from_record(
+            self.coin.index, self._raw_id(row), self.user_ids[row], self.channel_ids[row], self.fees[row],
+            self.required_confirmations[row], None if block_height == _NONE else block_height, self.watch_ids[row],
+            row
+        )
+
+    def add(self, tx: Transaction):
+        """
+        Stores a watch and sets its row.
+        :param tx: The transaction to add, which must have a watch ID.
+        """
+        if len(tx.raw_id) != TXID_SIZE:
+            raise ValueError(f"Transaction IDs must be {TXID_SIZE} bytes long")
+        values = (tx.watch_id, tx.user_id, tx.channel_id, int(tx.fee), tx.required_confirmations,
+                  _NONE if tx.block_height is None else tx.block_height)
+        if self._free_rows:
+            row = self._free_rows.pop()
+            (self.watch_ids[row], self.user_ids[row], self.channel_ids[row], self.fees[row],
+             self.required_confirmations[row], self.block_heights[row]) = values
+            self.raw_ids[row * TXID_SIZE:(row + 1) * TXID_SIZE] = tx.raw_id
+        else:
+            row = len(self.watch_ids)
+            for column, value in zip((self.watch_ids, self.user_ids, self.channel_ids, self.fees,
+                                      self.required_confirmations, self.block_heights), values):
+                column.append(value)
+            self.raw_ids += tx.raw_id
+            self.next_rows.append(_NONE)
+            self.next_poll_at.append(0)
+            self.poll_intervals.append(0)
+
+        position = self._lookup(tx.raw_id)
+        self.next_poll_at[row] = 0
+        self.poll_intervals[row] = 0
+        if position >= 0:
+            # Join the other watches of the transaction, sharing their poll state unless it went stale once mined
+            head = self._index[position]
+            self.next_rows[row] = head
+            self._index[position] = row
+            if self._is_unconfirmed(head):
+                self.next_poll_at[row] = self.next_poll_at[head]
+                self.poll_intervals[row] = self.poll_intervals[head]
+        else:
+            self.next_rows[row] = _NONE
+            self._insert(tx.raw_id, row)
+        if tx.block_height is None:
+            self._schedule_poll(row)
+            if tx.required_confirmations <= 1:
+                self.next_block_watches += 1
+        tx.slot = row
+        self._count += 1
+
+    def load(self, records: list[tuple], keep: Callable[[int, str], bool]) -> list[tuple[int, int]]:
+        """
+        Stores watches in bulk, straight from the records of the store, filling the columns without building a
+        transaction for each watch. Watches that are already tracked are skipped.
+        :param records: The watch ID, transaction ID, user ID, channel ID, fee, required confirmations and block height
+        of every watch.
+        :param keep: Checks whether a watch should be tracked from its watch ID and transaction ID.
+        :return: The target height and row of every mined watch added, to be scheduled.
+        """
+        if (self._index_used + len(records)) * 3 > len(self._index) * 2:
+            self._resize(len(records))
+        index = self._index
+        mask = len(index) - 1
+        raw_ids = self.raw_ids
+        watch_ids = self.watch_ids
+        next_rows = self.next_rows
+        user_ids, channel_ids, fees, required_confirmations, block_heights = [], [], [], [], []
+        encode_txid = self.coin.encode_txid
+        first_row = row = len(watch_ids)
+        unconfirmed_rows = array("i")
+        mined = []
+        for watch_id, txid, user_id, channel_id, fee, confirmations, block_height in records:
+            if not keep(watch_id, txid):
+                continue
+            raw_id = encode_txid(txid)
+            if len(raw_id) != TXID_SIZE:
+                raise ValueError(f"Transaction IDs must be {TXID_SIZE} bytes long")
+
+            # Look the transaction ID up and find where it would be inserted in the same probe, the index having
+            # room for the whole batch
+            position = hash(raw_id) & mask
+            free_position = -1
+            while (head := index[position]) != _EMPTY:
+                if head == _DELETED:
+                    if free_position < 0:
+                        free_position = position
+                elif raw_ids[head * TXID_SIZE:(head + 1) * TXID_SIZE] == raw_id:
+                    break
+                position = (position + 1) & mask
+            if head == _EMPTY:
+                next_rows.append(_NONE)
+                if free_position < 0:
+                    free_position = position
+                    self._index_used += 1
+                index[free_position] = row
+            else:
+                if any(watch_ids[chained] == watch_id for chained in self._chain(head)):
+                    continue
+                # Join the other watches of the transaction, with a fresh poll state
+                next_rows.append(head)
+                index[position] = row
+            raw_ids += raw_id
+            watch_ids.append(watch_id)
+            user_ids.append(user_id)
+            channel_ids.append(channel_id)
+            fees.append(fee)
+            required_confirmations.append(confirmations)
+            if block_height is None:
+                block_heights.append(_NONE)
+                unconfirmed_rows.append(row)
+                if confirmations <= 1:
+                    self.next_block_watches += 1
+            else:
+                block_heights.append(block_height)
+                mined.append((block_height + confirmations - 1, row))
+            row += 1
+
+        for column, values in ((self.user_ids, user_ids), (self.channel_ids, channel_ids), (self.fees, fees),
+                               (self.required_confirmations, required_confirmations),
+                               (self.block_heights, block_heights)):
+            column.extend(values)
+        added = row - first_row
+        self.next_poll_at.frombytes(bytes(added * self.next_poll_at.itemsize))
+        self.poll_intervals.frombytes(bytes(added * self.poll_intervals.itemsize))
+        self._count += added
+        if unconfirmed_rows:
+            # Never polled, so due right away
+            bucket = self._poll_buckets.get(0)
+            if bucket is None:
+                bucket = self._poll_buckets[0] = array("i")
+                heapq.heappush(self._poll_seconds, 0)
+            bucket.extend(unconfirmed_rows)
+        return mined
+
+    def remove(self, tx: Transaction):
+        """
+        Removes a watch, freeing its row.
+        :param tx: The transaction to remove.
+        """
+        row = self.find_row(tx)
+        if row < 0:
+            raise KeyError(tx.watch_id)
+        position = self._lookup(tx.raw_id)
+        head = self._index[position]
+        if head == row:
+            next_row = self.next_rows[row]
+            if next_row == _NONE:
+                self._index[position] = _DELETED
+            else:
+                self._index[position] = next_row
+        else:
+            previous = head
+            while self.next_rows[previous] != row:
+                previous = self.next_rows[previous]
+            self.next_rows[previous] = self.next_rows[row]
+
+        if self.block_heights[row] == _NONE and self.required_confirmations[row] <= 1:
+            self.next_block_watches -= 1
+        self.watch_ids[row] = 0
+        self._free_rows.append(row)
+        self._count -= 1
+
+    def update(self, tx: Transaction):
+        """
+        Writes the block height of a transaction record back to its row.
+        :param tx: The tracked transaction whose block height changed.
+        """
+        row = tx.slot
+        if self.required_confirmations[row] <= 1:
+            was_unconfirmed = self.block_heights[row] == _NONE
+            self.next_block_watches += (tx.block_height is None) - was_unconfirmed
+        if tx.block_height is None:
+            # Unconfirmed again after a reorg, so poll it from scratch
+            self.block_heights[row] = _NONE
+            self.next_poll_at[row] = 0
+            self.poll_intervals[row] = 0
+            self._schedule_poll(row)
+        else:
+            self.block_heights[row] = tx.block_height
+
+    def rows(self) -> list[int]:
+        return [row for row, watch_id in enumerate(self.watch_ids) if watch_id]
+
+    def watchers(self, raw_id: bytes) -> list[Transaction]:
+        position = self._lookup(raw_id)
+        if position < 0:
+            return []
+        return [self.get(row) for row in self._chain(self._index[position])]
+
+    def mined_since(self, height: int) -> list[Transaction]:
+        return [
+            self.get(row) for row, (watch_id, block_height) in enumerate(zip(self.watch_ids, self.block_heights))
+            if watch_id and block_height >= height
+        ]
+
+    def due_for_poll(self, tip_height: int | None, now: float) -> list[list[Transaction]]:
+        if tip_height is not None and tip_height > self._tip_height:
+            # A new block may have included any unconfirmed transaction, so every one of them is due right away
+            self._tip_height = tip_height
+            unconfirmed_rows = dict.fromkeys(
+                row for second, bucket in self._poll_buckets.items() for row in bucket
+                if self._is_unconfirmed(row) and int(self.next_poll_at[row]) == second
+            )
+            for row in unconfirmed_rows:
+                self.next_poll_at[row] = 0
+            self._poll_buckets = {0: array("i", unconfirmed_rows)} if unconfirmed_rows else {}
+            self._poll_seconds = list(self._poll_buckets)
+
+        # Rows stay in their bucket until they are polled, so a failed poll is retried on the next run
+        due: dict[bytes, None] = {}
+        kept: dict[int, list[int]] = {}
+        while self._poll_seconds and self._poll_seconds[0] <= now:
+            second = heapq.heappop(self._poll_seconds)
+            for row in dict.fromkeys(self._poll_buckets.pop(second)):
+                if not self._is_unconfirmed(row) or int(self.next_poll_at[row]) != second:
+                    continue
+                kept.setdefault(second, []).append(row)
+                if self.next_poll_at[row] <= now:
+                    due[self._raw_id(row)] = None
+        for second, rows in kept.items():
+            self._poll_buckets[second] = array("i", rows)
+            heapq.heappush(self._poll_seconds, second)
+        return [self.watchers(raw_id) for raw_id in due]
+
+    def polled(self, tx: Transaction, interval: float, next_poll_at: float):
+        position = self._lookup(tx.raw_id)
+        if position < 0:
+            return
+        for row in self._chain(self._index[position]):
+            self.next_poll_at[row] = next_poll_at
+            self.poll_intervals[row] = interval
+            self._schedule_poll(row)
+
+
+class TransactionRegistry:
+
+    def __init__(self):
+        """
+        Indexes tracked transactions by coin in compact columnar tables, with constant-time insertion and removal.
+        Watches of the same transaction are grouped so it is only looked up once.
+        The transactions returned are records built from the tables: changes to them are written back with update.
+        """
+        self._tables: dict["CoinSymbol", WatchTable] = {}
+
+    def __len__(self):
+        return sum(len(table) for table in self._tables.values())
+
+    def __contains__(self, tx: Transaction):
+        table = self._tables.get(tx.coin.symbol)
+        return table is not None and table.find_row(tx) >= 0
+
+    def add(self, tx: Transaction):
+        """
+        Adds a transaction to the registry.
+        :param tx: The transaction to add, which must have a watch ID.
+        """
+        table = self._tables.get(tx.coin.symbol)
+        if table is None:
+            table = self._tables[tx.coin.symbol] = WatchTable(tx.coin)
+        table.add(tx)
+
+    def load(self, coin: "Coin", records: list[tuple], keep: Callable[[int, str], bool]) -> list[tuple[int, int]]:
+        """
+        Adds stored transactions of a coin to the registry in bulk.
+        :param coin: The coin of the transactions.
+        :param records: The records of the transactions, as loaded from the store.
+        :param keep: Checks whether a transaction should be tracked from its watch ID and transaction ID.
+        :return: The target height and row of every mined transaction added, to be scheduled.
+        """
+        table = self._tables.get(coin.symbol)
+        if table is None:
+            table = self._tables[coin.symbol] = WatchTable(coin)
+        return table.load(records, keep)
+
+    def remove(self, tx: Transaction):
+        """
+        Removes a transaction from the registry.
+        :param tx: The transaction to remove.
+        """
+        self._tables[tx.coin.symbol].remove(tx)
+
+    def update(self, tx: Transaction):
+        """
+        Writes the block height of a tracked transaction back to the registry.
+        :param tx: The transaction whose block height changed.
+        """
+        self._tables[tx.coin.symbol].update(tx)
+
+    def coins(self) -> list["Coin"]:
+        """
+        Retrieves the coins that currently have tracked transactions.
+        :return: The coins with at least one tracked transaction.
+        """
+        return [table.coin for table in self._tables.values() if len(table)]
+
+    def count(self, symbol: "CoinSymbol") -> int:
+        """
+        Counts the tracked transactions of a coin.
+        :param symbol: The symbol of the coin.
+        :return: The number of tracked transactions of the coin.
+        """
+        table = self._tables.get(symbol)
+        return len(table) if table is not None else 0
+
+    def partition(self, symbol: "CoinSymbol") -> list[Transaction]:
+        """
+        Retrieves a snapshot of the tracked transactions of a coin.
+        :param symbol: The symbol of the coin.
+        :return: The tracked transactions of the coin.
+        """
+        table = self._tables.get(symbol)
+        return [table.get(row) for row in table.rows()] if table is not None else []
+
+    def watchers(self, tx: Transaction) -> list[Transaction]:
+        """
+        Retrieves a snapshot of the watches of a transaction.
+        :param tx: The transaction, tracked or not.
+        :return: The tracked transactions with the same coin and transaction ID.
+        """
+        table = self._tables.get(tx.coin.symbol)
+        return table.watchers(tx.raw_id) if table is not None else []
+
+    def resolve(self, symbol: "CoinSymbol", rows: list[int]) -> list[Transaction]:
+        """
+        Retrieves the transactions currently tracked in the given rows. A row may have been reused by another watch
+        since it was handed out, so the caller must check the transactions it gets back.
+        :param symbol: The symbol of the coin.
+        :param rows: The rows of the watches.
+        :return: The tracked transactions, skipping the rows that were freed.
+        """
+        table = self._tables.get(symbol)
+        if table is None:
+            return []
+        return [table.get(row) for row in rows if table.watch_ids[row]]
+
+    def mined_since(self, symbol: "CoinSymbol", height: int) -> list[Transaction]:
+        """
+        Retrieves the tracked transactions of a coin mined at or above a block height.
+        :param symbol: The symbol of the coin.
+        :param height: The lowest block height.
+        :return: The transactions mined in the block at that height or in a later one.
+        """
+        table = self._tables.get(symbol)
+        return table.mined_since(height) if table is not None else []
+
+    def due_for_poll(self, symbol: "CoinSymbol", tip_height: int | None) -> list[list[Transaction]]:
+        """
+        Retrieves the unconfirmed transactions of a coin that should be polled, either because the chain tip advanced
+        since their last poll or because their next poll is due.
+        :param symbol: The symbol of the coin.
+        :param tip_height: The latest known block height of the coin.
+        :return: The watches of every transaction due for a poll.
+        """
+        table = self._tables.get(symbol)
+        return table.due_for_poll(tip_height, monotonic()) if table is not None else []
+
+    def awaits_next_block(self, symbol: "CoinSymbol") -> bool:
+        """
+        Checks whether an unconfirmed transaction of a coin only needs one confirmation, so it reaches its target
+        height as soon as it is mined.
+        :param symbol: The symbol of the coin.
+        :return: Whether a watch of the coin could be notified on the next block.
+        """
+        table = self._tables.get(symbol)
+        return table is not None and table.next_block_watches > 0
+
+    def get_poll_interval(self, tx: Transaction) -> float | None:
+        """
+        Retrieves the current number of seconds between polls of an unconfirmed transaction.
+        :param tx: The tracked transaction.
+        :return: The interval, or None if the transaction hasn't been polled yet.
+        """
+        return self._tables[tx.coin.symbol].poll_intervals[tx.slot] or None
+
+    def polled(self, tx: Transaction, interval: float, next_poll_at: float):
+        """
+        Records a poll of an unconfirmed transaction for all of its watches.
+        :param tx: The tracked transaction that was polled.
+        :param interval: The number of seconds between polls of the transaction from now on.
+        :param next_poll_at: The monotonic time of the next poll.
+        """
+        self._tables[tx.coin.symbol].polled(tx, interval, next_poll_at)
@@ -0,0 +1,81 @@
+import heapq
+from array import array
+from collections import defaultdict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from crypto.base import CoinSymbol
+    from helpers.transaction import Transaction
+
+
+class ConfirmationScheduler:
+
+    def __init__(self):
+        """
+        Orders mined transactions by the block height at which they reach their required number of confirmations.
+        Once a transaction has a block height its confirmations only depend on the chain tip, so it doesn't need
+        to be fetched again until that height is reached.
+        Many transactions share a target height, so they are kept in compact buckets per target height, with the
+        target heights in a heap.
+        """
+        self._heaps: dict["CoinSymbol", list[int]] = defaultdict(list)
+        # The registry row of every scheduled transaction, keyed by target height
+        self._buckets: dict["CoinSymbol", dict[int, array]] = defaultdict(dict)
+
+    def __len__(self):
+        return sum(len(bucket) for buckets in self._buckets.values() for bucket in buckets.values())
+
+    def schedule(self, tx: "Transaction"):
+        """
+        Schedules a tracked mined transaction to be released once the chain reaches its target height.
+        :param tx: The transaction to schedule.
+        """
+        target_height = tx.target_height
+        buckets = self._buckets[tx.coin.symbol]
+        bucket = buckets.get(target_height)
+        if bucket is None:
+            bucket = buckets[target_height] = array("i")
+            heapq.heappush(self._heaps[tx.coin.symbol], target_height)
+        bucket.append(tx.slot)
+
+    def schedule_rows(self, symbol: "CoinSymbol", targets: list[tuple[int, int]]):
+        """
+        Schedules tracked mined transactions of a coin in bulk, straight from their registry rows.
+        :param symbol: The symbol of the coin.
+        :param targets: The target height and registry row of every transaction.
+        """
+        buckets = self._buckets[symbol]
+        for target_height, row in targets:
+            bucket = buckets.get(target_height)
+            if bucket is None:
+                bucket = buckets[target_height] = array("i")
+                heapq.heappush(self._heaps[symbol], target_height)
+            bucket.append(row)
+
+    def next_target(self, symbol: "CoinSymbol") -> int | None:
+        """
+        Retrieves the lowest target height of the scheduled transactions of a coin.
+        :param symbol: The symbol of the coin.
+        :return: The next target height, or None if no transactions are scheduled.
+        """
+        heap = self._heaps[symbol]
+        return heap[0] if heap else None
+
+    def pop_due(self, symbol: "CoinSymbol", tip_height: int) -> list[int]:
+        """
+        Removes and returns every transaction of a coin that has reached its target height.
+        :param symbol: The symbol of the coin.
+        :param tip_height: The latest block height of the coin.
+        :return: The registry rows of the transactions that have reached their required number of confirmations, to
+        be resolved by the registry. Rows reused by other watches since are left to the caller to filter out.
+        """
+        heap = self._heaps[symbol]
+        buckets = self._buckets[symbol]
+        due = []
+        while heap and heap[0] <= tip_height:
+            bucket = buckets.pop(heapq.heappop(heap))
+            due.extend(bucket)
+        return due
+
+
+confirmation_scheduler = ConfirmationScheduler()
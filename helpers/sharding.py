@@ -0,0 +1,213 @@
+import asyncio
+import bisect
+import hashlib
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from interactions import EmbedField
+
+from helpers.ipc import MonitorClient
+from helpers.store import TransactionStore
+from helpers.transaction import Transaction
+
+if TYPE_CHECKING:
+    from crypto.base import Coin, CoinSymbol
+
+
+def _hash(value: str) -> int:
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def shard_key(symbol: str, txid: str) -> str:
+    """
+    Builds the key a transaction is sharded by.
+    :param symbol: The symbol of the coin of the transaction.
+    :param txid: The transaction ID.
+    :return: The shard key of the transaction.
+    """
+    return f"{symbol}:{txid}"
+
+
+class HashRing:
+
+    def __init__(self, nodes: list[str], replicas: int = 100):
+        """
+        Assigns keys to nodes by consistent hashing, so only the keys of a node that joins or leaves move.
+        :param nodes: The nodes to assign keys to.
+        :param replicas: The number of points of every node on the ring, which evens out the share of each node.
+        """
+        self.nodes = sorted(nodes)
+        self._points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._hashes = [point for point, _ in self._points]
+
+    def get_node(self, key: str) -> str | None:
+        """
+        Retrieves the node a key is assigned to.
+        :param key: The key to look up.
+        :return: The node owning the key, or None if the ring is empty.
+        """
+        if not self._points:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._points)
+        return self._points[index][1]
+
+
+class WorkerMembership:
+
+    def __init__(
+            self,
+            store: TransactionStore,
+            address: str | None,
+            on_change: Callable[[HashRing], Awaitable],
+            interval: float = 5,
+            timeout: float = 20
+    ):
+        """
+        Follows the live monitor workers through the shared store and shards transactions across them.
+        Workers announce themselves with a heartbeat, while the bot only follows them.
+        :param store: The store shared by the workers.
+        :param address: The address of this worker, or None if this process isn't a worker.
+        :param on_change: The callback awaited with the new ring whenever a worker joins or leaves.
+        :param interval: The number of seconds between two heartbeats.
+        :param timeout: The number of seconds after which a worker without a heartbeat is considered gone.
+        """
+        self.store = store
+        self.address = address
+        self.on_change = on_change
+        self.interval = interval
+        self.timeout = timeout
+        self.ring = HashRing([])
+        self._task: asyncio.Task | None = None
+
+    def get_owner(self, symbol: str, txid: str) -> str | None:
+        """
+        Retrieves the worker a transaction is assigned to.
+        :param symbol: The symbol of the coin of the transaction.
+        :param txid: The transaction ID.
+        :return: The address of the worker, or None if no worker is alive.
+        """
+        return self.ring.get_node(shard_key(symbol, txid))
+
+    def owns(self, tx: Transaction) -> bool:
+        """
+        Checks whether a transaction is assigned to this worker.
+        :param tx: The transaction to check.
+        :return: Whether this worker is responsible for the transaction.
+        """
+        return self.get_owner(tx.coin.symbol.value, tx.id) == self.address
+
+    async def refresh(self):
+        """
+        Sends a heartbeat and rebuilds the ring if the live workers changed.
+        """
+        if self.address is not None:
+            await asyncio.to_thread(self.store.heartbeat, self.address)
+        live_workers = await asyncio.to_thread(self.store.live_workers, self.timeout)
+        if live_workers == self.ring.nodes:
+            return
+
+        print(f"[*] Monitor workers changed ({', '.join(live_workers) or 'none'})")
+        self.ring = HashRing(live_workers)
+        await self.on_change(self.ring)
+
+    def start(self):
+        """
+        Keeps the membership up to date in the background.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def run(self):
+        """
+        Refreshes the membership until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"[!] Monitor worker membership error {e!r}")
+
+    async def stop(self):
+        """
+        Stops following the membership, leaving the ring if this process is a worker.
+        """
+        if self._task is not None:
+            self._task.cancel()
+        if self.address is not None:
+            await asyncio.to_thread(self.store.leave, self.address)
+
+
+class MonitorRouter:
+
+    def __init__(
+            self,
+            store: TransactionStore,
+            coins: dict["CoinSymbol", "Coin"],
+            on_confirmed: Callable[[Transaction, list[EmbedField], float | None], Awaitable[asyncio.Future]],
+            default_address: str
+    ):
+        """
+        Connects the bot to every live monitor worker and sends each new watch to the worker that owns it.
+        :param store: The store shared by the workers.
+        :param coins: The supported coins, keyed by symbol.
+        :param on_confirmed: The callback awaited with every confirmed watch, its embed fields and the monotonic
+        time it reached its required number of confirmations, returning the future of its Delivery.
+        :param default_address: The address of the worker used while no worker has registered in the store.
+        """
+        self.coins = coins
+        self.on_confirmed = on_confirmed
+        self.default_address = default_address
+        self.membership = WorkerMembership(store, None, self._on_change)
+        self.clients: dict[str, MonitorClient] = {}
+        # Shared by the clients, since a confirmation is sent again by its new owner when workers change
+        self._handled: OrderedDict[int, bool] = OrderedDict()
+
+    async def start(self):
+        """
+        Connects to the live monitor workers and keeps following them in the background.
+        """
+        await self.membership.refresh()
+        if not self.membership.ring.nodes:
+            self._get_client(self.default_address)
+        self.membership.start()
+
+    def send_watch(self, tx: Transaction):
+        """
+        Hands a new watch over to the monitor worker that owns it. Returns immediately.
+        :param tx: The transaction to track.
+        """
+        address = self.membership.get_owner(tx.coin.symbol.value, tx.id) or self.default_address
+        self._get_client(address).send_watch(tx)
+
+    def send_match(self, tx: Transaction):
+        """
+        Hands a transaction a monitor worker found for a watched address over to the worker that owns it.
+        Returns immediately.
+        :param tx: The matched transaction, with the height of its block.
+        """
+        address = self.membership.get_owner(tx.coin.symbol.value, tx.id) or self.default_address
+        self._get_client(address).send_match(tx)
+
+    def _get_client(self, address: str) -> MonitorClient:
+        client = self.clients.get(address)
+        if client is None:
+            client = self.clients[address] = MonitorClient(
+                address, self.coins, self.on_confirmed, handled=self._handled, on_match=self.send_match
+            )
+            client.start()
+        return client
+
+    async def _on_change(self, ring: HashRing):
+        for address in ring.nodes:
+            self._get_client(address)
+
+        # Watches, matches and acknowledgements that didn't reach a worker that left are sent to their new owner instead
+        for address in [address for address in self.clients if address not in ring.nodes]:
+            if not ring.nodes and address == self.default_address:
+                continue
+            for message in self.clients.pop(address).stop():
+                tx = message["tx"]
+                owner = ring.get_node(shard_key(tx["coin"], tx["txid"])) or self.default_address
+                self._get_client(owner).send(message)
@@ -1,15 +1,115 @@
-from collections import deque
+import asyncio
+import os
+from typing import TYPE_CHECKING, Callable
 
 from dotenv import load_dotenv
-from interactions import Client, Intents
+from interactions import AutoShardedClient, Client, Intents
 
+from crypto.base import Coin, CoinSymbol
+from helpers.ipc import MonitorClient
+from helpers.registry import TransactionRegistry
+from helpers.scheduler import confirmation_scheduler
+from helpers.store import TransactionStore
 from helpers.transaction import Transaction
 
+if TYPE_CHECKING:
+    from helpers.sharding import MonitorRouter
+
 load_dotenv()
 
-bot = Client(intents=Intents.DEFAULT)
+# Gateway sharding: DISCORD_SHARDS is "auto" or the total number of shards, DISCORD_SHARD_IDS optionally limits the
+# shards run by this process so several bot processes can share the load
+if os.getenv("DISCORD_SHARDS"):
+    shard_options = {}
+    if os.getenv("DISCORD_SHARDS") != "auto":
+        shard_options["total_shards"] = int(os.getenv("DISCORD_SHARDS"))
+    if os.getenv("DISCORD_SHARD_IDS"):
+        shard_options["shard_ids"] = [int(shard_id) for shard_id in os.getenv("DISCORD_SHARD_IDS").split(",")]
+    bot = AutoShardedClient(intents=Intents.DEFAULT, **shard_options)
+else:
+    bot = Client(intents=Intents.DEFAULT)
+
+tx_registry = TransactionRegistry()
+tx_store = TransactionStore(os.getenv("TX_STORE_PATH", "transactions.db"))
+
+# Watch IDs reserved from the store at a time
+WATCH_ID_BLOCK = 1000
+
+_watch_ids = iter(())
+
+# Set when the monitor runs in separate worker processes, which then track the queued transactions
+monitor_client: "MonitorClient | MonitorRouter | None" = None
+
+
+def set_monitor_client(client: "MonitorClient | MonitorRouter"):
+    """
+    Hands every transaction queued from now on over to the monitor workers instead of tracking it in this process.
+    :param client: The connection to the monitor workers.
+    """
+    global monitor_client
+    monitor_client = client
+
+
+def _next_watch_id() -> int:
+    global _watch_ids
+
+    watch_id = next(_watch_ids, None)
+    if watch_id is None:
+        _watch_ids = iter(tx_store.reserve_watch_ids(WATCH_ID_BLOCK))
+        watch_id = next(_watch_ids)
+    return watch_id
 
-tx_queue: deque[Transaction] = deque()
+
+def _restore(records: list[tuple[Coin, list[tuple]]], owns: Callable[[str, str], bool] | None) -> int:
+    restored = 0
+    for coin, coin_records in records:
+        # Skip transactions that were just notified or belong to another worker, the registry skipping the ones it
+        # already tracks
+        def keep(watch_id: int, txid: str) -> bool:
+            return not tx_store.is_deleting(watch_id) and (owns is None or owns(coin.symbol.value, txid))
+
+        tracked = tx_registry.count(coin.symbol)
+        confirmation_scheduler.schedule_rows(coin.symbol, tx_registry.load(coin, coin_records, keep))
+        restored += tx_registry.count(coin.symbol) - tracked
+    return restored
+
+
+async def load_transactions(coins: dict[CoinSymbol, Coin]):
+    """
+    Restores the transactions that were still being tracked when the bot last stopped.
+    They are loaded in a worker thread, which also loads the coins they belong to, and added to the registry in bulk.
+    :param coins: The supported coins, keyed by symbol.
+    """
+    restored = _restore(await asyncio.to_thread(tx_store.load, coins), None)
+    print(f"[*] Restored {restored:,} TX")
+
+
+async def claim_transactions(coins: dict[CoinSymbol, Coin], owns: Callable[[str, str], bool]) -> int:
+    """
+    Starts tracking the stored transactions assigned to this monitor worker that it doesn't track yet.
+    :param coins: The supported coins, keyed by symbol.
+    :param owns: Checks whether a transaction is assigned to this worker from its coin symbol and transaction ID.
+    :return: The number of transactions claimed.
+    """
+    # Commit first, so transactions notified by this worker aren't restored from stale rows
+    await tx_store.commit()
+    return _restore(await asyncio.to_thread(tx_store.load, coins), owns)
+
+
+def release_transactions(owns: Callable[[Transaction], bool]) -> int:
+    """
+    Stops tracking the transactions that are no longer assigned to this monitor worker. They stay in the store for
+    the worker they are assigned to.
+    :param owns: Checks whether a transaction is assigned to this worker.
+    :return: The number of transactions released.
+    """
+    released = 0
+    for coin in tx_registry.coins():
+        for tx in tx_registry.partition(coin.symbol):
+            if not owns(tx):
+                tx_registry.remove(tx)
+                released += 1
+    return released
 
 
 def queue_transaction(tx: Transaction):
@@ -17,14 +117,24 @@ def queue_transaction(tx: Transaction):
     Adds a transaction to the queue.
     :param tx: The transaction to add.
     """
-    tx_queue.append(tx)
-    print(f"[+] TX (type: {tx.coin.symbol.name} | hash: {tx.id})")
+    if monitor_client is not None:
+        monitor_client.send_watch(tx)
+        print(f"[>] TX (type: {tx.coin.symbol.name} | hash: {tx.id})")
+        return
 
+    tx.watch_id = _next_watch_id()
+    tx_registry.add(tx)
+    tx_store.save(tx)
+
+    # Mined transactions only need to be checked again once the chain reaches their target height
+    if tx.block_height is not None:
+        for watcher in tx_registry.watchers(tx):
+            # The new lookup may be fresher than the one the other users of this transaction are waiting on
+            if watcher.watch_id != tx.watch_id and watcher.block_height is None:
+                watcher.block_height = tx.block_height
+                tx_registry.update(watcher)
+                tx_store.save(watcher)
+                confirmation_scheduler.schedule(watcher)
+        confirmation_scheduler.schedule(tx)
+    print(f"[+] TX (type: {tx.coin.symbol.name} | hash: {tx.id})")
 
-def remove_transaction(tx: Transaction):
-    """
-    Removes a transaction from the queue.
-    :param tx: The transaction to remove.
-    """
-    tx_queue.remove(tx)
-    print(f"[-] TX (type: {tx.coin.symbol.name} | hash: {tx.id} | conf: {tx.required_confirmations})")
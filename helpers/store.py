@@ -0,0 +1,282 @@
+import asyncio
+import json
+import sqlite3
+import threading
+from time import time
+from typing import TYPE_CHECKING
+
+from helpers.transaction import Transaction
+
+if TYPE_CHECKING:
+    from crypto.base import Coin, CoinSymbol
+
+
+class TransactionStore:
+
+    def __init__(self, path: str):
+        """
+        Persists tracked transactions in a SQLite database so they survive restarts.
+        Writes are buffered in memory and committed together by flush, so tracking a transaction never waits on disk.
+        The database can be shared by several monitor workers, which also register themselves in it.
+        Watched addresses are stored too, and written right away since they are rarely added.
+        Monitor workers also keep the confirmations they haven't had acknowledged by the bot, written in the same batch
+        as the deletion of their watch, so a confirmation is never lost between the two.
+        :param path: The path of the SQLite database file.
+        """
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        # Guards the connection, which is used from the event loop and from worker threads
+        self._lock = threading.RLock()
+        # Keeps the pending writes taken by commit in order
+        self._commit_lock = asyncio.Lock()
+        # Pending writes keyed by watch ID, where None marks a deletion
+        self._pending: dict[int, tuple | None] = {}
+        self._pending_confirmations: dict[int, tuple | None] = {}
+
+    def open(self):
+        """
+        Opens the database, creating the tables if they don't exist yet.
+        """
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, NORMAL only syncs on checkpoints while still protecting against corruption
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS transactions ("
+            "watch_id INTEGER PRIMARY KEY, coin TEXT NOT NULL, txid TEXT NOT NULL, user_id INTEGER NOT NULL, "
+            "channel_id INTEGER NOT NULL, fee INTEGER NOT NULL, required_confirmations INTEGER NOT NULL, "
+            "block_height INTEGER)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS workers (address TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)"
+        )
+        # Watch IDs are handed out in blocks, so workers sharing the database never assign the same one
+        self._connection.execute("CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._connection.execute(
+            "INSERT OR IGNORE INTO sequences VALUES ('watch_id', (SELECT COALESCE(MAX(watch_id), 0) FROM transactions))"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS addresses ("
+            "coin TEXT NOT NULL, address TEXT NOT NULL, user_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, "
+            "required_confirmations INTEGER NOT NULL, PRIMARY KEY (coin, address, user_id, channel_id))"
+        )
+        # Bumped on every change of the watched addresses, so processes only reload them when they changed
+        self._connection.execute("INSERT OR IGNORE INTO sequences VALUES ('addresses', 0)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS confirmations ("
+            "watch_id INTEGER PRIMARY KEY, coin TEXT NOT NULL, txid TEXT NOT NULL, message TEXT NOT NULL)"
+        )
+        self._connection.commit()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.open()
+        return self._connection
+
+    def load(self, coins: dict["CoinSymbol", "Coin"]) -> list[tuple["Coin", list[tuple]]]:
+        """
+        Loads every stored transaction in bulk, as plain records that can be added to the registry without building
+        a transaction for each of them.
+        :param coins: The supported coins, keyed by symbol.
+        :return: Every coin with stored transactions and the watch ID, transaction ID, user ID, channel ID, fee,
+        required confirmations and block height of each of them, ordered by watch ID. Coins that are no longer
+        supported are skipped.
+        """
+        with self._lock:
+            connection = self._get_connection()
+            records = [
+                (symbol, connection.execute(
+                    "SELECT watch_id, txid, user_id, channel_id, fee, required_confirmations, block_height "
+                    "FROM transactions WHERE coin = ? ORDER BY watch_id", (symbol.value,)
+                ).fetchall())
+                for symbol in coins
+            ]
+        return [(coins[symbol], coin_records) for symbol, coin_records in records if coin_records]
+
+    def save(self, tx: Transaction):
+        """
+        Queues a transaction to be inserted or updated on the next flush.
+        :param tx: The transaction to save.
+        """
+        self._pending[tx.watch_id] = (
+            tx.watch_id, tx.coin.symbol.value, tx.id, int(tx.user_id), int(tx.channel_id), tx.fee,
+            tx.required_confirmations, tx.block_height
+        )
+
+    def delete(self, tx: Transaction):
+        """
+        Queues a transaction to be deleted on the next flush.
+        :param tx: The transaction to delete.
+        """
+        self._pending[tx.watch_id] = None
+
+    def is_deleting(self, watch_id: int) -> bool:
+        """
+        Checks whether a transaction is queued to be deleted on the next flush.
+        :param watch_id: The watch ID of the transaction.
+        :return: Whether the transaction is about to be deleted.
+        """
+        return watch_id in self._pending and self._pending[watch_id] is None
+
+    def save_confirmation(self, watch_id: int, symbol: str, txid: str, message: dict):
+        """
+        Queues a confirmation reported to the bot to be kept on the next flush, until the bot acknowledges it.
+        :param watch_id: The watch ID of the confirmed transaction.
+        :param symbol: The symbol of the coin of the transaction.
+        :param txid: The transaction ID.
+        :param message: The confirmation message sent to the bot.
+        """
+        self._pending_confirmations[watch_id] = (watch_id, symbol, txid, json.dumps(message))
+
+    def delete_confirmation(self, watch_id: int):
+        """
+        Queues an acknowledged confirmation to be deleted on the next flush.
+        :param watch_id: The watch ID of the confirmed transaction.
+        """
+        self._pending_confirmations[watch_id] = None
+
+    def load_confirmations(self) -> list[tuple[int, str, str, dict]]:
+        """
+        Loads every confirmation that the bot hasn't acknowledged yet.
+        :return: The watch ID, coin symbol, transaction ID and message of every confirmation.
+        """
+        with self._lock:
+            rows = self._get_connection().execute("SELECT watch_id, coin, txid, message FROM confirmations").fetchall()
+        return [(watch_id, symbol, txid, json.loads(message)) for watch_id, symbol, txid, message in rows]
+
+    def take_pending(self) -> tuple[dict[int, tuple | None], dict[int, tuple | None]]:
+        """
+        Removes and returns the writes that haven't been flushed yet.
+        :return: The pending writes of transactions and of confirmations, both keyed by watch ID.
+        """
+        pending = self._pending, self._pending_confirmations
+        self._pending, self._pending_confirmations = {}, {}
+        return pending
+
+    def flush(self, pending: tuple[dict[int, tuple | None], dict[int, tuple | None]]):
+        """
+        Commits a batch of writes in a single transaction. Safe to run in a worker thread, as long as only one flush
+        runs at a time.
+        :param pending: The writes to commit, as returned by take_pending.
+        """
+        transactions, confirmations = pending
+        if not transactions and not confirmations:
+            return
+        with self._lock, self._get_connection() as connection:
+            connection.executemany(
+                "DELETE FROM transactions WHERE watch_id = ?",
+                [(watch_id,) for watch_id, row in transactions.items() if row is None]
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for row in transactions.values() if row is not None]
+            )
+            connection.executemany(
+                "DELETE FROM confirmations WHERE watch_id = ?",
+                [(watch_id,) for watch_id, row in confirmations.items() if row is None]
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO confirmations VALUES (?, ?, ?, ?)",
+                [row for row in confirmations.values() if row is not None]
+            )
+
+    async def commit(self):
+        """
+        Commits every pending write in a worker thread, after the writes taken by earlier commits.
+        """
+        async with self._commit_lock:
+            pending = self.take_pending()
+            if any(pending):
+                await asyncio.to_thread(self.flush, pending)
+
+    def reserve_watch_ids(self, count: int) -> range:
+        """
+        Reserves a block of watch IDs that no other process sharing the database will use.
+        :param count: The number of watch IDs to reserve.
+        :return: The reserved watch IDs.
+        """
+        with self._lock, self._get_connection() as connection:
+            value, = connection.execute(
+                "UPDATE sequences SET value = value + ? WHERE name = 'watch_id' RETURNING value", (count,)
+            ).fetchone()
+        return range(value - count + 1, value + 1)
+
+    def heartbeat(self, address: str):
+        """
+        Registers a monitor worker as alive.
+        :param address: The address the worker listens on.
+        """
+        with self._lock, self._get_connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO workers VALUES (?, ?)", (address, time()))
+
+    def leave(self, address: str):
+        """
+        Unregisters a monitor worker that is shutting down.
+        :param address: The address the worker listens on.
+        """
+        with self._lock, self._get_connection() as connection:
+            connection.execute("DELETE FROM workers WHERE address = ?", (address,))
+
+    def live_workers(self, timeout: float) -> list[str]:
+        """
+        Retrieves the monitor workers that sent a heartbeat recently.
+        :param timeout: The number of seconds after which a worker without a heartbeat is considered gone.
+        :return: The sorted addresses of the live workers.
+        """
+        with self._lock:
+            rows = self._get_connection().execute(
+                "SELECT address FROM workers WHERE heartbeat_at > ? ORDER BY address", (time() - timeout,)
+            ).fetchall()
+        return [address for address, in rows]
+
+    def add_address(self, symbol: str, address: str, user_id: int, channel_id: int, required_confirmations: int):
+        """
+        Starts watching an address for a user, replacing their previous watch of it in the same channel.
+        :param symbol: The symbol of the coin of the address.
+        :param address: The normalized address.
+        :param user_id: The ID of the user watching the address.
+        :param channel_id: The ID of the channel to notify the user in.
+        :param required_confirmations: The number of confirmations to notify after.
+        """
+        with self._lock, self._get_connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO addresses VALUES (?, ?, ?, ?, ?)",
+                (symbol, address, user_id, channel_id, required_confirmations)
+            )
+            connection.execute("UPDATE sequences SET value = value + 1 WHERE name = 'addresses'")
+
+    def remove_address(self, symbol: str, address: str, user_id: int) -> bool:
+        """
+        Stops watching an address for a user, in every channel.
+        :param symbol: The symbol of the coin of the address.
+        :param address: The normalized address.
+        :param user_id: The ID of the user watching the address.
+        :return: Whether the user was watching the address.
+        """
+        with self._lock, self._get_connection() as connection:
+            removed = connection.execute(
+                "DELETE FROM addresses WHERE coin = ? AND address = ? AND user_id = ?", (symbol, address, user_id)
+            ).rowcount
+            connection.execute("UPDATE sequences SET value = value + 1 WHERE name = 'addresses'")
+        return removed > 0
+
+    def get_addresses_version(self) -> int:
+        """
+        Retrieves the version of the watched addresses, which changes whenever one is added or removed.
+        :return: The current version.
+        """
+        with self._lock:
+            value, = self._get_connection().execute(
+                "SELECT value FROM sequences WHERE name = 'addresses'"
+            ).fetchone()
+        return value
+
+    def load_addresses(self) -> list[tuple[str, str, int, int, int]]:
+        """
+        Loads every watched address in bulk.
+        :return: The coin symbol, address, user ID, channel ID and required confirmations of every watch.
+        """
+        with self._lock:
+            return self._get_connection().execute(
+                "SELECT coin, address, user_id, channel_id, required_confirmations FROM addresses"
+            ).fetchall()
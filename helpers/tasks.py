@@ -1,113 +1,359 @@
 import asyncio
-from time import time
+from time import perf_counter
+from typing import Awaitable, Callable
 
-from interactions import IntervalTrigger, Task, EmbedField
+from interactions import EmbedField, IntervalTrigger, Task
 
-from crypto.base import CoinSymbol
+from crypto.base import Coin, CoinSymbol
+from helpers.addresses import address_index
 from helpers.embeds import send_tx_confirmed_embed
-from helpers.shared import tx_queue, remove_transaction
+from helpers.events import is_feed_live
+from helpers.headers import chain_headers
+from helpers.metrics import cycle_duration, reorgs
+from helpers.notifier import Delivery
+from helpers.polling import polling_scheduler
+from helpers.prices import prices
+from helpers.scheduler import confirmation_scheduler
+from helpers.shared import queue_transaction, tx_registry, tx_store
+from helpers.tips import chain_tips
 from helpers.transaction import Transaction
+from helpers.txcache import tx_cache
 
-# Use a semaphore to limit the number of simultaneous requests sent
-semaphore = asyncio.Semaphore(5)
+# Coins that are still being monitored by a previous run, which is skipped rather than overlapped
+_busy_coins: set[CoinSymbol] = set()
 
+# Awaited with every watch that reached its required confirmations, its embed fields and the monotonic time it reached
+# them. A monitor worker replaces it to report the watches to the bot process instead.
+on_confirmed: Callable[[Transaction, list[EmbedField], float | None], Awaitable[asyncio.Future]] = \
+    send_tx_confirmed_embed
 
-@Task.create(IntervalTrigger(seconds=10))
+
+def track_match(tx: Transaction):
+    """
+    Tracks a transaction found in a block for a user watching one of its recipient addresses.
+    :param tx: The matched transaction, with the height of its block.
+    """
+    # The block may be scanned again after a reorg
+    if any(watcher.user_id == tx.user_id and watcher.channel_id == tx.channel_id
+           for watcher in tx_registry.watchers(tx)):
+        return
+    queue_transaction(tx)
+
+
+# Called with every transaction found in a block for a watched address. A monitor worker replaces it to hand the
+# transactions owned by another worker over to it.
+on_match: Callable[[Transaction], None] = track_match
+
+
+@Task.create(IntervalTrigger(seconds=2))
 async def monitor_task():
     """
-    Monitors transactions in the transaction queue. Runs every 10 seconds.
+    Monitors transactions in the transaction queue. Runs every 2 seconds, while the polling scheduler decides what
+    is actually fetched on each run.
+    Each coin is handled as its own batch, so a slow provider doesn't hold up the other coins.
     """
-    async with semaphore:
-        tasks = [
-            asyncio.ensure_future(monitor(tx))
-            for tx in tx_queue
-        ]
-        await asyncio.gather(*tasks)
+    try:
+        await address_index.sync(tx_store)
+    except Exception as e:
+        print(f"[!] Watched address sync failed {e!r}")
+
+    coins = [
+        coin
+        for coin in {coin.symbol: coin for coin in tx_registry.coins() + address_index.get_coins()}.values()
+        if coin.symbol not in _busy_coins
+    ]
+    results = await asyncio.gather(*[monitor_coin(coin) for coin in coins], return_exceptions=True)
+    for coin, result in zip(coins, results):
+        if isinstance(result, Exception):
+            print(f"[!] Monitor run failed (type: {coin.symbol.name}) {result!r}")
 
 
-async def monitor(tx: Transaction):
+async def monitor_coin(coin: Coin):
     """
-    Monitors a transaction.
-    :param tx: The transaction to monitor
+    Monitors the tracked transactions of a coin.
+    Only unconfirmed transactions are polled; mined transactions wait in the confirmation scheduler until the chain
+    reaches their target height. Transactions tracked by several users are only looked up once.
+    :param coin: The coin to monitor the transactions of.
     """
-    match tx.coin.symbol:
-        case CoinSymbol.BTC:
-            data = tx.coin.get_tx(tx.id).json()
+    _busy_coins.add(coin.symbol)
+    started_at = perf_counter()
+    try:
+        tip_height = chain_tips.peek(coin.symbol)
+        next_target = confirmation_scheduler.next_target(coin.symbol)
+        tip_refreshed = polling_scheduler.should_refresh_tip(coin)
+        if tip_refreshed:
+            tip_height = await chain_tips.get_height(coin, refresh=True)
+            # Refresh the tip more often while a transaction is one block away from its target, which includes the
+            # unconfirmed transactions that only need the block they are mined in
+            near_target = (next_target is not None and next_target <= tip_height + 1) \
+                or tx_registry.awaits_next_block(coin.symbol)
+            polling_scheduler.tip_refreshed(coin, near_target, is_feed_live(coin.symbol))
 
-            tx_block_height = data["block_height"]
-            current_confirmations = tx.coin.get_current_confirmations(tx_block_height) if tx_block_height else 0
+        # Watches mined in blocks replaced by a reorg are polled again right away. A refreshed tip at the same height is
+        # checked too, since it may have been replaced by another block
+        fork_height = None if tip_height is None else await update_headers(coin, tip_height, tip_refreshed)
+        if fork_height is not None:
+            reorg(coin, fork_height)
+            address_index.rewind(coin.symbol, fork_height)
 
-            # The transaction hasn't reached the required number of confirmations yet
-            if current_confirmations < tx.required_confirmations:
-                return
-
-            formatted_confirmations = tx.coin.get_formatted_confirmations(current_confirmations)
-            formatted_fee = tx.coin.get_formatted_fee(tx.fee)
-            remove_transaction(tx)
-
-            await send_tx_confirmed_embed(tx, [
-                EmbedField(name="Transaction ID", value=f"`{tx.id}`", inline=False),
-                EmbedField(name="Confirmations", value=formatted_confirmations, inline=True),
-                EmbedField(name="Fee", value=formatted_fee, inline=True),
-                EmbedField(name="Double-spent", value=f"{'Yes' if data['double_spend'] else 'No'}", inline=True),
-                EmbedField(name="Block height", value=f"{tx_block_height:,}", inline=True),
-                EmbedField(name="Confirmed at", value=f"<t:{int(time())}>", inline=True),
-                EmbedField(name="Sent at", value=f"<t:{data['time']}>", inline=True)
-            ])
-        case CoinSymbol.LTC:
-            data = tx.coin.get_tx(tx.id).json()
-
-            current_confirmations = tx.coin.get_current_confirmations(data["status"]["block_height"]) \
-                if data["status"]["confirmed"] \
-                else 0
-
-            # The transaction hasn't reached the required number of confirmations yet
-            if current_confirmations < tx.required_confirmations:
-                return
-
-            tx_block_height = data["status"]["block_height"]
-
-            formatted_confirmations = tx.coin.get_formatted_confirmations(current_confirmations)
-            formatted_fee = tx.coin.get_formatted_fee(tx.fee)
-            remove_transaction(tx)
-
-            await send_tx_confirmed_embed(tx, [
-                EmbedField(name="Transaction ID", value=f"`{tx.id}`", inline=False),
-                EmbedField(name="Confirmations", value=formatted_confirmations, inline=True),
-                EmbedField(name="Fee", value=formatted_fee, inline=True),
-                EmbedField(name="Block height", value=f"{tx_block_height:,}", inline=True),
-                EmbedField(name="Size", value=f"{data['size']:,} vB", inline=True),
-                EmbedField(name="Weight", value=f"{data['weight']:,} WU", inline=True),
-                EmbedField(name="Confirmed at", value=f"<t:{int(time())}>", inline=True)
-            ])
-        case CoinSymbol.ETH:
-            data = tx.coin.get_tx(tx.id)
-
-            current_confirmations = tx.coin.get_current_confirmations(
-                data.blockNumber) if data.blockNumber is not None else 0
-
-            # The transaction hasn't reached the required number of confirmations yet
+        if tip_height is not None and address_index.count(coin.symbol):
+            await scan_blocks(coin, tip_height)
+
+        # Look up the status of every transaction that is due for a poll together, so coins with batch requests can
+        # combine them. The full transaction is only fetched once it reaches its target height
+        polled = tx_registry.due_for_poll(coin.symbol, tip_height)
+        if polled:
+            results = await coin.get_tx_status_batch([watchers[0].id for watchers in polled])
+            for watchers in polled:
+                monitor(watchers, results[watchers[0].id])
+
+        if tip_height is None:
+            return
+
+        # Group the due transactions by transaction ID, dropping duplicate entries of the same watch and watches that
+        # have already been notified through another entry
+        due: dict[str, dict[int, Transaction]] = {}
+        for tx in tx_registry.resolve(coin.symbol, confirmation_scheduler.pop_due(coin.symbol, tip_height)):
+            # Entries left behind by a reorg, or whose row is now used by another watch: the watch is polled again and
+        # rescheduled once it is mined, or has its own entry
+            if tx.block_height is None or tx.target_height > tip_height:
+                continue
+            due.setdefault(tx.id, {})[tx.watch_id] = tx
+        if not due:
+            return
+
+        # The due watches are off the scheduler now, so a failed lookup must hand them back to notify to reschedule
+        try:
+            results = await coin.get_cached_tx_data_batch(list(due))
+        except Exception as e:
+            results = {txid: e for txid in due}
+        notified = await asyncio.gather(*[
+            notify(coin, list(txs.values()), results[txid])
+            for txid, txs in due.items()
+        ], return_exceptions=True)
+        for txid, result in zip(due, notified):
+            if isinstance(result, Exception):
+                print(f"[!] TX notification failed (type: {coin.symbol.name} | hash: {txid}) {result!r}")
+    finally:
+        _busy_coins.discard(coin.symbol)
+        cycle_duration.observe(perf_counter() - started_at, coin=coin.symbol.name)
+
+
+async def on_block(coin: Coin, height: int):
+    """
+    Called when a block feed pushes a new block, so the watches it affects are handled right away instead of on the
+    next poll.
+    :param coin: The coin the block belongs to.
+    :param height: The height of the new block.
+    """
+    tip_height = chain_tips.peek(coin.symbol)
+    if tip_height is not None and height <= tip_height:
+        return
+
+    chain_tips.set_height(coin.symbol, height)
+    if coin.symbol not in _busy_coins and tx_registry.count(coin.symbol):
+        await monitor_coin(coin)
+
+
+@Task.create(IntervalTrigger(seconds=1))
+async def flush_task():
+    """
+    Commits pending changes of tracked transactions and of the transaction cache in one batch each. Runs every second.
+    """
+    await tx_store.commit()
+    await tx_cache.commit()
+
+
+@Task.create(IntervalTrigger(seconds=15))
+async def price_task():
+    """
+    Refreshes every price in the background, so commands and embeds are served from memory. Runs every 15 seconds.
+    """
+    try:
+        await prices.refresh()
+    except Exception as e:
+        print(f"[!] Price refresh failed {e!r}")
+
+
+async def warm_up(coins: dict[CoinSymbol, Coin], on_loaded: Callable[[Coin], None] | None = None):
+    """
+    Loads the enabled coins one by one in a background thread and fetches their chain tips, which opens the
+    connections to their providers, so the first commands don't wait on it.
+    :param coins: The enabled coins, keyed by symbol.
+    :param on_loaded: The callback called with every coin as soon as it is loaded, such as starting its block feed.
+    """
+    started_at = perf_counter()
+    loaded, tip_tasks = [], []
+    for symbol in coins:
+        try:
+            coin = await asyncio.to_thread(coins.__getitem__, symbol)
+        except Exception as e:
+            print(f"[!] Coin loading failed (type: {symbol.name}) {e!r}")
+            continue
+        loaded.append(coin)
+        if on_loaded is not None:
+            on_loaded(coin)
+        # The chain tip is fetched while the next coins load
+        tip_tasks.append(asyncio.create_task(chain_tips.get_height(coin)))
+
+    results = await asyncio.gather(*tip_tasks, return_exceptions=True)
+    for coin, result in zip(loaded, results):
+        if isinstance(result, Exception):
+            print(f"[!] Provider warm-up failed (type: {coin.symbol.name}) {result!r}")
+    print(f"[*] Loaded {len(loaded)} coin(s) in {perf_counter() - started_at:.2f}s")
+
+
+async def scan_blocks(coin: Coin, tip_height: int):
+    """
+    Scans the blocks added since the last scan for transactions sent to watched addresses, and tracks every
+    transaction found for the users watching the address. Each block is fetched once, however many addresses are
+    watched.
+    :param coin: The coin to scan the blocks of.
+    :param tip_height: The latest block height of the coin.
+    """
+    for height in address_index.get_scan_heights(coin.symbol, tip_height):
+        try:
+            recipients = await coin.get_block_recipients(height)
+        except Exception as e:
+            # Try again on the next cycle
+            print(f"[!] Block scan failed (type: {coin.symbol.name} | height: {height}) {e!r}")
+            return
+
+        for txid, fee, watch in address_index.match(coin.symbol, recipients):
+            tx = Transaction(coin, txid, watch.user_id, watch.channel_id, fee, watch.required_confirmations, height)
+            on_match(tx)
+        address_index.scanned(coin.symbol, height)
+
+
+async def update_headers(coin: Coin, tip_height: int, recheck_tip: bool = False) -> int | None:
+    """
+    Extends the block header index of a coin up to the chain tip.
+    :param coin: The coin to index the blocks of.
+    :param tip_height: The latest block height of the coin.
+    :param recheck_tip: Whether to check the tip again when its height didn't change.
+    :return: The lowest height whose block was replaced by a reorg, or None if there was no reorg.
+    """
+    try:
+        return await chain_headers.update(coin, tip_height, recheck_tip)
+    except Exception as e:
+        # Try again on the next cycle
+        print(f"[!] Block header update failed (type: {coin.symbol.name}) {e!r}")
+        return None
+
+
+def reorg(coin: Coin, fork_height: int):
+    """
+    Sends the watches of transactions mined in blocks replaced by a reorg back to polling, leaving the other watches
+    untouched.
+    :param coin: The coin of the reorg.
+    :param fork_height: The lowest height whose block was replaced.
+    """
+    txs = tx_registry.mined_since(coin.symbol, fork_height)
+    print(f"[!] Reorg (type: {coin.symbol.name} | height: {fork_height} | affected: {len(txs)})")
+    reorgs.inc(coin=coin.symbol.name)
+    for tx in txs:
+        tx.block_height = None
+        tx_registry.update(tx)
+        tx_store.save(tx)
+
+
+def monitor(watchers: list[Transaction], status):
+    """
+    Handles the result of polling an unconfirmed transaction and schedules every watch of it once it has been mined.
+    :param watchers: The watches of the polled transaction.
+    :param status: The block height of the transaction, None if it hasn't been mined yet, or the exception raised
+    while retrieving it.
+    """
+    coin = watchers[0].coin
+    tx_block_height = None if isinstance(status, Exception) else status
+    if tx_block_height is None:
+        interval = polling_scheduler.get_poll_interval(coin, tx_registry.get_poll_interval(watchers[0]))
+        tx_registry.polled(watchers[0], interval, polling_scheduler.get_next_poll_at(interval))
+        return
+
+    for tx in watchers:
+        tx.block_height = tx_block_height
+        tx_registry.update(tx)
+        tx_store.save(tx)
+        confirmation_scheduler.schedule(tx)
+
+
+def on_delivered(tx: Transaction, delivery: Delivery):
+    """
+    Deletes a notified watch from the store once its notification was delivered, or can never be. A notification
+    that failed is tracked again, so it is retried on the next cycle.
+    :param tx: The notified transaction, no longer tracked.
+    :param delivery: The outcome of the notification.
+    """
+    if delivery is Delivery.FAILED:
+        print(f"[!] TX notification failed, retrying (type: {tx.coin.symbol.name} | hash: {tx.id})")
+        tx_registry.add(tx)
+        confirmation_scheduler.schedule(tx)
+        return
+
+    tx_store.delete(tx)
+    print(f"[-] TX (type: {tx.coin.symbol.name} | hash: {tx.id} | conf: {tx.required_confirmations})")
+
+
+async def notify(coin: Coin, txs: list[Transaction], data):
+    """
+    Notifies the users of a transaction that has reached their target height.
+    The transaction is fetched once more to build the embeds and to make sure it is still in the same block.
+    The watches were taken off the confirmation scheduler to be notified, so the ones that aren't notified because of
+    an error are scheduled again and retried on the next cycle.
+    :param coin: The coin of the transaction.
+    :param txs: The watches of the transaction that reached their target height.
+    :param data: The parsed transaction data, or the exception raised while retrieving it.
+    """
+    txid = txs[0].id
+    if isinstance(data, Exception):
+        print(f"[!] TX (type: {coin.symbol.name} | hash: {txid}) {data}")
+        # Try again on the next cycle
+        for tx in txs:
+            confirmation_scheduler.schedule(tx)
+        return
+
+    handled: set[int] = set()
+    try:
+        tx_block_height = coin.get_tx_block_height(data)
+        if tx_block_height != txs[0].block_height:
+            # The block the transaction was mined in is no longer part of the chain
+            for tx in tx_registry.watchers(txs[0]):
+                tx.block_height = tx_block_height
+                tx_registry.update(tx)
+                tx_store.save(tx)
+                if tx_block_height is not None:
+                    confirmation_scheduler.schedule(tx)
+                handled.add(tx.watch_id)
+            return
+
+        # Counted from the block header index, which this monitor run brought up to the chain tip, without a request.
+        # A transaction in another block than the indexed one at its height isn't counted until they agree again.
+        # Coins without block headers and blocks deeper than the index fall back to the latest block height
+        current_confirmations = chain_headers.get_confirmations(
+            coin.symbol, tx_block_height, coin.get_tx_block_hash(data)
+        )
+        if current_confirmations is None:
+            current_confirmations = await coin.get_current_confirmations(tx_block_height)
+        for tx in txs:
+            # The watch was scheduled for a block height that has since changed
             if current_confirmations < tx.required_confirmations:
-                return
-
-            # convert gas price from wei to ETH
-            eth_gas_price = data.gasPrice / 1e18
-            # tx fee (ETH) = gas price * gas used by tx
-            fee = data.gas * eth_gas_price
-
-            # convert tx value from wei to ETH
-            eth_value = data.value / 1e18
-            usd_amount = tx.coin.get_usd_rate() * eth_value
-
-            formatted_confirmations = tx.coin.get_formatted_confirmations(current_confirmations)
-            remove_transaction(tx)
-
-            await send_tx_confirmed_embed(tx, [
-                EmbedField(name="Transaction ID", value=f"`{tx.id}`", inline=False),
-                EmbedField(name="Confirmations", value=formatted_confirmations, inline=True),
-                EmbedField(name="Fee", value=tx.coin.get_formatted_fee(fee), inline=True),
-                EmbedField(name="Value", value=f"${usd_amount:,.2f}", inline=True),
-                EmbedField(name="Block number", value=f"{data.blockNumber:,}", inline=True),
-                EmbedField(name="Nonce", value=f"{data.nonce:,}", inline=True),
-                EmbedField(name="Confirmed at", value=f"<t:{int(time())}>", inline=True)
-            ])
+                confirmation_scheduler.schedule(tx)
+                handled.add(tx.watch_id)
+                continue
+
+            fields = await coin.get_confirmed_fields(tx, data, current_confirmations)
+            # Only deleted from the store once delivered, so a restart before then notifies it again
+            tx_registry.remove(tx)
+            handled.add(tx.watch_id)
+            delivery = await on_confirmed(tx, fields, chain_tips.get_seen_at(coin.symbol, tx.target_height))
+            if delivery.done():
+                # Deleted right away when reported to the bot, in the same store batch as the saved confirmation
+                on_delivered(tx, delivery.result())
+            else:
+                delivery.add_done_callback(lambda future, tx=tx: on_delivered(tx, future.result()))
+    except Exception:
+        for tx in txs:
+            if tx.watch_id not in handled and tx.block_height is not None:
+                confirmation_scheduler.schedule(tx)
+        raise
@@ -0,0 +1,91 @@
+import asyncio
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from helpers.metrics import cache_requests
+
+if TYPE_CHECKING:
+    from crypto.base import Coin, CoinSymbol
+
+
+class ChainTips:
+
+    def __init__(self, max_age: float = 5):
+        """
+        Keeps the latest block height of each coin so it is fetched once and shared by every lookup.
+        :param max_age: The number of seconds a block height is reused before it is fetched again.
+        """
+        self.max_age = max_age
+        self._heights: dict["CoinSymbol", int] = {}
+        self._updated_at: dict["CoinSymbol", float] = {}
+        self._locks: dict["CoinSymbol", asyncio.Lock] = {}
+        # When each recent block height was first seen, used to measure how long notifications take
+        self._seen_at: dict["CoinSymbol", dict[int, float]] = {}
+
+    def is_fresh(self, symbol: "CoinSymbol"):
+        """
+        Checks whether the stored block height of a coin can still be used.
+        :param symbol: The symbol of the coin.
+        :return: Whether the stored block height is recent enough.
+        """
+        return symbol in self._heights and monotonic() - self._updated_at[symbol] < self.max_age
+
+    def peek(self, symbol: "CoinSymbol") -> int | None:
+        """
+        Retrieves the stored block height of a coin without fetching it, however old it is.
+        :param symbol: The symbol of the coin.
+        :return: The stored block height, or None if it hasn't been fetched yet.
+        """
+        return self._heights.get(symbol)
+
+    def set_height(self, symbol: "CoinSymbol", height: int):
+        """
+        Stores the latest block height of a coin.
+        :param symbol: The symbol of the coin.
+        :param height: The latest block height.
+        """
+        previous_height = self._heights.get(symbol)
+        self._heights[symbol] = height
+        self._updated_at[symbol] = monotonic()
+
+        if previous_height is None or height > previous_height:
+            seen_at = self._seen_at.setdefault(symbol, {})
+            first_new_height = height if previous_height is None else max(previous_height + 1, height - 99)
+            for new_height in range(first_new_height, height + 1):
+                seen_at[new_height] = self._updated_at[symbol]
+            # Only keep the most recent heights
+            for old_height in [old_height for old_height in seen_at if old_height <= height - 100]:
+                del seen_at[old_height]
+
+    def get_seen_at(self, symbol: "CoinSymbol", height: int) -> float | None:
+        """
+        Retrieves when a block height was first seen.
+        :param symbol: The symbol of the coin.
+        :param height: The block height.
+        :return: The monotonic time the height was first seen at, or None if it isn't one of the recent heights.
+        """
+        return self._seen_at.get(symbol, {}).get(height)
+
+    async def get_height(self, coin: "Coin", refresh=False) -> int:
+        """
+        Retrieves the latest block height of a coin, fetching it only if the stored one is stale.
+        :param coin: The coin to retrieve the block height of.
+        :param refresh: Whether to fetch the block height even if the stored one is still fresh.
+        :return: The latest block height of the coin.
+        """
+        if not refresh and self.is_fresh(coin.symbol):
+            cache_requests.inc(cache="tip", result="hit")
+            return self._heights[coin.symbol]
+        cache_requests.inc(cache="tip", result="miss")
+
+        lock = self._locks.setdefault(coin.symbol, asyncio.Lock())
+        updated_at = self._updated_at.get(coin.symbol)
+        async with lock:
+            # Another caller already fetched the block height while we were waiting for the lock
+            if self._updated_at.get(coin.symbol) != updated_at:
+                return self._heights[coin.symbol]
+            self.set_height(coin.symbol, await coin.get_latest_block_height())
+        return self._heights[coin.symbol]
+
+
+chain_tips = ChainTips()
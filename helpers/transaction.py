@@ -2,8 +2,21 @@ from interactions import Snowflake
 
 from crypto.base import Coin
 
+# The coins of compact transaction records, keyed by coin index
+_coins: dict[int, Coin] = {}
+
+
+def register_coin(coin: Coin):
+    """
+    Makes a coin known to the compact records of its transactions, for records built without a transaction.
+    :param coin: The coin to register.
+    """
+    _coins[coin.index] = coin
+
 
 class Transaction:
+    __slots__ = ("coin_index", "raw_id", "user_id", "channel_id", "fee", "required_confirmations", "block_height",
+                 "watch_id", "slot")
 
     def __init__(
             self,
@@ -12,20 +25,79 @@ class Transaction:
             user_id: Snowflake,
             channel_id: Snowflake,
             fee: int,
-            required_confirmations: int
+            required_confirmations: int,
+            block_height: int | None = None
     ):
         """
         Represents a cryptocurrency transaction.
+        The record is kept compact: the coin is stored as a small integer and the transaction ID as its raw bytes.
         :param id: The transaction ID.
         :param coin: The cryptocurrency coin used in the transaction.
         :param user_id: The ID of the user who started the transaction.
         :param channel_id: The ID of the channel the transaction was started in.
         :param fee: The fee of the transaction.
         :param required_confirmations: The number of confirmations to notify after.
+        :param block_height: The height of the block the transaction was mined in, or None if it is unconfirmed.
         """
-        self.coin = coin
-        self.id = id
-        self.user_id = user_id
-        self.channel_id = channel_id
+        _coins[coin.index] = coin
+        self.coin_index = coin.index
+        self.raw_id = coin.encode_txid(id)
+        self.user_id = int(user_id)
+        self.channel_id = int(channel_id)
         self.fee = fee
         self.required_confirmations = required_confirmations
+        self.block_height = block_height
+        # Assigned when the transaction is queued, used to persist it
+        self.watch_id: int | None = None
+        # The row of the transaction in the registry while it is tracked
+        self.slot: int | None = None
+
+    @classmethod
+    def from_record(
+            cls,
+            coin_index: int,
+            raw_id: bytes,
+            user_id: int,
+            channel_id: int,
+            fee: int,
+            required_confirmations: int,
+            block_height: int | None,
+            watch_id: int,
+            slot: int | None = None
+    ) -> "Transaction":
+        """
+        Builds a transaction from the fields of a compact record, without converting them again.
+        :return: The transaction.
+        """
+        tx = cls.__new__(cls)
+        tx.coin_index = coin_index
+        tx.raw_id = raw_id
+        tx.user_id = user_id
+        tx.channel_id = channel_id
+        tx.fee = fee
+        tx.required_confirmations = required_confirmations
+        tx.block_height = block_height
+        tx.watch_id = watch_id
+        tx.slot = slot
+        return tx
+
+    @property
+    def coin(self) -> Coin:
+        """
+        The cryptocurrency coin used in the transaction.
+        """
+        return _coins[self.coin_index]
+
+    @property
+    def id(self) -> str:
+        """
+        The transaction ID.
+        """
+        return self.coin.decode_txid(self.raw_id)
+
+    @property
+    def target_height(self):
+        """
+        The block height at which the transaction reaches its required number of confirmations.
+        """
+        return self.block_height + self.required_confirmations - 1
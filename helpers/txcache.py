@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import time
+from typing import TYPE_CHECKING
+
+from helpers.metrics import cache_requests, metrics
+from helpers.tips import chain_tips
+
+if TYPE_CHECKING:
+    from crypto.base import Coin
+
+
+class TransactionCache:
+
+    def __init__(self, path: str | None = None, max_entries: int = 10_000, min_confirmations: int = 100):
+        """
+        Keeps the data of deeply confirmed transactions, which can no longer change, so looking them up again is
+        served from memory without contacting any provider. The least recently used transactions are evicted first.
+        Only the fields used by the bot are kept, serialized, so cached data can't be modified by its users.
+        The cache can be persisted to a SQLite database. Writes are buffered in memory and committed together by
+        commit, like the transaction store, and the most recently used transactions are loaded on first use.
+        :param path: The path of the SQLite database file, or None to only keep the cache in memory.
+        :param max_entries: The maximum number of cached transactions.
+        :param min_confirmations: The number of confirmations after which a transaction is cached, deeper than any
+        reorg the block header index can detect.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.min_confirmations = min_confirmations
+        self._entries: OrderedDict[tuple[str, str], str] = OrderedDict()
+        self._loaded = False
+        # Whether the path and size are read from the environment on first use
+        self._from_env = False
+        self._connection: sqlite3.Connection | None = None
+        # Guards the connection, which is used from the event loop and from worker threads
+        self._lock = threading.RLock()
+        self._commit_lock = asyncio.Lock()
+        # Pending writes with the time the entry was last used, where None marks a deletion
+        self._pending: dict[tuple[str, str], tuple[str, float] | None] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def from_env(cls) -> "TransactionCache":
+        """
+        Creates a cache configured by TX_CACHE_PATH and TX_CACHE_SIZE. They are read on first use rather than on
+        import, so they can come from the .env file loaded by the bot.
+        :return: The transaction cache.
+        """
+        cache = cls()
+        cache._from_env = True
+        return cache
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cached_transactions ("
+                "coin TEXT NOT NULL, txid TEXT NOT NULL, data TEXT NOT NULL, used_at REAL NOT NULL, "
+                "PRIMARY KEY (coin, txid))"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _load(self):
+        self._loaded = True
+        if self._from_env:
+            self.path = os.getenv("TX_CACHE_PATH") or None
+            self.max_entries = int(os.getenv("TX_CACHE_SIZE", "10000"))
+        if self.path is None:
+            return
+
+        # Restore the most recently used transactions, from the least recently used up
+        with self._lock:
+            rows = self._get_connection().execute(
+                "SELECT coin, txid, data FROM (SELECT * FROM cached_transactions ORDER BY used_at DESC LIMIT ?) "
+                "ORDER BY used_at",
+                (self.max_entries,)
+            ).fetchall()
+        for symbol, txid, data in rows:
+            self._entries[(symbol, txid)] = data
+
+    def get(self, coin: "Coin", txid: str):
+        """
+        Retrieves the data of a cached transaction.
+        :param coin: The coin of the transaction.
+        :param txid: The transaction ID.
+        :return: The parsed transaction data, or None if the transaction isn't cached.
+        """
+        if not self._loaded:
+            self._load()
+        key = (coin.symbol.value, txid)
+        data = self._entries.get(key)
+        if data is None:
+            cache_requests.inc(cache="tx", result="miss")
+            return None
+
+        cache_requests.inc(cache="tx", result="hit")
+        self._entries.move_to_end(key)
+        if self.path is not None:
+            self._pending[key] = (data, time())
+        return coin.restore_tx_data(json.loads(data))
+
+    def put(self, coin: "Coin", txid: str, data):
+        """
+        Caches the data of a transaction if it is deeply confirmed, going by the latest known block height.
+        :param coin: The coin of the transaction.
+        :param txid: The transaction ID.
+        :param data: The parsed transaction data.
+        """
+        tx_block_height = coin.get_tx_block_height(data)
+        tip_height = chain_tips.peek(coin.symbol)
+        if tx_block_height is None or tip_height is None or tip_height - tx_block_height + 1 < self.min_confirmations:
+            return
+        if not self._loaded:
+            self._load()
+
+        key = (coin.symbol.value, txid)
+        self._entries[key] = json.dumps(coin.compact_tx_data(data), separators=(",", ":"))
+        self._entries.move_to_end(key)
+        if self.path is not None:
+            self._pending[key] = (self._entries[key], time())
+        while len(self._entries) > self.max_entries:
+            evicted_key, _ = self._entries.popitem(last=False)
+            if self.path is not None:
+                self._pending[evicted_key] = None
+
+    def flush(self, pending: dict[tuple[str, str], tuple[str, float] | None]):
+        """
+        Commits a batch of writes in a single transaction. Safe to run in a worker thread, as long as only one flush
+        runs at a time.
+        :param pending: The writes to commit.
+        """
+        with self._lock, self._get_connection() as connection:
+            connection.executemany(
+                "DELETE FROM cached_transactions WHERE coin = ? AND txid = ?",
+                [(symbol, txid) for (symbol, txid), entry in pending.items() if entry is None]
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO cached_transactions VALUES (?, ?, ?, ?)",
+                [(symbol, txid, *entry) for (symbol, txid), entry in pending.items() if entry is not None]
+            )
+
+    async def commit(self):
+        """
+        Commits every pending write in a worker thread, after the writes taken by earlier commits.
+        """
+        async with self._commit_lock:
+            pending, self._pending = self._pending, {}
+            if pending:
+                await asyncio.to_thread(self.flush, pending)
+
+
+tx_cache = TransactionCache.from_env()
+
+metrics.gauge(
+    "cryptotracker_tx_cache_entries", "Deeply confirmed transactions in the cache.", lambda: {(): len(tx_cache)}
+)
@@ -1,21 +1,63 @@
+import asyncio
+import contextlib
 import os
 import re
 from typing import Annotated
+from urllib.parse import urlsplit
 
-from interactions import (listen, slash_command, Activity, ActivityType, OptionType, SlashContext, SlashCommandChoice,
-                          SlashCommandOption, Status, Embed, RoleColors, EmbedField, Timestamp)
+from interactions import (listen, slash_command, Activity, ActivityType, Attachment, OptionType, SlashContext,
+                          SlashCommandChoice, SlashCommandOption, Status, Embed, RoleColors, EmbedField, Timestamp)
 
-from crypto import *
+from crypto import CoinRegistry
 from crypto.base import CoinSymbol
+from helpers.addresses import address_index
+from helpers.bulk import track_bulk
 from helpers.converters import LowerConverter
-from helpers.shared import bot
-from helpers.tasks import monitor_task
+from helpers.embeds import send_address_watch_embed, send_invalid_address_embed, send_tx_confirmed_embed
+from helpers.events import start_block_feed
+from helpers.http import close_clients, fetch, get_host
+from helpers.metrics import metrics, start_metrics_server
+from helpers.notifier import notifier
+from helpers.sharding import MonitorRouter
+from helpers.shared import bot, load_transactions, set_monitor_client, tx_registry, tx_store
+from helpers.tasks import flush_task, monitor_task, on_block, price_task, warm_up
 
-coins = {
-    CoinSymbol.BTC: Bitcoin(),
-    CoinSymbol.LTC: Litecoin(),
-    CoinSymbol.ETH: Ethereum()
-}
+# Coins are loaded on first use, so the bot connects to the gateway without waiting on them
+coins = CoinRegistry.from_env()
+address_index.coins = coins
+
+# The largest file of transaction IDs accepted by /bulktrack, in bytes
+MAX_BULK_FILE_SIZE = 64 * 1024
+
+metrics.gauge(
+    "cryptotracker_tracked_transactions",
+    "Tracked transactions by coin.",
+    lambda: {(("coin", symbol.name),): tx_registry.count(symbol) for symbol in coins}
+)
+metrics.gauge("cryptotracker_pending_notifications", "Notifications waiting to be sent.", lambda: {(): len(notifier)})
+
+
+@listen()
+async def on_startup():
+    """
+    Called once when the bot first connects, before it starts monitoring transactions.
+    """
+    price_task.start()
+    notifier.start()
+    # Also needed with monitor workers, since /track still caches deeply confirmed transactions in this process
+    flush_task.start()
+
+    if os.getenv("METRICS_PORT"):
+        await start_metrics_server(int(os.getenv("METRICS_PORT")))
+
+    # When monitor workers are configured, they track the transactions and report the ones that confirmed
+    if os.getenv("MONITOR_WORKER_ADDRESS"):
+        router = MonitorRouter(tx_store, coins, send_tx_confirmed_embed, os.getenv("MONITOR_WORKER_ADDRESS"))
+        set_monitor_client(router)
+        await router.start()
+        return
+
+    await load_transactions(coins)
 
 
 @listen()
@@ -26,7 +68,14 @@ async def on_ready():
     print(f"Established connection with gateway! Logged in as {bot.user}.")
     activity = Activity(type=ActivityType.WATCHING, name="your transactions")
     await bot.change_presence(Status.IDLE, activity)
-    monitor_task.start()
+    on_loaded = None
+    if not os.getenv("MONITOR_WORKER_ADDRESS"):
+        monitor_task.start()
+        # Optionally get new blocks pushed over websockets, the monitor keeps polling as a fallback. Each feed starts
+        # once its coin is loaded
+        if os.getenv("BLOCK_EVENTS", "").lower() in ("1", "true", "yes"):
+            on_loaded = lambda coin: start_block_feed(coin, on_block)
+    await warm_up(coins, on_loaded)
 
 
 @slash_command(
@@ -39,8 +88,8 @@ async def on_ready():
             name="coin",
             description="The cryptocurrency coin used.",
             choices=[
-                SlashCommandChoice(name=f"{coin.name} ({coin.symbol.name})", value=coin.symbol)
-                for coin in coins.values()
+                SlashCommandChoice(name=f"{coins.get_name(symbol)} ({symbol.name})", value=symbol)
+                for symbol in coins
             ]
         ),
         SlashCommandOption(
@@ -83,6 +132,166 @@ async def track_command(ctx: SlashContext, coin: CoinSymbol, txid: Annotated[str
     await crypto.track(ctx, txid, confirmations)
 
 
+@slash_command(
+    name="bulktrack",
+    description="Starts tracking a list of crypto transactions.",
+    options=[
+        SlashCommandOption(
+            type=OptionType.STRING,
+            required=True,
+            name="coin",
+            description="The cryptocurrency coin used.",
+            choices=[
+                SlashCommandChoice(name=f"{coins.get_name(symbol)} ({symbol.name})", value=symbol)
+                for symbol in coins
+            ]
+        ),
+        SlashCommandOption(
+            type=OptionType.STRING,
+            required=False,
+            name="txids",
+            description="The IDs or explorer links of the transactions, separated by spaces or commas."
+        ),
+        SlashCommandOption(
+            type=OptionType.ATTACHMENT,
+            required=False,
+            name="file",
+            description="A text or CSV file listing the IDs or explorer links of the transactions."
+        ),
+        SlashCommandOption(
+            type=OptionType.INTEGER,
+            required=False,
+            name="confirmations",
+            description="The number of confirmations to notify you after.",
+            min_value=1
+        )
+    ]
+)
+async def bulk_track_command(ctx: SlashContext, coin: CoinSymbol, txids: str = "", file: Attachment | None = None,
+                             confirmations=1):
+    """
+    Called when a user uses the /bulktrack command.
+    :param ctx: The application command interaction context.
+    :param coin: The symbol of the cryptocurrency coin used.
+    :param txids: The IDs or explorer links of the transactions to track.
+    :param file: A text or CSV file listing more transactions to track.
+    :param confirmations: The number of confirmations to notify after.
+    """
+    crypto = coins.get(coin)
+    if confirmations > crypto.max_confirmations:
+        return await ctx.send(f"The maximum number of confirmations for "
+                              f"**{crypto.name}** is **{crypto.max_confirmations}**.")
+    if file is not None and file.size > MAX_BULK_FILE_SIZE:
+        return await ctx.send(f"The attached file must be smaller than **{MAX_BULK_FILE_SIZE // 1024} KB**.")
+
+    # Defer the response to avoid timing out
+    await ctx.defer()
+
+    text = txids
+    if file is not None:
+        url = urlsplit(file.url)
+        response = await fetch(get_host(file.url), f"{url.path}?{url.query}")
+        if not response.is_success:
+            return await ctx.send("The attached file could not be downloaded.")
+        text += "\n" + response.text
+
+    found = crypto.extract_txids(text)
+    if not found:
+        return await ctx.send(f"No **{crypto.name}** transaction IDs were found.")
+    await track_bulk(ctx, crypto, found, confirmations)
+
+
+@slash_command(
+    name="watch",
+    description="Notifies you of transactions sent to a crypto address.",
+    options=[
+        SlashCommandOption(
+            type=OptionType.STRING,
+            required=True,
+            name="coin",
+            description="The cryptocurrency coin of the address.",
+            choices=[
+                SlashCommandChoice(name=f"{coins.get_name(symbol)} ({symbol.name})", value=symbol)
+                for symbol in coins
+            ]
+        ),
+        SlashCommandOption(
+            type=OptionType.STRING,
+            required=True,
+            name="address",
+            description="The address you want to watch."
+        ),
+        SlashCommandOption(
+            type=OptionType.INTEGER,
+            required=False,
+            name="confirmations",
+            description="The number of confirmations to notify you after.",
+            min_value=1
+        )
+    ]
+)
+async def watch_command(ctx: SlashContext, coin: CoinSymbol, address: str, confirmations=1):
+    """
+    Called when a user uses the /watch command.
+    :param ctx: The application command interaction context.
+    :param coin: The symbol of the cryptocurrency coin of the address.
+    :param address: The address to watch.
+    :param confirmations: The number of confirmations to notify after.
+    """
+    crypto = coins.get(coin)
+    if confirmations > crypto.max_confirmations:
+        return await ctx.send(f"The maximum number of confirmations for "
+                              f"**{crypto.name}** is **{crypto.max_confirmations}**.")
+
+    address = crypto.normalize_address(address)
+    if crypto.address_pattern is None or not crypto.address_pattern.match(address):
+        return await send_invalid_address_embed(ctx, crypto)
+
+    # Monitor workers pick up the new address from the shared store
+    await asyncio.to_thread(tx_store.add_address, crypto.symbol.value, address, int(ctx.user.id),
+                            int(ctx.channel_id), confirmations)
+    print(f"[+] Address (type: {crypto.symbol.name} | address: {address})")
+    await send_address_watch_embed(ctx, crypto, address, confirmations)
+
+
+@slash_command(
+    name="unwatch",
+    description="Stops notifying you of transactions sent to a crypto address.",
+    options=[
+        SlashCommandOption(
+            type=OptionType.STRING,
+            required=True,
+            name="coin",
+            description="The cryptocurrency coin of the address.",
+            choices=[
+                SlashCommandChoice(name=f"{coins.get_name(symbol)} ({symbol.name})", value=symbol)
+                for symbol in coins
+            ]
+        ),
+        SlashCommandOption(
+            type=OptionType.STRING,
+            required=True,
+            name="address",
+            description="The address you no longer want to watch."
+        )
+    ]
+)
+async def unwatch_command(ctx: SlashContext, coin: CoinSymbol, address: str):
+    """
+    Called when a user uses the /unwatch command.
+    :param ctx: The application command interaction context.
+    :param coin: The symbol of the cryptocurrency coin of the address.
+    :param address: The address to stop watching.
+    """
+    crypto = coins.get(coin)
+    address = crypto.normalize_address(address)
+    if not await asyncio.to_thread(tx_store.remove_address, crypto.symbol.value, address, int(ctx.user.id)):
+        return await ctx.send(f"You are not watching `{address}`.")
+
+    print(f"[-] Address (type: {crypto.symbol.name} | address: {address})")
+    await ctx.send(f"You are no longer watching `{address}`.")
+
+
 @slash_command(name="prices", description="Displays the prices of top cryptocurrencies.")
 async def prices_command(ctx: SlashContext):
     """
@@ -91,14 +300,17 @@ async def prices_command(ctx: SlashContext):
     """
     await ctx.defer()
 
+    # Prices are served from memory by the price service
+    rates = await asyncio.gather(*[coin.get_usd_rate() for coin in coins.values()])
+
     embed = Embed(title=":coin: Cryptocurrency Prices", color=RoleColors.YELLOW, timestamp=Timestamp.now())
     embed.add_fields(*[
         EmbedField(
             name=f"{coin.name} ({coin.symbol.name})",
-            value=f"{coin.emoji} ${coin.get_usd_rate():,.2f} USD",
+            value=f"{coin.emoji} ${rate:,.2f} USD",
             inline=True
         )
-        for coin in coins.values()
+        for coin, rate in zip(coins.values(), rates)
     ])
 
     await ctx.send(embed=embed)
@@ -127,5 +339,17 @@ async def help_command(ctx: SlashContext):
     await ctx.send(embed=embed)
 
 
-# Start the Discord bot
-bot.start(os.getenv("DISCORD_BOT_TOKEN"))
+async def main():
+    """
+    Runs the Discord bot until it stops, then closes the pooled HTTP clients.
+    """
+    try:
+        await bot.astart(os.getenv("DISCORD_BOT_TOKEN"))
+    finally:
+        await close_clients()
+
+
+if __name__ == "__main__":
+    # Start the Discord bot
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(main())
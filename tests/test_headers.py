@@ -0,0 +1,51 @@
+import unittest
+
+from crypto.base import CoinSymbol
+from helpers.headers import HeaderIndex
+
+
+class StubChain:
+    symbol = CoinSymbol.LTC
+
+    def __init__(self, hashes: list[str]):
+        # The hash of every block, by height
+        self.hashes = hashes
+
+    async def get_block_headers(self, start_height: int, end_height: int):
+        return [
+            (height, self.hashes[height], self.hashes[height - 1] if height else "")
+            for height in range(start_height, min(end_height, len(self.hashes) - 1) + 1)
+        ]
+
+
+class HeaderIndexTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.chain = StubChain([f"a{height}" for height in range(11)])
+        self.index = HeaderIndex(depth=5)
+        await self.index.update(self.chain, 9)
+        await self.index.update(self.chain, 10)
+
+    async def test_counts_confirmations_of_indexed_block(self):
+        self.assertEqual(self.index.get_confirmations(CoinSymbol.LTC, 9, "a9"), 2)
+        self.assertEqual(self.index.get_confirmations(CoinSymbol.LTC, 9), 2)
+        self.assertIsNone(self.index.get_confirmations(CoinSymbol.LTC, 2, "a2"))
+
+    async def test_other_block_at_same_height_has_no_confirmations(self):
+        self.assertEqual(self.index.get_confirmations(CoinSymbol.LTC, 9, "b9"), 0)
+
+    async def test_detects_tip_replaced_at_same_height(self):
+        self.chain.hashes[10] = "b10"
+        self.assertIsNone(await self.index.update(self.chain, 10))
+        self.assertEqual(await self.index.update(self.chain, 10, recheck_tip=True), 10)
+        self.assertEqual(self.index.get_hash(CoinSymbol.LTC, 10), "b10")
+        self.assertIsNone(await self.index.update(self.chain, 10, recheck_tip=True))
+
+    async def test_detects_reorg_below_new_blocks(self):
+        self.chain.hashes[9:] = ["b9", "b10", "b11"]
+        self.assertEqual(await self.index.update(self.chain, 11), 9)
+        self.assertEqual(self.index.get_confirmations(CoinSymbol.LTC, 9, "b9"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
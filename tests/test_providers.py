@@ -0,0 +1,112 @@
+import asyncio
+import gc
+import unittest
+from unittest import mock
+
+import httpx
+
+from helpers import providers
+from helpers.providers import ProviderPool
+
+
+class StubProviders:
+
+    def __init__(self):
+        """
+        Stands in for the HTTP requests of a provider pool, answering each backend from the future set up for it.
+        """
+        self.answers: dict[str, asyncio.Future] = {}
+        self.requested: list[str] = []
+
+    def answer(self, url: str) -> asyncio.Future:
+        future = self.answers[url] = asyncio.get_running_loop().create_future()
+        return future
+
+    async def request(self, method: str, url: str, path: str, **kwargs) -> httpx.Response:
+        self.requested.append(url)
+        future = self.answers.get(url)
+        if future is None:
+            return httpx.Response(200, text=url)
+        return await asyncio.shield(future)
+
+
+class ProviderPoolTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.stub = StubProviders()
+        patcher = mock.patch.object(providers, "request", self.stub.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = ProviderPool("test", ["https://a", "https://b"], default_hedge_delay=0.05, max_failures=2)
+        self.addCleanup(providers._pools.remove, self.pool)
+
+    async def test_hedges_slow_backend(self):
+        self.stub.answer("https://a")
+        response = await self.pool.fetch("/tip")
+        self.assertEqual(response.text, "https://b")
+        self.assertEqual(self.stub.requested, ["https://a", "https://b"])
+
+    async def test_fails_over_on_error(self):
+        self.stub.answer("https://a").set_exception(httpx.ConnectError("refused"))
+        response = await self.pool.fetch("/tip")
+        self.assertEqual(response.text, "https://b")
+
+    async def test_fails_over_on_unavailable_response(self):
+        self.stub.answer("https://a").set_result(httpx.Response(503))
+        response = await self.pool.fetch("/tip")
+        self.assertEqual(response.text, "https://b")
+
+    async def test_returns_last_response_when_every_backend_fails(self):
+        self.stub.answer("https://a").set_result(httpx.Response(503))
+        self.stub.answer("https://b").set_result(httpx.Response(429))
+        response = await self.pool.fetch("/tip")
+        self.assertIn(response.status_code, (503, 429))
+
+    async def test_takes_failing_backend_out_of_rotation(self):
+        self.stub.answer("https://a").set_exception(httpx.ConnectError("refused"))
+        for _ in range(2):
+            await self.pool.fetch("/tip")
+        primary = self.pool.backends[0]
+        self.assertFalse(primary.is_healthy())
+        self.assertEqual(primary.cooldown, self.pool.base_cooldown)
+
+        self.stub.requested.clear()
+        await self.pool.fetch("/tip")
+        self.assertEqual(self.stub.requested, ["https://b"])
+
+        # Failing again right after coming back takes it out for twice as long
+        primary.down_until = 0
+        for _ in range(2):
+            await self.pool.fetch("/tip")
+        self.assertEqual(primary.cooldown, self.pool.base_cooldown * 2)
+
+    async def test_cleans_up_losing_requests(self):
+        unretrieved = []
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda _, context: unretrieved.append(context))
+        self.addCleanup(loop.set_exception_handler, None)
+
+        # The slow request is still running when the hedge answers
+        self.stub.answer("https://a")
+        await self.pool.fetch("/tip")
+        await asyncio.sleep(0)
+        self.assertEqual(asyncio.all_tasks(), {asyncio.current_task()})
+
+        for i in range(10):
+            answers = self.stub.answer("https://a"), self.stub.answer("https://b")
+            fetch = asyncio.create_task(self.pool.fetch("/tip"))
+            # Both requests finish together once the hedge started, in whichever order the pool looks at them
+            await asyncio.sleep(0.1)
+            answers[i % 2].set_exception(httpx.ReadTimeout("timed out"))
+            answers[1 - i % 2].set_result(httpx.Response(200))
+            self.assertEqual((await fetch).status_code, 200)
+            for backend in self.pool.backends:
+                backend.down_until = 0
+        del fetch
+        gc.collect()
+        await asyncio.sleep(0)
+        self.assertEqual(unretrieved, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from crypto.base import CoinSymbol
+from crypto.litecoin import Litecoin
+from helpers import shared
+from helpers.registry import TransactionRegistry
+from helpers.scheduler import ConfirmationScheduler
+from helpers.store import TransactionStore
+from helpers.transaction import Transaction
+
+
+class ClaimTransactionsTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.coins = {CoinSymbol.LTC: Litecoin()}
+        self.registry = TransactionRegistry()
+        for name, value in (
+                ("tx_store", TransactionStore(os.path.join(directory.name, "transactions.db"))),
+                ("tx_registry", self.registry),
+                ("confirmation_scheduler", ConfirmationScheduler()),
+                ("_watch_ids", iter(()))
+        ):
+            patcher = mock.patch.object(shared, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_stored_records_match_tracked_watches(self):
+        tx = Transaction(self.coins[CoinSymbol.LTC], "ab" * 32, 1, 2, 1000, 2, 100)
+        shared.queue_transaction(tx)
+        shared.tx_store.flush(shared.tx_store.take_pending())
+
+        # Records built from the store don't know the row of their watch
+        (coin, (record,)), = shared.tx_store.load(self.coins)
+        watch_id, txid, *fields = record
+        stored = Transaction(coin, txid, *fields)
+        stored.watch_id = watch_id
+        self.assertIsNone(stored.slot)
+        self.assertIn(stored, self.registry)
+
+    async def test_claim_skips_tracked_watches(self):
+        for i in range(3):
+            shared.queue_transaction(Transaction(self.coins[CoinSymbol.LTC], f"{i:064x}", 1, 2, 1000, 2, None))
+
+        claimed = await shared.claim_transactions(self.coins, lambda symbol, txid: True)
+        self.assertEqual(claimed, 0)
+        self.assertEqual(len(self.registry), 3)
+
+    async def test_claim_adds_untracked_watches(self):
+        tx = Transaction(self.coins[CoinSymbol.LTC], "cd" * 32, 1, 2, 1000, 2, None)
+        shared.queue_transaction(tx)
+        shared.release_transactions(lambda tx: False)
+        self.assertEqual(len(self.registry), 0)
+
+        claimed = await shared.claim_transactions(self.coins, lambda symbol, txid: True)
+        self.assertEqual(claimed, 1)
+        self.assertEqual(len(self.registry), 1)
+
+    async def test_restore_schedules_mined_watches(self):
+        coin = self.coins[CoinSymbol.LTC]
+        for i, (txid, block_height) in enumerate((("ee" * 32, None), ("ef" * 32, 100), ("ef" * 32, 100))):
+            shared.queue_transaction(Transaction(coin, txid, i, 2, 1000, 2, block_height))
+        shared.tx_store.flush(shared.tx_store.take_pending())
+        shared.release_transactions(lambda tx: False)
+
+        claimed = await shared.claim_transactions(self.coins, lambda symbol, txid: True)
+        self.assertEqual(claimed, 3)
+        self.assertEqual(len(self.registry.watchers(Transaction(coin, "ef" * 32, 0, 0, 0, 2))), 2)
+        due = self.registry.resolve(CoinSymbol.LTC, shared.confirmation_scheduler.pop_due(CoinSymbol.LTC, 101))
+        self.assertEqual(sorted(tx.user_id for tx in due), [1, 2])
+
+
+class DueForPollTest(unittest.TestCase):
+
+    def setUp(self):
+        self.coin = Litecoin()
+        self.registry = TransactionRegistry()
+        for i in range(1, 4):
+            tx = Transaction(self.coin, f"{i:064x}", 1, 2, 1000, 2, None)
+            tx.watch_id = i
+            self.registry.add(tx)
+
+    def get_due(self, tip_height: int, now: float) -> list[int]:
+        table = self.registry._tables[CoinSymbol.LTC]
+        return sorted(watchers[0].watch_id for watchers in table.due_for_poll(tip_height, now))
+
+    def test_polls_due_transactions(self):
+        self.assertEqual(self.get_due(100, 0), [1, 2, 3])
+        for tx, next_poll_at in zip(self.registry.partition(CoinSymbol.LTC), (10, 20, 30)):
+            self.registry.polled(tx, 10, next_poll_at)
+
+        self.assertEqual(self.get_due(100, 5), [])
+        self.assertEqual(self.get_due(100, 20), [1, 2])
+        # A new block may have included any of them
+        self.assertEqual(self.get_due(101, 5), [1, 2, 3])
+
+    def test_keeps_unpolled_transactions_due(self):
+        self.assertEqual(self.get_due(100, 0), [1, 2, 3])
+        self.assertEqual(self.get_due(100, 0), [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+from crypto import CoinRegistry
+from helpers import tasks
+from helpers.addresses import address_index
+from helpers.events import start_block_feed
+from helpers.http import close_clients
+from helpers.ipc import MonitorServer
+from helpers.metrics import metrics, start_metrics_server
+from helpers.sharding import HashRing, WorkerMembership
+from helpers.shared import claim_transactions, queue_transaction, release_transactions, tx_registry, tx_store
+from helpers.tasks import flush_task, monitor_task, on_block, price_task, warm_up
+from helpers.transaction import Transaction
+
+# Coins are loaded on first use, by the transactions claimed or the warm-up
+coins = CoinRegistry.from_env()
+address_index.coins = coins
+
+
+async def main():
+    """
+    Runs the monitoring engine in its own process, apart from the Discord gateway.
+    The bot hands new watches over to it and sends the notifications for the watches it reports as confirmed.
+    Several workers can share the same store, each tracking the transactions assigned to it by consistent hashing.
+    """
+    address = os.getenv("MONITOR_WORKER_ADDRESS", "127.0.0.1:8790")
+
+    async def rebalance(ring: HashRing):
+        # Watched addresses are sharded like transactions, so each address is only matched by one worker
+        address_index.invalidate()
+        released = release_transactions(membership.owns) + server.release_confirmations(owns)
+        # Give the other workers a heartbeat to notice the change and commit what they released
+        await asyncio.sleep(membership.interval)
+        claimed = await claim_transactions(coins, owns) + await server.claim_confirmations(owns)
+        print(f"[*] Rebalanced across {len(ring.nodes)} worker(s) (released: {released:,} | claimed: {claimed:,})")
+
+    def owns(symbol: str, key: str) -> bool:
+        return membership.get_owner(symbol, key) == address
+
+    def on_match(tx: Transaction):
+        # Addresses and transactions are sharded apart, so a match may belong to another worker
+        if membership.owns(tx):
+            tasks.track_match(tx)
+        else:
+            server.hand_over(tx)
+
+    membership = WorkerMembership(tx_store, address, rebalance)
+    address_index.owns = lambda symbol, watched_address: owns(symbol.value, watched_address)
+    server = MonitorServer(address, coins, queue_transaction, tx_store, tasks.track_match)
+    tasks.on_confirmed = server.send_confirmed
+    tasks.on_match = on_match
+
+    metrics.gauge(
+        "cryptotracker_tracked_transactions",
+        "Tracked transactions by coin.",
+        lambda: {(("coin", symbol.name),): tx_registry.count(symbol) for symbol in coins}
+    )
+    metrics.gauge(
+        "cryptotracker_unreported_confirmations",
+        "Confirmations the bot hasn't acknowledged yet.",
+        lambda: {(): len(server)}
+    )
+
+    await server.start()
+    flush_task.start()
+    price_task.start()
+    monitor_task.start()
+    # Joining claims this worker's share of the stored transactions
+    await membership.refresh()
+    membership.start()
+
+    if os.getenv("WORKER_METRICS_PORT"):
+        await start_metrics_server(int(os.getenv("WORKER_METRICS_PORT")))
+
+    # Optionally get new blocks pushed over websockets, the monitor keeps polling as a fallback. Each feed starts once
+    # its coin is loaded
+    on_loaded = None
+    if os.getenv("BLOCK_EVENTS", "").lower() in ("1", "true", "yes"):
+        on_loaded = lambda coin: start_block_feed(coin, on_block)
+    await warm_up(coins, on_loaded)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # Leave right away so the other workers take over, and keep the changes made since the last commit
+        await membership.stop()
+        await tx_store.commit()
+        await close_clients()
+
+
+if __name__ == "__main__":
+    # Start the monitor worker
+    asyncio.run(main())